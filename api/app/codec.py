@@ -0,0 +1,176 @@
+"""
+Compact binary codec for game states stored in Redis
+
+Games are stored as a Redis hash with one field per group of related attributes, so a handler only rewrites
+the groups it changed (e.g. a flag or clock update never touches the board). All groups are little endian:
+
+    meta        time_control (H), wager (I), round (B), n_rounds (B), finished (?)
+    clock       tr_white (i), tr_black (i), last_turn_timestamp (q)
+    players     string table: count (B), then each string as length (B) + UTF-8 bytes (sids and wallet
+                addresses are interned here and referenced by index below)
+                players: count (B), string indices (B each)
+                wallets: count (B), (sid index, address index) pairs
+                scores:  count (B), (sid index, score in half points (H)) pairs
+    board       FEN length (B) + FEN the moves were played from, move count (H), 16-bit move codes (H each)
+    version     state version as a plain integer string
+
+Move codes pack from_square (6 bits), to_square (6 bits) and promotion piece type (3 bits).
+
+Older states stored as a single JSON string are read by utils.deserialise_game_state.
+"""
+
+import struct
+from typing import Dict, Iterable, Tuple
+
+from chess import Board, Move
+
+_META = struct.Struct("<HIBB?")
+_CLOCK = struct.Struct("<iiq")
+_U8 = struct.Struct("<B")
+_U16 = struct.Struct("<H")
+
+# maps Game attributes to the hash field (group) they are stored in
+FIELD_GROUPS = {
+    "time_control": "meta",
+    "wager": "meta",
+    "round": "meta",
+    "n_rounds": "meta",
+    "finished": "meta",
+    "tr_white": "clock",
+    "tr_black": "clock",
+    "last_turn_timestamp": "clock",
+    "players": "players",
+    "player_wallet_addrs": "players",
+    "match_score": "players",
+    "board": "board",
+    "version": "version",
+}
+
+
+def encode_move(move: Move) -> int:
+    return move.from_square | (move.to_square << 6) | ((move.promotion or 0) << 12)
+
+
+def decode_move(code: int) -> Move:
+    return Move(code & 0x3F, (code >> 6) & 0x3F, (code >> 12) or None)
+
+
+def _encode_meta(game) -> bytes:
+    return _META.pack(game.time_control, game.wager, game.round, game.n_rounds, game.finished)
+
+
+def _encode_clock(game) -> bytes:
+    return _CLOCK.pack(game.tr_white, game.tr_black, game.last_turn_timestamp)
+
+
+def _encode_players(game) -> bytes:
+    strings: Dict[str, int] = {}
+
+    def intern(s: str) -> int:
+        if s not in strings:
+            strings[s] = len(strings)
+        return strings[s]
+
+    players = [intern(sid) for sid in game.players]
+    wallets = [(intern(sid), intern(addr)) for sid, addr in game.player_wallet_addrs.items()]
+    scores = [(intern(sid), int(score * 2)) for sid, score in game.match_score.items()]
+
+    parts = [_U8.pack(len(strings))]
+    for s in strings:
+        b = s.encode()
+        parts.append(_U8.pack(len(b)))
+        parts.append(b)
+    parts.append(struct.pack(f"<B{len(players)}B", len(players), *players))
+    parts.append(struct.pack(f"<B{2 * len(wallets)}B", len(wallets), *(i for pair in wallets for i in pair)))
+    parts.append(_U8.pack(len(scores)))
+    parts.extend(struct.pack("<BH", sid, score) for sid, score in scores)
+    return b"".join(parts)
+
+
+def _encode_board(game) -> bytes:
+    board: Board = game.board
+    fen = board.root().fen().encode()  # not always the standard start (e.g. a migrated legacy state)
+    moves = [encode_move(m) for m in board.move_stack]
+    return b"".join((_U8.pack(len(fen)), fen, struct.pack(f"<H{len(moves)}H", len(moves), *moves)))
+
+
+def _encode_version(game) -> bytes:
+    return str(game.version).encode()
+
+
+ENCODERS = {
+    "meta": _encode_meta,
+    "clock": _encode_clock,
+    "players": _encode_players,
+    "board": _encode_board,
+    "version": _encode_version,
+}
+
+
+def encode_fields(game, fields: Iterable[str] = None) -> Dict[str, bytes]:
+    """Encode the hash fields holding the given Game attributes (all of them by default)"""
+    groups = ENCODERS.keys() if fields is None else {FIELD_GROUPS[f] for f in fields}
+    return {group: ENCODERS[group](game) for group in groups}
+
+
+def _decode_players(data: bytes) -> dict:
+    n_strings = data[0]
+    offset = 1
+    strings = []
+    for _ in range(n_strings):
+        length = data[offset]
+        strings.append(bytes(data[offset + 1 : offset + 1 + length]).decode())
+        offset += 1 + length
+
+    n_players = data[offset]
+    players = [strings[i] for i in data[offset + 1 : offset + 1 + n_players]]
+    offset += 1 + n_players
+
+    n_wallets = data[offset]
+    offset += 1
+    wallets = {strings[data[offset + 2 * i]]: strings[data[offset + 2 * i + 1]] for i in range(n_wallets)}
+    offset += 2 * n_wallets
+
+    n_scores = data[offset]
+    offset += 1
+    match_score = {}
+    for _ in range(n_scores):
+        sid, score = struct.unpack_from("<BH", data, offset)
+        match_score[strings[sid]] = score / 2
+        offset += 3
+
+    return {"players": players, "player_wallet_addrs": wallets, "match_score": match_score}
+
+
+def _decode_board(data: bytes) -> Tuple[str, Tuple[int, ...]]:
+    fen_length = data[0]
+    fen = bytes(data[1 : 1 + fen_length]).decode()
+    offset = 1 + fen_length
+    (n_moves,) = _U16.unpack_from(data, offset)
+    return fen, struct.unpack_from(f"<{n_moves}H", data, offset + _U16.size)
+
+
+def decode_fields(state: Dict[bytes, bytes]) -> Tuple[dict, str, Tuple[int, ...]]:
+    """
+    Decode a game state hash
+
+    Returns the Game fields (without the board), the board FEN and the round's move codes (left packed so
+    they are only decoded if the board has to be rebuilt)
+    """
+    time_control, wager, round_, n_rounds, finished = _META.unpack(state[b"meta"])
+    tr_white, tr_black, last_turn_timestamp = _CLOCK.unpack(state[b"clock"])
+    fields = _decode_players(state[b"players"])
+    fields.update(
+        time_control=time_control,
+        wager=wager,
+        round=round_,
+        n_rounds=n_rounds,
+        finished=finished,
+        tr_white=tr_white,
+        tr_black=tr_black,
+        last_turn_timestamp=last_turn_timestamp,
+        version=int(state[b"version"]),
+    )
+    fen, moves = _decode_board(state[b"board"])
+    return fields, fen, moves
+
@@ -1,3 +1,4 @@
+import json
 import os
 
 from dotenv import load_dotenv
@@ -10,10 +11,38 @@ MILLISECONDS_PER_MINUTE = 60_000
 VALID_WAGER_RANGE = (1, 100)
 VALID_TIME_CONTROLS = {3, 5, 10, 30}
 VALID_N_ROUNDS_RANGE = (1, 10)
+VALID_ELO_RANGE = (0, 4000)
 
 
 MAX_EMIT_RETRIES = 5
+MAX_UPDATE_RETRIES = 5  # compare-and-set attempts before a concurrent game update is abandoned
 BROADCAST_KEY = "all"
+BATCH_EVENT = "batch"  # socket event carrying several game events, [[name, data], ...]
+GAMES_EXCHANGE = "games"  # topic exchange for all game events, routed by game.<gid>.<sid or BROADCAST_KEY>
+
+RMQ_CHANNEL_POOL_SIZE = 4  # channels used for topology and consumers per worker
+RMQ_MAX_PENDING_PUBLISHES = 1000  # unconfirmed publishes before publishers are made to wait
+RMQ_MAX_PUBLISH_ATTEMPTS = 5  # attempts at a publish (nacked, or its confirm lost e.g. to a reconnect) before it is dropped
+RMQ_PUBLISH_RETRY_DELAY = 1  # seconds before failed publishes are put back on the batch
+
+PLAYER_TTL = 120  # seconds a player -> game record survives without being refreshed by its worker
+REGISTRY_CACHE_SIZE = 10_000  # max player -> game records cached per worker
+REGISTRY_CACHE_TTL = 5  # seconds a cached player -> game record is trusted
+
+EXCHANGE_RATE_TTL = 60  # seconds an exchange rate is served before it is refetched
+EXCHANGE_RATE_STALE_TTL = 24 * 60 * 60  # seconds the last good rate is kept for when CoinMarketCap fails
+EXCHANGE_TIMEOUT = 5  # seconds allowed for a CoinMarketCap request
+EXCHANGE_LOCK_TTL = 10  # seconds one worker holds the right to refetch a rate (others wait for its result)
+SUPPORTED_FIATS = ("GBP", "USD", "EUR")  # rates prefetched together and served by the bulk exchange endpoint
+EXCHANGE_REFRESH_INTERVAL = EXCHANGE_RATE_TTL // 2  # seconds between prefetches of all supported fiats (any worker)
+ODDS_CACHE_SIZE = 10_000  # cached (elo difference, average elo, n) match odds
+ELO_ROUNDING = 5  # ratings are rounded to a multiple of this for odds caching
+ODDS_TABLE_PATH = os.environ.get("ODDS_TABLE_PATH", "odds_table.npy")  # precomputed odds (built on startup if missing)
+ODDS_TABLE_AVE = (0, 4000, 50)  # (min, max, step) of the average rating axis of the odds table
+ODDS_TABLE_DIFF = (-1000, 1000, 5)  # (min, max, step) of the rating difference axis (larger gaps are computed)
+POSITION_CACHE_SIZE = 10_000  # max boards held in memory per worker
+
+GAME_TTL = 3 * 60 * 60  # seconds of inactivity before a game (and its admission slot) expires
 
 REDIS_URL = os.environ.get("REDIS_URL")
 ALCHEMY_API_URL = os.environ.get("ALCHEMY_API_URL")
@@ -24,5 +53,48 @@ WALLET_PK = os.environ.get("WALLET_PK")
 
 CMC_API_KEY = os.environ.get("CMC_API_KEY")
 
+# how game events reach sockets held by other workers: "mq" (own RabbitMQ fan-out), "sio-redis" or "sio-amqp"
+# (Socket.IO client manager)
+EVENT_DELIVERY = os.environ.get("EVENT_DELIVERY", "mq")
+
+DEADLINE_SWEEP_INTERVAL = 5  # seconds between checks for overdue deadlines armed by other (e.g. dead) workers
+DEADLINE_SWEEP_GRACE = 1_000  # ms a deadline must be overdue before another worker's sweep fires it
+ROUND_INTERVAL = 15  # seconds between the end of a round and the start of the next
+SETTLEMENT_POLL_INTERVAL = 2  # seconds between checks for due settlements
+SETTLEMENT_BATCH_SIZE = 10  # max settlements claimed per check
+SETTLEMENT_MAX_IN_FLIGHT = 200  # max settlements a worker has in progress (mostly waiting for receipts)
+SETTLEMENT_RECEIPT_TIMEOUT = 240  # seconds to wait for a settlement transaction to be mined
+SETTLEMENT_LEASE = 300  # seconds a claimed settlement is reserved for its worker (must exceed the receipt timeout)
+SETTLEMENT_BACKOFF = (5, 600)  # min/max seconds between settlement attempts (doubles per failed attempt)
+SETTLEMENT_MAX_ATTEMPTS = 20
+SETTLEMENT_RECORD_TTL = 7 * 24 * 60 * 60  # seconds a completed settlement is remembered (idempotency)
+CONTRACT_BATCH_WINDOW = float(os.environ.get("CONTRACT_BATCH_WINDOW", 0.5))  # seconds results are collected per batch
+CONTRACT_BATCH_SIZE = int(os.environ.get("CONTRACT_BATCH_SIZE", 20))  # max results declared per transaction
+GAS_PRICE_BUMP = 1.25  # multiplier applied to the gas price of a stuck transaction when replacing it (min 1.1)
+MAX_GAS_PRICE = int(os.environ.get("MAX_GAS_PRICE", 1_000 * 10**9))  # wei, replacements never bid above this
+
 CONCURRENT_GAME_LIMIT = int(os.environ.get("CONCURRENT_GAME_LIMIT"))
-BUCKET_CAPACITY = int(os.environ.get("BUCKET_CAPACITY"))
+BUCKET_CAPACITY = int(os.environ.get("BUCKET_CAPACITY"))  # connections allowed in a burst (all clients, all workers)
+BUCKET_REFILL_RATE = float(os.environ.get("BUCKET_REFILL_RATE", 10 / 60))  # connection tokens per second (all clients)
+IP_BUCKET_CAPACITY = int(os.environ.get("IP_BUCKET_CAPACITY", 10))  # connections allowed in a burst per client IP
+IP_BUCKET_REFILL_RATE = float(os.environ.get("IP_BUCKET_REFILL_RATE", 2 / 60))  # connection tokens per second per IP
+
+# per client socket event budgets: (burst, tokens per second), overridable with a JSON object in EVENT_RATE_LIMITS
+DEFAULT_EVENT_RATE_LIMIT = (10, 1.0)  # events without their own budget
+EVENT_RATE_LIMITS = {
+    "create": (3, 0.1),
+    "cancel": (3, 0.1),
+    "getGameDetails": (10, 1.0),
+    "acceptGame": (3, 0.1),
+    "move": (10, 2.0),
+    "resync": (3, 0.2),
+    "offerDraw": (3, 0.05),
+    "acceptDraw": (3, 0.1),
+    "resign": (3, 0.1),
+    "flag": (5, 1.0),
+    "offerRematch": (3, 0.05),
+    "acceptRematch": (3, 0.1),
+    "exit": (3, 0.1),
+    **json.loads(os.environ.get("EVENT_RATE_LIMITS", "{}")),
+}
+STATS_FLUSH_INTERVAL = 10  # seconds between flushes of per-worker counters to Redis
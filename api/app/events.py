@@ -0,0 +1,132 @@
+import asyncio
+import json
+import os
+from abc import ABC, abstractmethod
+from logging import Logger
+from typing import List
+
+import app.utils as utils
+from app.constants import BATCH_EVENT, BROADCAST_KEY, GAMES_EXCHANGE, MAX_EMIT_RETRIES
+from app.game_registry import GameRegistry
+from app.metrics import timed
+from app.models import Event
+from app.rmq import RMQConnectionManager
+from socketio.asyncio_server import AsyncServer
+
+
+class EventBus(ABC):
+    """Delivers game events to the players of a game, wherever (i.e. on whichever worker) they are connected"""
+
+    def __init__(self, sio: AsyncServer, logger: Logger):
+        self.sio = sio
+        self.logger = logger
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def publish(self, gid: str, event: Event, rk=BROADCAST_KEY):
+        """Send an event to one player of a game (rk = sid) or all of them (rk = BROADCAST_KEY)"""
+        await self.publish_many(gid, [event], rk)
+
+    @abstractmethod
+    async def publish_many(self, gid: str, events: List[Event], rk=BROADCAST_KEY):
+        """Send events to one player of a game (rk = sid) or all of them as one message, delivered in order"""
+
+    @staticmethod
+    def batch(events: List[Event]):
+        """Single event to emit for a list of events (clients unpack BATCH_EVENT into its events)"""
+        if len(events) == 1:
+            return events[0]
+        return Event(BATCH_EVENT, [[event.name, event.data] for event in events])
+
+    async def add_listener(self, gid: str, sid: str):
+        """Start delivering a game's events to a player connected to this worker"""
+        pass
+
+    async def remove_listener(self, gid: str, sid: str):
+        """Stop delivering a game's events to a player connected to this worker"""
+        pass
+
+    def _emit(self, event: Event, to: str, attempts=1):
+        task = asyncio.create_task(self.sio.emit(event.name, event.data, to=to))
+        task.add_done_callback(lambda t: self._on_emit_done(t, event, to, attempts))
+
+    def _on_emit_done(self, task, event, to, attempts):
+        try:
+            task.result()  #  raises exception if task failed
+        except Exception as e:
+            if attempts < MAX_EMIT_RETRIES:
+                self.logger.error(f"Emit event failed with exception: {e}, retrying...")
+                self._emit(event, to, attempts + 1)
+            else:
+                self.logger.error(f"Emit event failed {MAX_EMIT_RETRIES} times, giving up")
+
+
+class MQEventBus(EventBus):
+    """
+    Fans game events out through RabbitMQ
+
+    Events are published to one topic exchange with routing keys game.<gid>.<sid or BROADCAST_KEY>. Each worker
+    consumes from its own exclusive queue, bound to the keys of the players connected to it, and emits received
+    events to the matching local sockets.
+    """
+
+    def __init__(self, rmq: RMQConnectionManager, sio: AsyncServer, gr: GameRegistry, logger: Logger):
+        super().__init__(sio, logger)
+        self.rmq = rmq
+        self.gr = gr
+        self.worker_queue = None
+
+    async def start(self):
+        """Connect, declare this worker's (exclusive) queue on the games exchange and start consuming from it"""
+        await self.rmq.connect()
+        self.worker_queue = utils.get_worker_queue_name()
+        await self.rmq.declare_exchange(GAMES_EXCHANGE)
+        await self.rmq.declare_queue(self.worker_queue, exclusive=True, auto_delete=True)
+        await self.rmq.consume(self.worker_queue, self._on_message)
+        self.logger.info("Initialised listener " + self.worker_queue)
+
+    async def close(self):
+        await self.rmq.close()
+
+    @timed("mq_publish")
+    async def publish_many(self, gid: str, events: List[Event], rk=BROADCAST_KEY):
+        body = json.dumps([event.__dict__ for event in events]).encode()
+        await self.rmq.publish(GAMES_EXCHANGE, utils.get_routing_key(gid, rk), body)
+
+    def _on_message(self, routing_key, body):
+        """Demultiplex events from the worker queue to the game's players connected to this worker"""
+        gid, rk = utils.parse_routing_key(routing_key)
+        event = self.batch([Event(**e) for e in json.loads(body)])
+        local_sids = self.gr.get_game_sids(gid)
+        recipients = list(local_sids) if rk == BROADCAST_KEY else [sid for sid in (rk,) if sid in local_sids]
+        for sid in recipients:
+            self._emit(event, sid)
+
+    async def add_listener(self, gid: str, sid: str):
+        """Route a player's game events to this worker (player must already be in the game registry)"""
+        self.logger.info("Adding listener for game " + gid + ", user " + sid + ", on worker ID " + str(os.getpid()))
+        await self.rmq.bind_queue(self.worker_queue, GAMES_EXCHANGE, utils.get_routing_key(gid, sid))
+        if len(self.gr.get_game_sids(gid)) == 1:  # first player of this game on this worker
+            await self.rmq.bind_queue(self.worker_queue, GAMES_EXCHANGE, utils.get_routing_key(gid, BROADCAST_KEY))
+
+    async def remove_listener(self, gid: str, sid: str):
+        """Stop routing a player's game events to this worker (player must already be removed from the game registry)"""
+        await self.rmq.unbind_queue(self.worker_queue, GAMES_EXCHANGE, utils.get_routing_key(gid, sid))
+        if not self.gr.get_game_sids(gid):  # no players of this game left on this worker
+            await self.rmq.unbind_queue(self.worker_queue, GAMES_EXCHANGE, utils.get_routing_key(gid, BROADCAST_KEY))
+
+
+class SIOEventBus(EventBus):
+    """
+    Emits game events directly to the game's Socket.IO room (or a player's sid)
+
+    Relies on the server's client manager (AsyncRedisManager / AsyncAioPikaManager) to fan emits out to the
+    sockets held by other workers, so no listeners need to be managed here.
+    """
+
+    async def publish_many(self, gid: str, events: List[Event], rk=BROADCAST_KEY):
+        self._emit(self.batch(events), gid if rk == BROADCAST_KEY else rk)
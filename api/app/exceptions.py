@@ -1,4 +1,6 @@
-import app.utils as utils
+import time
+
+from app.metrics import EVENT_DROPPED, EVENT_ERRORS, EVENT_SECONDS
 from app.models import Event
 
 
@@ -16,22 +18,53 @@ class CustomException(Exception):
 
 
 class SocketIOExceptionHandler:
-    def __init__(self, sio, rmq, logger):
+    def __init__(self, sio, events, logger, limiter=None):
         self.sio = sio
-        self.rmq = rmq
+        self.events = events
         self.logger = logger
+        self.limiter = limiter  # EventRateLimiter applied to handlers registered with on
 
-    def sio_exception_handler(self, handler):
-        """Produces a wrapper that goes around SIO event handlers"""
+    def sio_exception_handler(self, handler, event=None):
+        """Produces a wrapper that goes around SIO event handlers (timing them and counting errors if event given)"""
 
         async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
             try:
                 return await handler(*args, **kwargs)
             except CustomException as exc:
+                if event:
+                    EVENT_ERRORS.inc(event=event)
                 self.logger.error(f"Exception caught in {handler.__name__}: {exc}")
                 if exc.emit_local:  # emit to single recipient on local SIO server
                     await self.sio.emit("error", exc.message, to=exc.sid)
                 else:  # emit to every player in game
-                    utils.publish_event(self.rmq.channel, exc.gid, Event("error", exc.message))
+                    await self.events.publish(exc.gid, Event("error", exc.message))
+            except Exception:
+                if event:
+                    EVENT_ERRORS.inc(event=event)
+                raise
+            finally:
+                if event:
+                    EVENT_SECONDS.observe(time.perf_counter() - start, event=event)
 
         return wrapper
+
+    def on(self, event):
+        """
+        Registers a SIO event handler, wrapped in sio_exception_handler (instrumented) and rate limited per sid (if
+        limiter given)
+        """
+
+        def decorator(handler):
+            wrapper = self.sio_exception_handler(handler, event)
+
+            async def limited(sid, *args):
+                if self.limiter and not self.limiter.allow(sid, event):
+                    EVENT_DROPPED.inc(event=event)
+                    return  # flood, dropped before any game work
+                return await wrapper(sid, *args)
+
+            self.sio.on(event, limited)
+            return handler
+
+        return decorator
@@ -1,42 +1,210 @@
+import asyncio
+import json
+import uuid
+from logging import Logger
+from typing import Dict, Iterable
+
 import aiohttp
-from app.constants import CMC_API_KEY
+import app.utils as utils
+from aioredis.client import Redis
+from app.constants import (
+    CMC_API_KEY,
+    EXCHANGE_LOCK_TTL,
+    EXCHANGE_RATE_STALE_TTL,
+    EXCHANGE_RATE_TTL,
+    EXCHANGE_REFRESH_INTERVAL,
+    EXCHANGE_TIMEOUT,
+    SUPPORTED_FIATS,
+)
 from fastapi import APIRouter, HTTPException
-from starlette.status import HTTP_500_INTERNAL_SERVER_ERROR
+from starlette.status import HTTP_400_BAD_REQUEST, HTTP_500_INTERNAL_SERVER_ERROR
 
-router = APIRouter(prefix="/exchange", tags=["exchange"])
+CMC_QUOTES_URL = "https://pro-api.coinmarketcap.com/v2/cryptocurrency/quotes/latest"
 
 
-@router.get("/{fiat}")
-async def get_exchange_rate(fiat: str):
+class ExchangeRates:
     """
-    Fetch the current exchange rate of POL to fiat from CoinMarketCap API
+    POL to fiat exchange rates from CoinMarketCap, cached in Redis for all workers
+
+    Rates are refetched once older than EXCHANGE_RATE_TTL. Concurrent misses are coalesced: within a worker they share
+    one in-flight fetch, and across workers only the holder of a short Redis lock fetches while the others wait for
+    its result. If CoinMarketCap fails, the last good rate is served (for up to EXCHANGE_RATE_STALE_TTL).
 
-    Returns:
-        dict: The exchange rate
+    A background refresher fetches all SUPPORTED_FIATS in one upstream call every EXCHANGE_REFRESH_INTERVAL (on
+    whichever worker claims the interval), so their rates are always cached and upstream traffic does not grow with
+    the number of users.
     """
-    FIAT = fiat.upper()
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                "https://pro-api.coinmarketcap.com/v2/cryptocurrency/quotes/latest",
-                params={"symbol": "POL", "convert": FIAT},
-                headers={
-                    "X-CMC_PRO_API_KEY": CMC_API_KEY,
-                    "Accept-Encoding": "deflate, gzip",
-                    "Accept": "application/json",
-                },
-            ) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    exchange_rate = data["data"]["POL"][0]["quote"][FIAT]["price"]
-                    return {"exchange_rate": exchange_rate}
-                else:
-                    raise HTTPException(
-                        status_code=response.status,
-                        detail="Error fetching exchange rate from CoinMarketCap API",
-                    )
-    except Exception:
-        raise HTTPException(
-            status_code=HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="An error occurred while fetching the exchange rate",
+
+    LOCK_POLL_INTERVAL = 0.05  # seconds
+
+    # deletes a lock only if it still holds the caller's token (i.e. it has not expired and been taken by another worker)
+    RELEASE_LOCK_SCRIPT = """
+    if redis.call("GET", KEYS[1]) == ARGV[1] then
+        return redis.call("DEL", KEYS[1])
+    end
+    return 0
+    """
+
+    def __init__(self, redis_client: Redis, logger: Logger, url: str = CMC_QUOTES_URL):
+        self.redis_client = redis_client
+        self.release_lock_script = redis_client.register_script(self.RELEASE_LOCK_SCRIPT)
+        self.logger = logger
+        self.url = url
+        self.session: aiohttp.ClientSession = None
+        self.inflight: Dict[str, asyncio.Task] = {}
+        self.refresher = None
+
+    async def start(self):
+        """Open the shared (connection pooling) HTTP session and start prefetching the supported fiats"""
+        self.session = aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=EXCHANGE_TIMEOUT),
+            headers={
+                "X-CMC_PRO_API_KEY": CMC_API_KEY,
+                "Accept-Encoding": "deflate, gzip",
+                "Accept": "application/json",
+            },
         )
+        self.refresher = asyncio.create_task(self.refresh_supported())
+
+    async def close(self):
+        if self.refresher:
+            self.refresher.cancel()
+        if self.session:
+            await self.session.close()
+
+    async def _get_cached(self, fiat):
+        """Cached (rate, fetched at ms) or None"""
+        cached = await self.redis_client.get(utils.get_redis_exchange_rate_key(fiat))
+        if cached is None:
+            return None
+        cached = json.loads(cached)
+        return cached["rate"], cached["fetchedAt"]
+
+    def _is_fresh(self, cached):
+        return cached is not None and utils.get_time_now_ms() - cached[1] < EXCHANGE_RATE_TTL * 1000
+
+    async def _fetch_many(self, fiats: Iterable[str]):
+        """Rates of POL to several fiats in one CoinMarketCap request"""
+        async with self.session.get(self.url, params={"symbol": "POL", "convert": ",".join(fiats)}) as response:
+            if response.status != 200:
+                raise RuntimeError(f"CoinMarketCap responded with status {response.status}")
+            data = await response.json()
+        quote = data["data"]["POL"][0]["quote"]
+        return {fiat: quote[fiat]["price"] for fiat in fiats}
+
+    async def _fetch(self, fiat):
+        return (await self._fetch_many([fiat]))[fiat]
+
+    async def _store(self, rates: Dict[str, float]):
+        fetched_at = utils.get_time_now_ms()
+        async with self.redis_client.pipeline(transaction=False) as pipe:
+            for fiat, rate in rates.items():
+                cached = json.dumps({"rate": rate, "fetchedAt": fetched_at})
+                pipe.set(utils.get_redis_exchange_rate_key(fiat), cached, ex=EXCHANGE_RATE_STALE_TTL)
+            await pipe.execute()
+
+    async def _refresh(self, fiat, stale):
+        """Fetch a rate from CoinMarketCap (or wait for another worker to), falling back to the stale rate"""
+        lock_key = utils.get_redis_exchange_rate_lock_key(fiat)
+        token = uuid.uuid4().hex
+        if not await self.redis_client.set(lock_key, token, nx=True, ex=EXCHANGE_LOCK_TTL):
+            # another worker is fetching it
+            token = None
+            for _ in range(int(EXCHANGE_TIMEOUT / self.LOCK_POLL_INTERVAL)):
+                await asyncio.sleep(self.LOCK_POLL_INTERVAL)
+                cached = await self._get_cached(fiat)
+                if self._is_fresh(cached):
+                    return cached[0]
+                if not await self.redis_client.exists(lock_key):  # fetch finished (or failed) without a new rate
+                    break
+            if stale is not None:
+                return stale[0]
+            # nothing to fall back on - fetch it here, leaving the lock to its holder
+
+        try:
+            try:
+                rate = await self._fetch(fiat)
+            except Exception as exc:
+                if stale is None:
+                    raise
+                self.logger.warning(f"Fetching {fiat} exchange rate failed ({exc}), serving last good rate")
+                return stale[0]
+            await self._store({fiat: rate})  # before releasing the lock, so waiting workers find the new rate
+        finally:
+            if token is not None:
+                await self.release_lock_script(keys=[lock_key], args=[token])
+        return rate
+
+    async def get_rate(self, fiat: str):
+        """Exchange rate of POL to fiat"""
+        cached = await self._get_cached(fiat)
+        if self._is_fresh(cached):
+            return cached[0]
+
+        task = self.inflight.get(fiat)
+        if task is None:
+            task = asyncio.create_task(self._refresh(fiat, cached))
+            self.inflight[fiat] = task
+            task.add_done_callback(lambda _: self.inflight.pop(fiat, None))
+        return await asyncio.shield(task)  # a cancelled request doesn't cancel the fetch others are waiting on
+
+    async def get_rates(self):
+        """Exchange rates of POL to all supported fiats"""
+        # served from the cache the refresher keeps warm; falls back to fetching if it is behind (e.g. just started)
+        rates = await asyncio.gather(*(self.get_rate(fiat) for fiat in SUPPORTED_FIATS))
+        return dict(zip(SUPPORTED_FIATS, rates))
+
+    async def refresh_supported(self):
+        """Prefetch all supported fiats in one request per interval, shared by all workers"""
+        lock_key = utils.get_redis_exchange_rate_lock_key(",".join(SUPPORTED_FIATS))
+        while True:
+            try:
+                # the lock is left to expire, so at most one worker refreshes per interval
+                if await self.redis_client.set(lock_key, 1, nx=True, ex=EXCHANGE_REFRESH_INTERVAL):
+                    await self._store(await self._fetch_many(SUPPORTED_FIATS))
+            except Exception as exc:
+                self.logger.error(f"Prefetching exchange rates failed: {exc}")
+            await asyncio.sleep(EXCHANGE_REFRESH_INTERVAL)
+
+
+def build_exchange_router(rates: ExchangeRates):
+    router = APIRouter(prefix="/exchange", tags=["exchange"])
+
+    async def get_exchange_rate(fiat: str):
+        """
+        Fetch the current exchange rate of POL to fiat (cached from CoinMarketCap API)
+
+        Returns:
+            dict: The exchange rate
+        """
+        fiat = fiat.upper()
+        if fiat not in SUPPORTED_FIATS:
+            raise HTTPException(status_code=HTTP_400_BAD_REQUEST, detail=f"Fiat must be one of {', '.join(SUPPORTED_FIATS)}")
+        try:
+            return {"exchange_rate": await rates.get_rate(fiat)}
+        except Exception as exc:
+            rates.logger.error(f"Error fetching exchange rate: {exc}")
+            raise HTTPException(
+                status_code=HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="An error occurred while fetching the exchange rate",
+            )
+
+    async def get_exchange_rates():
+        """
+        Fetch the current exchange rates of POL to all supported fiats (cached from CoinMarketCap API)
+
+        Returns:
+            dict: The exchange rates by fiat
+        """
+        try:
+            return {"exchange_rates": await rates.get_rates()}
+        except Exception as exc:
+            rates.logger.error(f"Error fetching exchange rates: {exc}")
+            raise HTTPException(
+                status_code=HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="An error occurred while fetching the exchange rates",
+            )
+
+    router.add_api_route("", get_exchange_rates)
+    router.add_api_route("/{fiat}", get_exchange_rate)
+    return router
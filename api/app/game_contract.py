@@ -1,60 +1,175 @@
+import asyncio
 from logging import Logger
 
+import app.utils as utils
+from aioredis.client import Redis
 from app.abi import abi
-from app.constants import SC_ADDRESS, WALLET_PK
+from app.constants import CONTRACT_BATCH_SIZE, CONTRACT_BATCH_WINDOW, SC_ADDRESS, WALLET_PK
+from app.metrics import timed
+from app.models import SentTx
+from app.nonce import NonceManager
 from eth_utils import encode_hex
 from web3 import AsyncWeb3
+from web3.constants import ADDRESS_ZERO
+from web3.exceptions import TransactionNotFound
+from web3.logs import DISCARD
 
 
 class GameContract:
-    """Wrapper around smart contract functions declareWinner and declareDraw"""
+    """
+    Wrapper around smart contract functions cancelGame and declareResults
+
+    Transactions are sent without waiting to be mined (see wait_for_receipt), with nonces from the shared NonceManager.
+    Match results are batched into one declareResults transaction (see declare_result).
+    """
 
     GAS_LIMIT = 1_000_000
+    BATCH_GAS_PER_RESULT = 150_000  # gas limit of declareResults is this per game (+ GAS_LIMIT overhead)
+    NONCE_RETRIES = 3
+    # node errors meaning the nonce has already been used (by a mined or pending transaction)
+    NONCE_ERRORS = ("nonce too low", "already known", "replacement transaction underpriced", "nonce has already been used")
 
-    def __init__(self, w3: AsyncWeb3, logger: Logger):
+    def __init__(self, w3: AsyncWeb3, redis_client: Redis, logger: Logger):
         self.w3 = w3
         self.contract = w3.eth.contract(address=SC_ADDRESS, abi=abi)
         self.acct = w3.eth.account.from_key(WALLET_PK)
+        self.nonces = NonceManager(redis_client, w3, self.acct.address, logger)
         self.logger = logger
+        self.pending_results = []  # (gid, winner address, future) waiting to be declared in the next batch
+        self.batch_flusher = None
 
-    async def _sign_and_send_tx(self, tx):
-        signed_tx = self.w3.eth.account.sign_transaction(tx, private_key=self.acct.key)
-        tx_hash = await self.w3.eth.send_raw_transaction(signed_tx.rawTransaction)
-        await self.w3.eth.wait_for_transaction_receipt(tx_hash)
-        return tx_hash
-    
-    async def cancel_game(self, gid: str):
-        """Cancel game and cash out before it has started"""
-        tx = await self.contract.functions.cancelGame(gid).build_transaction(
+    async def _sign_tx(self, fn, nonce: int, gas_price: int, gas: int):
+        tx = await fn.build_transaction(
             {
                 "from": self.acct.address,
-                "gas": self.GAS_LIMIT,
-                "nonce": await self.w3.eth.get_transaction_count(self.acct.address),
+                "gas": gas,
+                "gasPrice": gas_price,
+                "nonce": nonce,
             }
         )
-        tx_hash = await self._sign_and_send_tx(tx)
-        self.logger.info(f"Game {gid} cancelled by creator. Transaction hash: {encode_hex(tx_hash)}")
+        return self.w3.eth.account.sign_transaction(tx, private_key=self.acct.key).rawTransaction
 
-    async def declare_winner(self, gid: str, winner_addr: str):
-        """Declare winner of game"""
-        tx = await self.contract.functions.declareWinner(gid, winner_addr).build_transaction(
-            {
-                "from": self.acct.address,
-                "gas": self.GAS_LIMIT,
-                "nonce": await self.w3.eth.get_transaction_count(self.acct.address),
-            }
-        )
-        tx_hash = await self._sign_and_send_tx(tx)
-        self.logger.info(f"Winner declared in game {gid}. Transaction hash: {encode_hex(tx_hash)}")
+    @timed("chain_send")
+    async def send(self, fn, nonce: int = None, gas_price: int = None, gas: int = GAS_LIMIT) -> SentTx:
+        """
+        Sign and send a contract function call without waiting for it to be mined
 
-    async def declare_draw(self, gid: str):
-        """Declare draw in game"""
-        tx = await self.contract.functions.declareDraw(gid).build_transaction(
-            {
-                "from": self.acct.address,
-                "gas": self.GAS_LIMIT,
-                "nonce": await self.w3.eth.get_transaction_count(self.acct.address),
-            }
-        )
-        tx_hash = await self._sign_and_send_tx(tx)
-        self.logger.info(f"Draw declared in game {gid}. Transaction hash: {encode_hex(tx_hash)}")
+        :param fn: contract function call
+        :param nonce: nonce of a pending transaction to replace, a new nonce is allocated if not given
+        :param gas_price: gas price (wei), defaults to the node's current gas price
+        :param gas: gas limit
+        """
+        if gas_price is None:
+            gas_price = await self.w3.eth.gas_price
+
+        if nonce is not None:  # replacement, must keep the nonce
+            tx_hash = await self.w3.eth.send_raw_transaction(await self._sign_tx(fn, nonce, gas_price, gas))
+            return SentTx(encode_hex(tx_hash), nonce, gas_price)
+
+        for attempt in range(self.NONCE_RETRIES):
+            nonce = await self.nonces.allocate()
+            try:
+                raw_tx = await self._sign_tx(fn, nonce, gas_price, gas)
+            except Exception:
+                # never broadcast, and a gap left by an unused nonce would stall every later transaction
+                await self.nonces.release(nonce)
+                raise
+            try:
+                tx_hash = await self.w3.eth.send_raw_transaction(raw_tx)
+                return SentTx(encode_hex(tx_hash), nonce, gas_price)
+            except Exception as exc:
+                if self.is_nonce_error(exc):
+                    if attempt == self.NONCE_RETRIES - 1:
+                        raise
+                    # counter is behind the chain (e.g. transactions sent from elsewhere) - catch up and try again
+                    self.logger.warning(f"Nonce {nonce} already used, resyncing: {exc}")
+                    await self.nonces.sync()
+                    continue
+                if self.is_rejection(exc):  # the node refused it, so the nonce was never used
+                    await self.nonces.release(nonce)
+                else:
+                    # e.g. a timeout or dropped connection - the node may have accepted it, and handing its nonce out
+                    # again could replace it, so keep it and catch up with whatever the chain has
+                    self.logger.warning(f"Transaction with nonce {nonce} may have been sent, resyncing: {exc}")
+                    await self.nonces.sync()
+                raise
+
+    def is_nonce_error(self, exc: Exception):
+        """Whether a send failed because its nonce has already been used"""
+        return any(err in str(exc).lower() for err in self.NONCE_ERRORS)
+
+    def is_rejection(self, exc: Exception):
+        """Whether a send failed with an error response from the node, i.e. the transaction was not accepted"""
+        return isinstance(exc, ValueError)  # web3 raises JSON-RPC error responses as ValueError
+
+    def failure_reason(self, receipt, gid: str):
+        """Why a mined transaction did not settle a game, or None if it did"""
+        if receipt["status"] != 1:
+            return "transaction reverted"
+        for log in self.contract.events.ResultFailed().process_receipt(receipt, errors=DISCARD):
+            if log["args"]["gid"] == utils.gid_to_bytes(gid):
+                return log["args"]["reason"] or "settlement reverted"
+        return None
+
+    @timed("chain_receipt")
+    async def get_receipt(self, tx_hash):
+        """Receipt of a mined transaction, or None if it is pending or unknown"""
+        try:
+            return await self.w3.eth.get_transaction_receipt(tx_hash)
+        except TransactionNotFound:
+            return None
+
+    async def wait_for_receipt(self, tx_hash, timeout: float):
+        """Wait for a transaction to be mined, returns its receipt (raises web3.exceptions.TimeExhausted on timeout)"""
+        return await self.w3.eth.wait_for_transaction_receipt(tx_hash, timeout=timeout)
+
+    async def cancel_game(self, gid: str, nonce: int = None, gas_price: int = None):
+        """Cancel game and cash out before it has started"""
+        tx = await self.send(self.contract.functions.cancelGame(utils.gid_to_bytes(gid)), nonce, gas_price)
+        tx.gids = (gid,)
+        return tx
+
+    async def declare_result(self, gid: str, winner_addr: str = None):
+        """
+        Declare the result of a game (draw if no winner), batched with other results
+
+        :returns: the (batch) transaction the result was declared in
+        """
+        winner_addr = winner_addr or ADDRESS_ZERO
+        future = asyncio.get_running_loop().create_future()
+        self.pending_results.append((gid, winner_addr, future))
+        if len(self.pending_results) >= CONTRACT_BATCH_SIZE:
+            self._flush_results()
+        elif self.batch_flusher is None:
+            self.batch_flusher = asyncio.get_running_loop().call_later(CONTRACT_BATCH_WINDOW, self._flush_results)
+        return await future
+
+    def _flush_results(self):
+        if self.batch_flusher is not None:
+            self.batch_flusher.cancel()
+            self.batch_flusher = None
+        batch, self.pending_results = self.pending_results, []
+        if batch:
+            asyncio.create_task(self._send_batch(batch))
+
+    async def _send_batch(self, batch):
+        gids, winners, futures = zip(*batch)
+        try:
+            tx = await self._declare_results(list(gids), list(winners))
+        except Exception as exc:
+            for future in futures:
+                future.set_exception(exc)
+            return
+        self.logger.info(f"Declared results of {len(gids)} games. Transaction hash: {tx.tx_hash}")
+        for future in futures:
+            future.set_result(tx)
+
+    async def replace_results(self, gids, winners, nonce: int, gas_price: int):
+        """Resend a whole batch of results with the nonce (and a higher gas price) of its pending transaction"""
+        return await self._declare_results(gids, winners, nonce, gas_price)
+
+    async def _declare_results(self, gids, winners, nonce=None, gas_price=None):
+        fn = self.contract.functions.declareResults([utils.gid_to_bytes(gid) for gid in gids], winners)
+        tx = await self.send(fn, nonce, gas_price, self.GAS_LIMIT + self.BATCH_GAS_PER_RESULT * len(gids))
+        tx.gids, tx.winners = tuple(gids), tuple(winners)
+        return tx
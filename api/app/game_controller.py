@@ -1,6 +1,4 @@
-import asyncio
-import json
-import os
+import inspect
 import random
 import uuid
 from logging import Logger
@@ -8,79 +6,170 @@ from logging import Logger
 import aioredis
 import app.utils as utils
 from aioredis.client import Redis
-from app.constants import BROADCAST_KEY, CONCURRENT_GAME_LIMIT, MAX_EMIT_RETRIES, MILLISECONDS_PER_MINUTE, VALID_N_ROUNDS_RANGE, VALID_TIME_CONTROLS, VALID_WAGER_RANGE
+from app import codec
+from app.constants import CONCURRENT_GAME_LIMIT, GAME_TTL, MAX_UPDATE_RETRIES, MILLISECONDS_PER_MINUTE, ROUND_INTERVAL, VALID_N_ROUNDS_RANGE, VALID_TIME_CONTROLS, VALID_WAGER_RANGE
 from app.exceptions import CustomException
-from app.game_contract import GameContract
+from app.events import EventBus
 from app.game_registry import GameRegistry
-from app.models import Colour, Event, Game, Outcome
-from app.rmq import RMQConnectionManager
+from app.metrics import timed
+from app.models import Colour, Event, Game, Outcome, Settlement
+from app.position_cache import PositionCache
+from app.scheduler import DeadlineScheduler
+from app.settlement import SettlementQueue
 from chess import Board
+from eth_utils import is_address
 from socketio.asyncio_server import AsyncServer
 
 
 class GameController:
 
-    def __init__(self, rmq: RMQConnectionManager, redis_client: Redis, sio: AsyncServer, gr: GameRegistry, contract: GameContract, logger: Logger):
-        self.rmq = rmq
+    # Live games are tracked in a sorted set of gid -> lease expiry (ms). Expired leases (games whose key
+    # expired or whose worker died) are evicted before counting, so admission is atomic across workers.
+    RESERVE_GAME_SLOT_SCRIPT = """
+    redis.call("ZREMRANGEBYSCORE", KEYS[1], "-inf", ARGV[1])
+    if redis.call("ZCARD", KEYS[1]) >= tonumber(ARGV[2]) then
+        return 0
+    end
+    redis.call("ZADD", KEYS[1], ARGV[3], ARGV[4])
+    return 1
+    """
+
+    # Compare-and-set save: only writes the changed fields if the stored version is still the one that was read.
+    # Legacy single blob states carry no version field and are replaced outright.
+    SAVE_GAME_SCRIPT = """
+    local key_type = redis.call("TYPE", KEYS[1]).ok
+    if key_type == "hash" then
+        if redis.call("HGET", KEYS[1], "version") ~= ARGV[1] then
+            return 0
+        end
+    elseif key_type == "none" and ARGV[1] ~= "0" then
+        return 0
+    end
+    if ARGV[5] == "1" then
+        redis.call("DEL", KEYS[1])
+    end
+    redis.call("HSET", KEYS[1], unpack(ARGV, 6))
+    redis.call("EXPIRE", KEYS[1], ARGV[2])
+    redis.call("ZADD", KEYS[2], "XX", ARGV[3], ARGV[4])
+    return 1
+    """
+
+    def __init__(self, events: EventBus, redis_client: Redis, sio: AsyncServer, gr: GameRegistry, positions: PositionCache, clocks: DeadlineScheduler, rounds: DeadlineScheduler, settlements: SettlementQueue, logger: Logger):
+        self.events = events
         self.redis_client = redis_client
         self.sio = sio
         self.gr = gr
-        self.contract = contract
+        self.positions = positions
+        self.clocks = clocks  # player to move runs out of time
+        self.rounds = rounds  # next round of a match starts
+        self.settlements = settlements
         self.logger = logger
-
-    def _on_emit_done(self, task, event, sid, attempts):
-        try:
-            task.result()  #  raises exception if task failed
-        except Exception as e:
-            if attempts < MAX_EMIT_RETRIES:
-                self.logger.error(f"Emit event failed with exception: {e}, retrying...")
-                new_task = asyncio.create_task(self.sio.emit(event.name, event.data, to=sid))
-                new_task.add_done_callback(lambda t, sid=sid: self._on_emit_done(t, event, sid, attempts + 1))
-            else:
-                self.logger.error(f"Emit event failed {MAX_EMIT_RETRIES} times, giving up")
-
-    async def _init_listener(self, gid, sid):
-        self.logger.info("Initialising listener for game " + gid + ", user " + sid + ", on worker ID " + str(os.getpid()))
-
-        def on_message(_, __, ___, body):
-            message = json.loads(body)
-            event = Event(**message)
-            task = asyncio.create_task(self.sio.emit(event.name, event.data, to=sid))
-            task.add_done_callback(lambda t, sid=sid: self._on_emit_done(t, event, sid, 1))
-
-        self.gr.add_game_ctag(gid, self.rmq.channel.basic_consume(queue=utils.get_queue_name(gid, sid), on_message_callback=on_message, auto_ack=True))
-
-    async def get_game_by_gid(self, gid, sid):
-        """Get game state from redis by game ID"""
+        self.reserve_game_slot = redis_client.register_script(self.RESERVE_GAME_SLOT_SCRIPT)
+        self.save_game_script = redis_client.register_script(self.SAVE_GAME_SCRIPT)
+
+    def _game_error(self, message, gid, sid):
+        """Error for the player who triggered an update, or for the game's players if it has no triggering player"""
+        if sid is None:  # e.g. a scheduler callback, don't emit to sid None (every socket)
+            return CustomException(message, emit_local=False, gid=gid)
+        return CustomException(message, sid)
+
+    async def get_game_by_gid(self, gid, sid, checkout=False):
+        """Get game state from redis by game ID (checkout if the board will be modified, see PositionCache)"""
+        key = utils.get_redis_game_key(gid)
         try:
-            game = utils.deserialise_game_state(await self.redis_client.get(utils.get_redis_game_key(gid)))
+            with timed("redis_read"):
+                try:
+                    state = await self.redis_client.hgetall(key)
+                except aioredis.ResponseError as exc:
+                    if not str(exc).startswith("WRONGTYPE"):
+                        raise
+                    state = await self.redis_client.get(key)  # legacy single blob state
+            game = utils.deserialise_game_state(state, self.positions, gid, checkout)
         except aioredis.RedisError as exc:
-            raise CustomException(f"Redis error: {exc}", sid)
+            raise self._game_error(f"Redis error: {exc}", gid, sid)
         if not game:
-            raise CustomException("Game not found", sid)
+            raise self._game_error("Game not found", gid, sid)
         return game
 
     async def get_game_by_sid(self, sid):
         """Get game state from redis by player ID"""
-        gid = self.gr.get_gid(sid)
+        gid = await self.gr.get_gid(sid)
         game = await self.get_game_by_gid(gid, sid)
         return game, gid
 
-    async def save_game(self, gid, game, _=None):
-        """Save game state in Redis"""
+    async def _compare_and_save(self, gid, game):
+        """Save changed game state fields in Redis if no one else has saved since it was read. Returns success"""
+        expected_version = game.version
+        game.version += 1
+        fields = utils.serialise_game_state(game, game.dirty)
+        full_rewrite = len(fields) == len(codec.ENCODERS)  # new game, or legacy state being migrated
         try:
-            await self.redis_client.set(utils.get_redis_game_key(gid), utils.serialise_game_state(game))
+            with timed("redis_write"):
+                saved = await self.save_game_script(
+                    keys=[utils.get_redis_game_key(gid), utils.get_redis_live_games_key()],
+                    args=[expected_version, GAME_TTL, utils.get_time_now_ms() + GAME_TTL * 1000, gid, int(full_rewrite), *(x for item in fields.items() for x in item)],
+                )
         except aioredis.RedisError as exc:
             raise CustomException(f"Redis error: {exc}", emit_local=False, gid=gid)
+        if not saved:
+            return False
+        game.dirty.clear()
+        self.positions.checkin(gid, game.version, game.board)
+        return True
+
+    async def save_game(self, gid, game, sid=None):
+        """Save game state in Redis (and renew the game's admission lease), failing if it was modified concurrently"""
+        if not await self._compare_and_save(gid, game):
+            raise CustomException("Game was modified concurrently, please try again", sid)
+
+    async def update_game(self, gid, mutator, sid=None):
+        """
+        Read-modify-write a game with optimistic concurrency control
+
+        The mutator is called with a fresh copy of the game and may be a coroutine function. If another handler
+        saves the game in the meantime, the game is re-read and the mutator re-run (up to MAX_UPDATE_RETRIES times),
+        so it must not have side effects (publishing events, contract calls etc.) - return what is needed for those
+        instead, and perform them once this method returns. The game is only written if the mutator changed it.
 
-    async def _validate_game_creation(self, sid, time_control, wager, n_rounds):
-        # rate limiting
-        games_inpr = 0
-        async for _ in self.redis_client.scan_iter("game:*"):  # count games in progress
-            games_inpr += 1
-        if games_inpr >= CONCURRENT_GAME_LIMIT:
+        :returns: tuple of the saved game and the mutator's return value
+        """
+        for _ in range(MAX_UPDATE_RETRIES):
+            game = await self.get_game_by_gid(gid, sid, checkout=True)
+            result = mutator(game)
+            if inspect.isawaitable(result):
+                result = await result
+            if not game.dirty:  # nothing to save
+                self.positions.checkin(gid, game.version, game.board)
+                return game, result
+            if await self._compare_and_save(gid, game):
+                return game, result
+            self.logger.info(f"Concurrent update of game {gid}, retrying")
+        raise self._game_error("Game is busy, please try again", gid, sid)
+
+    async def update_game_by_sid(self, sid, mutator):
+        """Update game by player ID (see update_game)"""
+        gid = await self.gr.get_gid(sid)
+        game, result = await self.update_game(gid, mutator, sid)
+        return game, gid, result
+
+    async def _reserve_game_slot(self, sid, gid):
+        """Atomically check the concurrent game limit and reserve a slot for a new game"""
+        now = utils.get_time_now_ms()
+        try:
+            reserved = await self.reserve_game_slot(
+                keys=[utils.get_redis_live_games_key()],
+                args=[now, CONCURRENT_GAME_LIMIT, now + GAME_TTL * 1000, gid],
+            )
+        except aioredis.RedisError as exc:
+            raise CustomException(f"Redis error: {exc}", sid)
+        if not reserved:
             raise CustomException("Server at capacity. Please come back later", sid)
 
+    async def _validate_game_creation(self, sid, time_control, wager, wallet_addr, n_rounds):
+        # settings are stored as fixed width integers (see codec), reject other types (e.g. 5.0 is in range(1, 101))
+        if not all(type(value) is int for value in (time_control, wager, n_rounds)):
+            raise CustomException("Invalid game settings", sid)
+
         # check wager meets min/max requirements
         if wager not in range(VALID_WAGER_RANGE[0], VALID_WAGER_RANGE[1] + 1):
             raise CustomException(f"Invalid wager. Wager must be in range {VALID_WAGER_RANGE} POL", sid)
@@ -93,6 +182,13 @@ class GameController:
         if n_rounds not in range(VALID_N_ROUNDS_RANGE[0], VALID_N_ROUNDS_RANGE[1] + 1):
             raise CustomException(f"Number of rounds must be in range {VALID_N_ROUNDS_RANGE}", sid)
 
+        self._validate_wallet_addr(sid, wallet_addr)
+
+    def _validate_wallet_addr(self, sid, wallet_addr):
+        # also bounds its length, as it is stored as a length prefixed string (see codec)
+        if not isinstance(wallet_addr, str) or not is_address(wallet_addr):
+            raise CustomException("Invalid wallet address", sid)
+
     def _validate_joining_gid(self, gid):
         try:
             uuid.UUID(gid)
@@ -109,42 +205,51 @@ class GameController:
         :param wallet_addr: player's wallet address
         :param n_rounds: number of rounds in the game
         """
-        await self._validate_game_creation(sid, time_control, wager, n_rounds)
+        await self._validate_game_creation(sid, time_control, wager, wallet_addr, n_rounds)
 
         gid = str(uuid.uuid4())  # generate game ID
-        self.sio.enter_room(sid, gid)  # create an SIO room for the game
-
-        tr = time_control * MILLISECONDS_PER_MINUTE
-
-        game = Game(
-            players=[sid],
-            board=Board(),
-            wager=wager,
-            player_wallet_addrs={sid: wallet_addr},
-            time_control=time_control,
-            match_score={sid: 0},
-            n_rounds=n_rounds,
-            round=1,
-            tr_white=tr,
-            tr_black=tr,
-        )
-
-        self.gr.add_player_gid_record(sid, gid)
-        await self.save_game(gid, game, sid)
-
-        # send game id to client
-        await self.sio.emit("gameId", gid, to=sid)  # N.B no need to publish this to MQ
-
-        # create fanout exchange for game
-        self.rmq.channel.exchange_declare(exchange=gid, exchange_type="topic")
-        # create player 1 queue
-        self.rmq.channel.queue_declare(queue=utils.get_queue_name(gid, sid))
-        # bind the queue to the game exchange
-        self.rmq.channel.queue_bind(exchange=gid, queue=utils.get_queue_name(gid, sid), routing_key=sid)
-        self.rmq.channel.queue_bind(exchange=gid, queue=utils.get_queue_name(gid, sid), routing_key=BROADCAST_KEY)
-
-        # init listener
-        await self._init_listener(gid, sid)
+        await self._reserve_game_slot(sid, gid)  # rate limiting
+        try:
+            self.sio.enter_room(sid, gid)  # create an SIO room for the game
+
+            tr = time_control * MILLISECONDS_PER_MINUTE
+
+            game = Game(
+                players=[sid],
+                board=Board(),
+                wager=wager,
+                player_wallet_addrs={sid: wallet_addr},
+                time_control=time_control,
+                match_score={sid: 0},
+                n_rounds=n_rounds,
+                round=1,
+                tr_white=tr,
+                tr_black=tr,
+            )
+
+            await self.gr.add_player_gid_record(sid, gid)
+            await self.save_game(gid, game, sid)
+
+            # send game id to client
+            await self.sio.emit("gameId", gid, to=sid)  # N.B no need to publish this to MQ
+
+            # route player 1's events to this worker
+            await self.events.add_listener(gid, sid)
+        except Exception:
+            await self._abandon_creation(sid, gid)
+            raise
+
+    async def _abandon_creation(self, sid, gid):
+        """Undo a failed create, releasing its admission slot now rather than when its lease expires"""
+        self.sio.leave_room(sid, gid)
+        try:
+            if await self.gr.get_gid(sid) == gid:
+                await self.gr.remove_player_gid_record(sid)
+                await self.events.remove_listener(gid, sid)
+            await self.redis_client.delete(utils.get_redis_game_key(gid))
+            self.positions.evict(gid)
+        finally:
+            await self.redis_client.zrem(utils.get_redis_live_games_key(), gid)
 
     async def get_game_details(self, sid, gid):
         """
@@ -178,11 +283,11 @@ class GameController:
         :param sid: player's socket ID
         :param created_on_contract: whether the contract interaction to create the game completed
         """
-        game, gid = await self.get_game_by_sid(sid)
+        _, gid = await self.get_game_by_sid(sid)
         if created_on_contract:
-            await self.contract.cancel_game(gid)
+            await self.settlements.enqueue(gid, Settlement.CANCEL)
         await self.sio.emit("gameCancelled", to=sid)
-        await self.clear_game(sid, game, gid)
+        await self.clear_game(sid, gid)
 
     async def accept_game(self, sid, gid, wallet_addr):
         """
@@ -193,34 +298,34 @@ class GameController:
         :param gid: game ID
         :param wallet_addr: player's wallet address
         """
-        game = await self.get_game_by_gid(gid, sid)
-
-        self.sio.enter_room(sid, gid)  # join room
-        game.players.append(sid)
-        game.player_wallet_addrs[sid] = wallet_addr
-        game.match_score[sid] = 0
-
-        self.gr.add_player_gid_record(sid, gid)
+        self._validate_wallet_addr(sid, wallet_addr)
+
+        def join(game: Game):
+            if len(game.players) >= 2:  # another player joined first
+                raise CustomException("This game already has two players", sid)
+            game.players.append(sid)
+            game.player_wallet_addrs[sid] = wallet_addr
+            game.match_score[sid] = 0
+            # randomly pick white and black
+            random.shuffle(game.players)
+            game.touch("players", "player_wallet_addrs", "match_score")
+            # set start timestamp (ms) and save game before sending start events
+            game.last_turn_timestamp = utils.get_time_now_ms()
 
-        # randomly pick white and black
-        random.shuffle(game.players)
+        game, _ = await self.update_game(gid, join, sid)
 
-        # create player 2 queue
-        self.rmq.channel.queue_declare(queue=utils.get_queue_name(gid, sid))
-        # bind the queue to the game exchange
-        self.rmq.channel.queue_bind(exchange=gid, queue=utils.get_queue_name(gid, sid), routing_key=sid)
-        self.rmq.channel.queue_bind(exchange=gid, queue=utils.get_queue_name(gid, sid), routing_key=BROADCAST_KEY)
+        self.sio.enter_room(sid, gid)  # join room
+        await self.gr.add_player_gid_record(sid, gid)
 
-        await self._init_listener(gid, sid)
+        # route player 2's events to this worker
+        await self.events.add_listener(gid, sid)
 
-        # set start timestamp (ms) and save game before sending start events
-        game.last_turn_timestamp = utils.get_time_now_ms()
-        await self.save_game(gid, game, sid)
+        # start white's clock
+        await self.clocks.arm(gid, game.last_turn_timestamp + game.tr_white)
 
         # send start events to both players
         for i, colour in enumerate([Colour.BLACK.value[0], Colour.WHITE.value[0]]):
-            utils.publish_event(
-                self.rmq.channel,
+            await self.events.publish(
                 gid,
                 Event(
                     "start",
@@ -233,84 +338,115 @@ class GameController:
         await self.redis_client.incr(utils.get_redis_stat_key("n_games"))
         await self.redis_client.incr(utils.get_redis_stat_key("total_wagered"), game.wager * 2)
 
-    async def handle_end_of_round(self, gid: str, game: Game):
-        overall_winner = None
-        match_score = game.match_score
+    @timed("end_of_round")
+    async def handle_end_of_round(self, gid: str, game: Game, sid=None):
+        """Called by the handler whose (saved) update decided the round (sid: player who triggered it, if any)"""
+        await self.clocks.disarm(gid)
         if game.round == game.n_rounds:
             # end of match
+            def finish(game: Game):
+                if game.finished:  # already ended (e.g. opponent abandoned concurrently)
+                    return False
+                game.finished = True
+                return True
+
+            game, finished = await self.update_game(gid, finish, sid)
+            if not finished:
+                return
+
+            overall_winner = None
+            match_score = game.match_score
             if match_score[game.players[0]] > match_score[game.players[1]]:  # player who had black in last round wins overall
                 overall_winner = 0
             elif match_score[game.players[0]] < match_score[game.players[1]]:  # player who had white in last round wins overall
                 overall_winner = 1
 
             # publish matchEnded event
-            utils.publish_event(self.rmq.channel, gid, Event("matchEnded", {"overallWinner": overall_winner}))
-            # save game
-            game.finished = True
-            await self.save_game(gid, game)
+            await self.events.publish(gid, Event("matchEnded", {"overallWinner": overall_winner}))
 
             # declare result on SC
             if overall_winner is not None:
-                await self.contract.declare_winner(gid, game.player_wallet_addrs[game.players[overall_winner]])
+                await self.settlements.enqueue(gid, Settlement.WINNER, game.player_wallet_addrs[game.players[overall_winner]])
             else:  # draw
-                await self.contract.declare_draw(gid)
+                await self.settlements.enqueue(gid, Settlement.DRAW)
         else:
-            # start next round
-            await asyncio.sleep(15)  # wait some time before starting next round
-            game = await self.get_game_by_gid(gid, game.players[0])  # refresh game in memory
+            # start next round after a break (see start_next_round)
+            await self.rounds.arm(gid, utils.get_time_now_ms() + ROUND_INTERVAL * 1000)
+
+    async def start_next_round(self, gid: str):
+        """Start the next round of a match once the current one is decided (round scheduler callback)"""
+
+        def next_round(game: Game):
+            # abandoned, or next round already started (each round adds one point to the match score in total)
+            if game.finished or sum(game.match_score.values()) < game.round:
+                return False
             game.round += 1
-            game.match_score = match_score  # restore match score
             game.board.reset()  # reset board
             game.players.reverse()  # switch white and black
+            game.touch("board", "players")
             game.tr_white = game.tr_black = game.time_control * MILLISECONDS_PER_MINUTE
             game.last_turn_timestamp = utils.get_time_now_ms()
-
-            await self.save_game(gid, game)
-
-            if not game.finished:  # if game has not been abandoned, send start event
-                for i, colour in enumerate([Colour.BLACK.value[0], Colour.WHITE.value[0]]):
-                    utils.publish_event(
-                        self.rmq.channel,
-                        gid,
-                        Event(
-                            "start",
-                            {"colour": colour, "timeRemaining": game.tr_white, "round": game.round, "totalRounds": game.n_rounds},
-                        ),
-                        game.players[i],
-                    )
+            return True
+
+        game, started = await self.update_game(gid, next_round)
+
+        if started:  # if game has not been abandoned, start white's clock and send start event
+            await self.clocks.arm(gid, game.last_turn_timestamp + game.tr_white)
+            for i, colour in enumerate([Colour.BLACK.value[0], Colour.WHITE.value[0]]):
+                await self.events.publish(
+                    gid,
+                    Event(
+                        "start",
+                        {"colour": colour, "timeRemaining": game.tr_white, "round": game.round, "totalRounds": game.n_rounds},
+                    ),
+                    game.players[i],
+                )
 
     async def handle_exit(self, sid):
-        if not self.gr.get_gid(sid):
+        if not await self.gr.get_gid(sid):
             # if player already removed from game or game deleted, return
             return
 
-        game, gid = await self.get_game_by_sid(sid)
-        if len(game.players) > 1 and not game.finished:
-            # if game not finished, the player automatically loses the match
-            winner_ind = utils.opponent_ind(game.players.index(sid))
-            utils.publish_event(self.rmq.channel, gid, Event("move", {"winner": winner_ind, "outcome": Outcome.ABANDONED.value, "matchScore": game.match_score}))
-            utils.publish_event(self.rmq.channel, gid, Event("matchEnded", {"overallWinner": winner_ind}))
-            game.finished = True
-            await self.save_game(gid, game)
-            await self.contract.declare_winner(gid, game.player_wallet_addrs[game.players[winner_ind]])
+        def abandon(game: Game):
+            if len(game.players) > 1 and not game.finished:
+                # if game not finished, the player automatically loses the match
+                game.finished = True
+                return utils.opponent_ind(game.players.index(sid))
 
-        await self.clear_game(sid, game, gid)
+        game, gid, winner_ind = await self.update_game_by_sid(sid, abandon)
+        if winner_ind is not None:
+            await self.events.publish_many(
+                gid,
+                [
+                    Event("move", {"winner": winner_ind, "outcome": Outcome.ABANDONED.value, "matchScore": game.match_score}),
+                    Event("matchEnded", {"overallWinner": winner_ind}),
+                ],
+            )
+            await self.settlements.enqueue(gid, Settlement.WINNER, game.player_wallet_addrs[game.players[winner_ind]])
 
-    async def clear_game(self, sid, game, gid):
+        await self.clear_game(sid, gid)
+
+    async def clear_game(self, sid, gid):
         """Clears a user's game(s) from memory"""
         self.logger.info("Clearing game " + gid + " (user " + sid + ")")
-        self.gr.remove_player_gid_record(sid)
-        self.rmq.channel.queue_unbind(utils.get_queue_name(gid, sid), exchange=gid, routing_key=sid)
-        self.rmq.channel.queue_unbind(utils.get_queue_name(gid, sid), exchange=gid, routing_key=BROADCAST_KEY)
+        await self.gr.remove_player_gid_record(sid)
+        await self.events.remove_listener(gid, sid)
         self.sio.leave_room(sid, gid)
 
-        if len(game.players) > 1:  # remove player from game.players
-            game.players.remove(sid)
-            await self.save_game(gid, game, sid)
-        else:  # last player to leave game
+        def leave(game: Game):
+            if len(game.players) > 1:  # remove player from game.players
+                game.players.remove(sid)
+                game.touch("players")
+                return False
+            return True
+
+        _, last_player = await self.update_game(gid, leave, sid)
+        # game is over once a player leaves
+        await self.clocks.disarm(gid)
+        await self.rounds.disarm(gid)
+
+        if last_player:  # last player to leave game
             await self.sio.close_room(gid)
-            for ctag in self.gr.get_game_ctags(gid):
-                self.rmq.channel.basic_cancel(consumer_tag=ctag)
-            self.gr.remove_all_game_ctags(gid)
-            self.rmq.channel.exchange_delete(exchange=gid)
             await self.redis_client.delete(utils.get_redis_game_key(gid))
+            self.positions.evict(gid)
+            await self.redis_client.zrem(utils.get_redis_live_games_key(), gid)  # release admission slot
@@ -1,35 +1,86 @@
-from collections import defaultdict
+import asyncio
+import time
+from collections import OrderedDict, defaultdict
+
+import app.utils as utils
+from aioredis.client import Redis
+from app.constants import PLAYER_TTL, REGISTRY_CACHE_SIZE, REGISTRY_CACHE_TTL
 
 
 class GameRegistry:
-    """Stores two hash tables mapping player IDs to game IDs and game IDs to MQ consumer tags, respectively"""
+    """
+    Maps player IDs to game IDs (shared by all workers via Redis) and game IDs to the players connected to this worker
+
+    Player records expire after PLAYER_TTL seconds unless refreshed; the worker holding a player's socket refreshes
+    them periodically, so records of players on a dead worker clean themselves up. Lookups go through a small local
+    LRU cache.
+    """
+
+    def __init__(self, redis_client: Redis):
+        self.redis_client = redis_client
+        self.cache = OrderedDict()  # sid -> (gid, cached at)
+        self.gids_to_sids = defaultdict(set)  # local players only
+        self.refresher = None
 
-    def __init__(self):
-        self.players_to_gids = {}
-        self.gids_to_ctags = defaultdict(list)
+    async def get_gid(self, sid):
+        entry = self.cache.get(sid)
+        if entry is not None and time.monotonic() - entry[1] < REGISTRY_CACHE_TTL:
+            self.cache.move_to_end(sid)
+            return entry[0]
+        gid = await self.redis_client.get(utils.get_redis_player_key(sid))
+        if gid is None:
+            self.cache.pop(sid, None)
+            return None
+        gid = gid.decode()
+        self._cache(sid, gid)
+        return gid
 
-    def get_gid(self, sid):
-        return self.players_to_gids.get(sid, None)
+    def _cache(self, sid, gid):
+        self.cache[sid] = (gid, time.monotonic())
+        self.cache.move_to_end(sid)
+        if len(self.cache) > REGISTRY_CACHE_SIZE:
+            self.cache.popitem(last=False)  # evict least recently used
 
-    def add_player_gid_record(self, sid, gid):
-        self.players_to_gids[sid] = gid
+    async def add_player_gid_record(self, sid, gid):
+        await self.redis_client.set(utils.get_redis_player_key(sid), gid, ex=PLAYER_TTL)
+        self._cache(sid, gid)
+        self.gids_to_sids[gid].add(sid)
 
-    def remove_player_gid_record(self, sid):
-        self.players_to_gids.pop(sid, None)
+    async def remove_player_gid_record(self, sid):
+        gid = await self.get_gid(sid)
+        await self.redis_client.delete(utils.get_redis_player_key(sid))
+        self.cache.pop(sid, None)
+        if gid in self.gids_to_sids:
+            self.gids_to_sids[gid].discard(sid)
+            if not self.gids_to_sids[gid]:
+                del self.gids_to_sids[gid]
 
-    def get_game_ctags(self, gid):
-        return self.gids_to_ctags.get(gid, [])
+    def get_game_sids(self, gid):
+        return self.gids_to_sids.get(gid, set())
 
-    def add_game_ctag(self, gid, ctag):
-        self.gids_to_ctags[gid].append(ctag)
+    async def refresh_records(self):
+        """Keeps the records of players connected to this worker alive"""
+        while True:
+            await asyncio.sleep(PLAYER_TTL / 3)
+            sids = [sid for sids in self.gids_to_sids.values() for sid in sids]
+            if not sids:
+                continue
+            async with self.redis_client.pipeline(transaction=False) as pipe:
+                for sid in sids:
+                    pipe.expire(utils.get_redis_player_key(sid), PLAYER_TTL)
+                await pipe.execute()
 
-    def remove_game_ctag(self, gid, ctag):
-        if gid in self.gids_to_ctags:
-            self.gids_to_ctags[gid].remove(ctag)
+    def start_refresher(self):
+        self.refresher = asyncio.create_task(self.refresh_records())
 
-    def remove_all_game_ctags(self, gid):
-        self.gids_to_ctags.pop(gid, None)
+    def stop_refresher(self):
+        if self.refresher:
+            self.refresher.cancel()
 
-    def clear(self):
-        self.players_to_gids.clear()
-        self.gids_to_ctags.clear()
+    async def clear(self):
+        """Removes the records of players connected to this worker"""
+        sids = [sid for sids in self.gids_to_sids.values() for sid in sids]
+        if sids:
+            await self.redis_client.delete(*(utils.get_redis_player_key(sid) for sid in sids))
+        self.cache.clear()
+        self.gids_to_sids.clear()
@@ -2,17 +2,24 @@ import logging
 from contextlib import asynccontextmanager
 
 import aioredis
-from app.constants import ALCHEMY_API_URL, CLOUDAMQP_URL, REDIS_URL
+import app.utils as utils
+import socketio
+from app.constants import ALCHEMY_API_URL, CLOUDAMQP_URL, EVENT_DELIVERY, REDIS_URL
+from app.events import MQEventBus, SIOEventBus
 from app.exceptions import SocketIOExceptionHandler
-from app.exchange import router as exchange_router
-from app.stats import build_stats_router
+from app.exchange import ExchangeRates, build_exchange_router
+from app.stats import MetricsExporter, build_metrics_router, build_stats_router
 from app.game_contract import GameContract
 from app.game_controller import GameController
 from app.game_registry import GameRegistry
 from app.log_formatter import custom_formatter
+from app.odds import odds_table, router as odds_router
 from app.play_controller import PlayController
-from app.rate_limit import TokenBucketRateLimiter
+from app.position_cache import PositionCache
+from app.rate_limit import EventRateLimiter, TokenBucketRateLimiter, get_client_ip
 from app.rmq import RMQConnectionManager
+from app.scheduler import DeadlineScheduler
+from app.settlement import SettlementQueue
 from fastapi import Depends, FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi_socketio import SocketManager
@@ -28,35 +35,76 @@ logger.handlers[0].setFormatter(custom_formatter)
 w3 = AsyncWeb3(AsyncWeb3.AsyncHTTPProvider(ALCHEMY_API_URL))
 w3.middleware_onion.inject(async_geth_poa_middleware, layer=0)
 
-# game registry
-gr = GameRegistry()
-
-# connection token bucket (rate limiting)
-rate_limiter = TokenBucketRateLimiter()
+# live board cache
+positions = PositionCache()
 
 # Redis client and MQ setup
 rurl = urlparse(REDIS_URL)
 redis_client = aioredis.Redis(host=rurl.hostname, port=rurl.port, password=rurl.password, ssl=(rurl.scheme == "rediss"), ssl_cert_reqs=None)
 
-# RabbitMQ connection manager (pika)
-rmq = RMQConnectionManager(CLOUDAMQP_URL, logger)
+# connection token buckets (rate limiting, shared by all workers)
+rate_limiter = TokenBucketRateLimiter(redis_client)
+
+# per client event token buckets (flood protection)
+event_limiter = EventRateLimiter(redis_client, logger)
+
+# metrics of all workers (aggregated in redis)
+metrics = MetricsExporter(redis_client, logger)
+
+# game registry
+gr = GameRegistry(redis_client)
+
+# exchange rates (cached in redis)
+exchange_rates = ExchangeRates(redis_client, logger)
+
+# Socket.IO client manager (only used when events are delivered through Socket.IO rather than our own MQ fan-out)
+if EVENT_DELIVERY == "sio-redis":
+    client_manager = socketio.AsyncRedisManager(REDIS_URL, redis_options={"ssl_cert_reqs": None} if rurl.scheme == "rediss" else None)
+elif EVENT_DELIVERY == "sio-amqp":
+    client_manager = socketio.AsyncAioPikaManager(CLOUDAMQP_URL)
+else:
+    client_manager = None
 
 
 @asynccontextmanager
 async def lifespan(_):
     """Handles startup/shutdown"""
-    # Start token refiller
-    rate_limiter.start_refiller()
+    # Start delivering game events (connects to RabbitMQ in MQ mode)
+    await events.start()
+
+    # Map the precomputed odds table (built if missing)
+    odds_table.load()
+
+    # Open the exchange rate API session
+    await exchange_rates.start()
+
+    # Start flushing rate limiter counters (for /stats) and metrics (for /metrics)
+    event_limiter.start()
+    metrics.start()
+
+    # Start refreshing the registry records of this worker's players
+    gr.start_refresher()
+
+    # Start settling finished games on chain
+    settlements.start()
+
+    # Start the server side clocks and round transitions (rebuilt from redis)
+    await clocks.start(pc.time_out)
+    await rounds.start(gc.start_next_round)
 
     yield
 
     # Clean up before shutdown
-    rate_limiter.stop_refiller()
-    gr.clear()  # clear game registry
-    if rmq.channel is not None and rmq.channel.is_open:  # close MQ
-        rmq.channel.close()
-    async for key in redis_client.scan_iter("game:*"):  # clear all games from redis cache
-        await redis_client.delete(key)
+    event_limiter.stop()
+    gr.stop_refresher()
+    settlements.stop()
+    clocks.stop()
+    rounds.stop()
+    await gr.clear()  # clear this worker's player records (games, deadlines etc. are shared by all workers)
+    positions.clear()  # clear board cache
+    await events.close()  # close MQ
+    await exchange_rates.close()  # close exchange rate API session
+    await metrics.stop()  # flush this worker's last metrics
     await redis_client.close()  # close redis connection
 
 
@@ -73,29 +121,44 @@ chess_api.add_middleware(
     allow_headers=["*"],
 )
 
-chess_api.include_router(exchange_router)
-chess_api.include_router(build_stats_router(redis_client))
+chess_api.include_router(build_exchange_router(exchange_rates))
+chess_api.include_router(odds_router)
+chess_api.include_router(build_stats_router(redis_client, logger))
+chess_api.include_router(build_metrics_router(metrics))
+
+socket_manager = SocketManager(app=chess_api, client_manager=client_manager)
 
-socket_manager = SocketManager(app=chess_api)
+# Game event delivery
+if client_manager is None:
+    events = MQEventBus(RMQConnectionManager(CLOUDAMQP_URL, logger), chess_api.sio, gr, logger)
+else:
+    events = SIOEventBus(chess_api.sio, logger)
 
 # Contract wrapper
-contract = GameContract(w3, logger)
+contract = GameContract(w3, redis_client, logger)
+
+# On-chain settlement queue
+settlements = SettlementQueue(redis_client, contract, events, logger)
+
+# Server side clocks and round transitions
+clocks = DeadlineScheduler(redis_client, utils.get_redis_clock_deadlines_key(), logger)
+rounds = DeadlineScheduler(redis_client, utils.get_redis_round_starts_key(), logger)
 
 # Game controller
-gc = GameController(rmq, redis_client, chess_api.sio, gr, contract, logger)
+gc = GameController(events, redis_client, chess_api.sio, gr, positions, clocks, rounds, settlements, logger)
 
 # Play (in game events) controller
-pc = PlayController(rmq, chess_api.sio, gc, logger)
+pc = PlayController(events, chess_api.sio, gc, logger)
 
 # Global exception handler for controller methods
-sioexc = SocketIOExceptionHandler(chess_api.sio, rmq, logger)
+sioexc = SocketIOExceptionHandler(chess_api.sio, events, logger, event_limiter)
 
 # Connect/disconnect handlers
 
 
 @chess_api.sio.on("connect")
-async def connect(sid, _):
-    if rate_limiter.consume_token():
+async def connect(sid, environ):
+    if await rate_limiter.consume_connection(get_client_ip(environ)):
         logger.info(f"Client {sid} connected")
     else:
         await chess_api.sio.emit("error", "Connection limit exceeded", to=sid)
@@ -105,6 +168,7 @@ async def connect(sid, _):
 
 @chess_api.sio.on("disconnect")
 async def disconnect(sid):
+    event_limiter.forget(sid)
     await gc.handle_exit(sid)
     logger.info(f"Client {sid} disconnected")
 
@@ -112,27 +176,23 @@ async def disconnect(sid):
 # Game management event handlers
 
 
-@chess_api.sio.on("create")
-@sioexc.sio_exception_handler
+@sioexc.on("create")
 async def create(sid, time_control, wager, wallet_addr, n_rounds):
     await gc.create(sid, time_control, wager, wallet_addr, n_rounds)
 
 
-@chess_api.sio.on("cancel")
-@sioexc.sio_exception_handler
+@sioexc.on("cancel")
 async def cancel_game(sid, created_on_contract):
     """Game creator cancels the game and cashes out"""
     await gc.cancel_game(sid, created_on_contract)
 
 
-@chess_api.sio.on("getGameDetails")
-@sioexc.sio_exception_handler
+@sioexc.on("getGameDetails")
 async def get_game_details(sid, gid):
     await gc.get_game_details(sid, gid)
 
 
-@chess_api.sio.on("acceptGame")
-@sioexc.sio_exception_handler
+@sioexc.on("acceptGame")
 async def accept_game(sid, gid, wallet_addr):
     await gc.accept_game(sid, gid, wallet_addr)
 
@@ -140,26 +200,27 @@ async def accept_game(sid, gid, wallet_addr):
 # In-game event handlers
 
 
-@chess_api.sio.on("move")
-@sioexc.sio_exception_handler
+@sioexc.on("move")
 async def move(sid, uci):
     await pc.move(sid, uci)
 
 
-@chess_api.sio.on("offerDraw")
-@sioexc.sio_exception_handler
+@sioexc.on("resync")
+async def resync(sid):
+    await pc.resync(sid)
+
+
+@sioexc.on("offerDraw")
 async def offer_draw(sid):
     await pc.offer_draw(sid)
 
 
-@chess_api.sio.on("acceptDraw")
-@sioexc.sio_exception_handler
+@sioexc.on("acceptDraw")
 async def accept_draw(sid):
     await pc.accept_draw(sid)
 
 
-@chess_api.sio.on("resign")
-@sioexc.sio_exception_handler
+@sioexc.on("resign")
 async def resign(sid):
     await pc.resign(sid)
 
@@ -167,8 +228,7 @@ async def resign(sid):
 # NOTE: flag means run out of clock time
 
 
-@chess_api.sio.on("flag")
-@sioexc.sio_exception_handler
+@sioexc.on("flag")
 async def flag(sid, flagged):
     await pc.flag(sid, flagged)
 
@@ -176,14 +236,12 @@ async def flag(sid, flagged):
 # Rematch (game management)
 
 
-@chess_api.sio.on("offerRematch")
-@sioexc.sio_exception_handler
+@sioexc.on("offerRematch")
 async def offer_rematch(sid):
     await gc.offer_rematch(sid)
 
 
-@chess_api.sio.on("acceptRematch")
-@sioexc.sio_exception_handler
+@sioexc.on("acceptRematch")
 async def accept_rematch(sid):
     await gc.accept_rematch(sid)
 
@@ -191,8 +249,7 @@ async def accept_rematch(sid):
 # Exit game handler
 
 
-@chess_api.sio.on("exit")
-@sioexc.sio_exception_handler
+@sioexc.on("exit")
 async def exit(sid):
     """When a client exits the game/match, clear it from game registry and cache"""
     await gc.handle_exit(sid)
@@ -0,0 +1,138 @@
+import bisect
+import inspect
+import json
+import time
+from functools import wraps
+from typing import Dict, List, Tuple
+
+# upper bounds (seconds) of latency histogram buckets, from sub-millisecond Redis calls to chain transactions
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Metric:
+    """Counts kept in process (per worker) and collected for export by drain (see stats.MetricsExporter)"""
+
+    kind = None
+
+    def __init__(self, name: str, description: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.values: Dict[tuple, object] = {}  # label values -> value since the last drain
+
+    def _key(self, label_values):
+        return tuple(label_values[label] for label in self.labels)
+
+    def drain(self):
+        """Values since the last drain, keyed by a JSON list of their label values"""
+        values, self.values = self.values, {}
+        return {json.dumps([str(v) for v in key]): value for key, value in values.items()}
+
+    def restore(self, drained):
+        """Add back values drain returned (e.g. they could not be exported), merged with any counted since"""
+        for labels, value in drained.items():
+            key = tuple(json.loads(labels))
+            self.values[key] = self._merge(self.values[key], value) if key in self.values else value
+
+    @staticmethod
+    def _merge(value, other):
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **label_values):
+        key = self._key(label_values)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    @staticmethod
+    def _merge(value, other):
+        return value + other
+
+
+class Histogram(Metric):
+    """Values are [count of each bucket (not cumulative, last is +Inf), sum]"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, description: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = buckets
+
+    def observe(self, value: float, **label_values):
+        key = self._key(label_values)
+        counts = self.values.get(key)
+        if counts is None:
+            counts = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    @staticmethod
+    def _merge(value, other):
+        return [a + b for a, b in zip(value, other)]
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: List[Metric] = []
+
+    def counter(self, name: str, description: str, labels: Tuple[str, ...] = ()):
+        self.metrics.append(Counter(name, description, labels))
+        return self.metrics[-1]
+
+    def histogram(self, name: str, description: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.metrics.append(Histogram(name, description, labels, buckets))
+        return self.metrics[-1]
+
+
+registry = Registry()
+
+EVENT_SECONDS = registry.histogram("dechecs_sio_event_seconds", "Socket.IO event handler latency", ("event",))
+EVENT_ERRORS = registry.counter("dechecs_sio_event_errors_total", "Socket.IO events that failed", ("event",))
+EVENT_DROPPED = registry.counter("dechecs_sio_events_dropped_total", "Socket.IO events dropped by rate limiting", ("event",))
+STEP_SECONDS = registry.histogram("dechecs_step_seconds", "Latency of hot path steps (Redis, chess, publishing, chain)", ("step",))
+
+
+class timed:
+    """
+    Time a step into STEP_SECONDS, as a context manager or a (sync or async) function decorator
+
+        with timed("redis_read"):
+            state = await redis_client.hgetall(key)
+    """
+
+    __slots__ = ("step", "start")
+
+    def __init__(self, step: str):
+        self.step = step
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *_):
+        STEP_SECONDS.observe(time.perf_counter() - self.start, step=self.step)
+
+    def __call__(self, fn):
+        step = self.step
+        if inspect.iscoroutinefunction(fn):
+
+            @wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    STEP_SECONDS.observe(time.perf_counter() - start, step=step)
+
+            return async_wrapper
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                STEP_SECONDS.observe(time.perf_counter() - start, step=step)
+
+        return wrapper
@@ -1,6 +1,6 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field, fields
 from enum import Enum
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, List, Optional, Set, Tuple
 
 from chess import Board
 
@@ -22,7 +22,13 @@ class Outcome(Enum):
     ABANDONED = 14
 
 
-@dataclass
+class Settlement(Enum):
+    CANCEL = "cancel"
+    WINNER = "winner"
+    DRAW = "draw"
+
+
+@dataclass(slots=True)
 class Game:
     players: List[str]  # [0] black, [1] white
     board: Board | str  # pychess board object or string when serialised
@@ -36,21 +42,40 @@ class Game:
     tr_black: int  # time reamining in round (black)
     finished: bool = False  # whether the game has finished
     last_turn_timestamp: int = 0  # timestamp for end of last turn (or start of round)
+    version: int = 0  # incremented on every save, used to validate cached boards
+    dirty: Set[str] = field(default_factory=set, repr=False, compare=False)  # attributes changed since last save
+
+    def __post_init__(self):
+        self.dirty = {f.name for f in fields(self) if f.name != "dirty"}  # new games are saved in full
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if name != "dirty" and hasattr(self, "dirty"):
+            self.dirty.add(name)
+
+    def touch(self, *names):
+        """Mark attributes mutated in place (e.g. board.push, players.append) as changed"""
+        self.dirty.update(names)
 
 
 @dataclass
 class MoveData:
     # NOTE: we break naming conventions here to avoid using hindering var name conversion
+    # only the latest move is sent (moveStack / legal moves of a full state are sent on request, see resync)
+    ply: int  # number of moves played this round, lets clients detect a missed move
     turn: int
-    winner: int
-    outcome: int
-    matchScore: Optional[Tuple[float, float]]  # TODO: move winner, outcome, matchScore to separate event
     move: str
-    castles: Optional[str]
     isCheck: bool
     enPassant: bool
-    legalMoves: List[str]
-    moveStack: List[str]
+    castles: Optional[str] = None
+    legal: Optional[str] = None  # legal moves for the player to move (utils.encode_legal_moves), None once over
+    winner: Optional[int] = None
+    outcome: Optional[int] = None
+    matchScore: Optional[Tuple[float, float]] = None  # TODO: move winner, outcome, matchScore to separate event
+
+    def delta(self):
+        """Payload of the move event (unset optional fields are left out)"""
+        return {k: v for k, v in self.__dict__.items() if v is not None}
 
 
 @dataclass
@@ -63,3 +88,12 @@ class TimerData:
 class Event:
     name: str
     data: int | str | dict
+
+
+@dataclass
+class SentTx:
+    tx_hash: str  # hex
+    nonce: int
+    gas_price: int  # wei
+    gids: Tuple[str, ...] = ()  # games settled by the transaction (all of a batch)
+    winners: Tuple[str, ...] = ()  # winner address of each game of a declareResults batch
@@ -0,0 +1,70 @@
+from logging import Logger
+
+import app.utils as utils
+from aioredis.client import Redis
+from web3 import AsyncWeb3
+
+
+class NonceManager:
+    """
+    Allocates transaction nonces for an account, shared by all workers through a Redis counter
+
+    The counter is seeded from the chain's pending transaction count and only ever handed out atomically, so
+    concurrent settlements (on any worker) never pick the same nonce. If an allocated nonce is never used (the
+    transaction could not be signed or the node rejected it) later transactions are stuck behind the gap, so it is
+    released and handed out again before the counter moves on. The counter itself only ever moves forwards.
+    """
+
+    # returns the lowest released nonce, else the next nonce and increments the counter (nil if it has not been seeded)
+    ALLOCATE_SCRIPT = """
+    local released = redis.call("ZPOPMIN", KEYS[2])
+    if released[1] then
+        return tonumber(released[1])
+    end
+    local nonce = redis.call("GET", KEYS[1])
+    if not nonce then
+        return false
+    end
+    redis.call("INCR", KEYS[1])
+    return tonumber(nonce)
+    """
+
+    # moves the counter up to the chain's pending count if it is behind, dropping released nonces the chain has used
+    SYNC_SCRIPT = """
+    redis.call("ZREMRANGEBYSCORE", KEYS[2], "-inf", "(" .. ARGV[1])
+    local nonce = tonumber(redis.call("GET", KEYS[1]) or "-1")
+    if nonce < tonumber(ARGV[1]) then
+        redis.call("SET", KEYS[1], ARGV[1])
+        return tonumber(ARGV[1])
+    end
+    return nonce
+    """
+
+    def __init__(self, redis_client: Redis, w3: AsyncWeb3, address: str, logger: Logger):
+        self.redis_client = redis_client
+        self.w3 = w3
+        self.address = address
+        self.key = utils.get_redis_nonce_key(address)
+        self.released_key = utils.get_redis_released_nonces_key(address)
+        self.logger = logger
+        self.allocate_script = redis_client.register_script(self.ALLOCATE_SCRIPT)
+        self.sync_script = redis_client.register_script(self.SYNC_SCRIPT)
+
+    async def allocate(self) -> int:
+        """Reserve the next nonce"""
+        nonce = await self.allocate_script(keys=[self.key, self.released_key])
+        if nonce is None:
+            await self.sync()
+            nonce = await self.allocate_script(keys=[self.key, self.released_key])
+        return nonce
+
+    async def release(self, nonce: int):
+        """Return an allocated nonce that was never used, so the next allocation fills the gap"""
+        await self.redis_client.zadd(self.released_key, {nonce: nonce})
+
+    async def sync(self) -> int:
+        """Catch the counter up with the chain's pending transaction count (e.g. after transactions sent elsewhere)"""
+        chain_nonce = await self.w3.eth.get_transaction_count(self.address, "pending")
+        nonce = await self.sync_script(keys=[self.key, self.released_key], args=[chain_nonce])
+        self.logger.info(f"Nonce for {self.address} synced to {nonce} (chain pending count {chain_nonce})")
+        return nonce
@@ -0,0 +1,34 @@
+from typing import List
+
+from app.constants import ODDS_TABLE_PATH, VALID_ELO_RANGE, VALID_N_ROUNDS_RANGE
+from app.win_prob import OddsTable, WinProbability
+from fastapi import APIRouter, HTTPException, Query
+from starlette.status import HTTP_400_BAD_REQUEST
+
+router = APIRouter(prefix="/odds", tags=["odds"])
+
+odds_table = OddsTable(ODDS_TABLE_PATH)  # loaded on startup
+win_probability = WinProbability()  # ratings outside the table's grid
+
+
+@router.get("")
+async def get_odds(elo1: float, elo2: float, rounds: List[int] = Query(None)):
+    """
+    Odds of player 1 (elo1) winning, losing and drawing a best-of-n match against player 2 (elo2)
+
+    Returns:
+        dict: Odds for each requested number of rounds (all valid numbers of rounds if none are given)
+    """
+    if not all(VALID_ELO_RANGE[0] <= elo <= VALID_ELO_RANGE[1] for elo in (elo1, elo2)):
+        raise HTTPException(status_code=HTTP_400_BAD_REQUEST, detail=f"Ratings must be in range {VALID_ELO_RANGE}")
+    if rounds is None:
+        rounds = list(range(VALID_N_ROUNDS_RANGE[0], VALID_N_ROUNDS_RANGE[1] + 1))
+    elif not all(VALID_N_ROUNDS_RANGE[0] <= n <= VALID_N_ROUNDS_RANGE[1] for n in rounds):
+        raise HTTPException(status_code=HTTP_400_BAD_REQUEST, detail=f"Number of rounds must be in range {VALID_N_ROUNDS_RANGE}")
+
+    elo1s, elo2s = [elo1] * len(rounds), [elo2] * len(rounds)
+    if odds_table.covers(elo1, elo2):
+        odds = odds_table.odds_many(elo1s, elo2s, rounds).tolist()
+    else:  # too far apart for the table, computed rather than clamped to its edge
+        odds = win_probability.odds_many(elo1s, elo2s, rounds)
+    return {"odds": {n: {"win": win, "lose": lose, "draw": draw} for n, (win, lose, draw) in zip(rounds, odds)}}
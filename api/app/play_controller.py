@@ -1,11 +1,11 @@
-import time
 from logging import Logger
 
 import app.utils as utils
+from app.events import EventBus
 from app.exceptions import CustomException
 from app.game_controller import GameController
-from app.models import Castles, Colour, Event, MoveData, Outcome, TimerData
-from app.rmq import RMQConnectionManager
+from app.metrics import timed
+from app.models import Castles, Colour, Event, Game, MoveData, Outcome, TimerData
 from chess import Move
 from socketio.asyncio_server import AsyncServer
 
@@ -14,20 +14,23 @@ class PlayController:
 
     TIMER_HALF_PRECISION = 100  # ms
 
-    def __init__(self, rmq: RMQConnectionManager, sio: AsyncServer, gc: GameController, logger: Logger):
-        self.rmq = rmq
+    def __init__(self, events: EventBus, sio: AsyncServer, gc: GameController, logger: Logger):
+        self.events = events
         self.sio = sio
         self.gc = gc
         self.logger = logger
 
-    def _update_match_score(self, game, outcome, winner_sid=None):
-        assert sum(game.match_score.values()) < game.n_rounds  # check score has not already been updated (flag request handling)
+    def _round_decided(self, game: Game):
+        """Whether the current round already has a result (each round adds one point to the match score in total)"""
+        return game.finished or sum(game.match_score.values()) >= game.round
 
+    def _update_match_score(self, game, outcome, winner_sid=None):
         if outcome == Outcome.AGREEMENT.value:
             for pid in game.players:
                 game.match_score[pid] += 0.5
         else:
             game.match_score[winner_sid] += 1
+        game.touch("match_score")
         match_score = [0, 0]  # dumb match score [black, white]
         for idx, pid in enumerate(game.players):
             match_score[idx] = game.match_score[pid]
@@ -36,112 +39,185 @@ class PlayController:
     async def move(self, sid, uci):
         move_timestamp = utils.get_time_now_ms()
 
-        game, gid = await self.gc.get_game_by_sid(sid)
-        board = game.board
-        move = Move.from_uci(uci)
-        castles, en_passant = None, False
-        if board.is_kingside_castling(move):
-            castles = Castles.KINGSIDE
-        elif board.is_queenside_castling(move):
-            castles = Castles.QUEENSIDE
-        elif board.is_en_passant(move):
-            en_passant = True
-
-        try:
+        @timed("play_move")
+        def play(game: Game):
+            if self._round_decided(game):
+                raise CustomException("Round is over", sid)
+            board = game.board
+            if game.players[int(board.turn)] != sid:
+                raise CustomException("It is not your turn", sid)
+
+            # the mover's clock may have run out before the move arrived (the deadline claim then finds it moved)
+            move_time = move_timestamp - game.last_turn_timestamp
+            turn = int(board.turn)
+            if move_time >= (game.tr_white if turn == Colour.WHITE.value[0] else game.tr_black):
+                winner_ind = utils.opponent_ind(turn)
+                return None, None, None, (winner_ind, self._update_match_score(game, Outcome.TIMEOUT.value, game.players[winner_ind])[1])
+
+            try:
+                move = Move.from_uci(uci)
+            except ValueError:  # malformed UCI
+                raise CustomException("Ilegal move", sid)
+            if not board.is_legal(move):  # also rejects the null move
+                raise CustomException("Ilegal move", sid)
+            castles, en_passant = None, False
+            if board.is_kingside_castling(move):
+                castles = Castles.KINGSIDE
+            elif board.is_queenside_castling(move):
+                castles = Castles.QUEENSIDE
+            elif board.is_en_passant(move):
+                en_passant = True
+
             board.push(move)
             outcome = board.outcome(claim_draw=True)
-        except AssertionError:
-            # move not pseudo-legal
-            raise CustomException("Ilegal move", sid)
+            game.touch("board")
+
+            match_score = None
+            if outcome:
+                winner_sid = None
+                if outcome.winner is not None:
+                    winner_sid = game.players[int(outcome.winner)]
+                game, match_score = self._update_match_score(game, outcome.termination.value, winner_sid)
+
+            move_data = MoveData(
+                ply=len(board.move_stack),
+                turn=int(board.turn),
+                move=str(board.peek()),
+                isCheck=board.is_check(),
+                enPassant=en_passant,
+                castles=castles.value if castles else None,
+                legal=None if outcome else utils.encode_legal_moves(board),
+                winner=int(outcome.winner) if outcome and outcome.winner is not None else None,
+                outcome=outcome.termination.value if outcome else None,
+                matchScore=match_score,
+            )
+
+            # update players' time remaining
+            game.last_turn_timestamp = move_timestamp
+
+            if move_data.turn == 0:  # last turn was white
+                game.tr_white -= move_time
+            else:  # last turn was black
+                game.tr_black -= move_time
+
+            timer_data = TimerData(white=game.tr_white, black=game.tr_black)
+            return move_data, timer_data, outcome, None
+
+        game, gid, (move_data, timer_data, outcome, timed_out) = await self.gc.update_game_by_sid(sid, play)
+
+        if timed_out:  # move came too late, the mover lost the round on time
+            winner_ind, match_score = timed_out
+            await self.events.publish(gid, Event("move", {"winner": winner_ind, "outcome": Outcome.TIMEOUT.value, "matchScore": match_score}))
+            await self.gc.handle_end_of_round(gid, game, sid)
+            return
 
-        match_score = None
-        if outcome:
-            winner_sid = None
-            if outcome.winner is not None:
-                winner_sid = game.players[int(outcome.winner)]
-            game, match_score = self._update_match_score(game, outcome.termination.value, winner_sid)
-
-        move_data = MoveData(
-            turn=int(board.turn),
-            winner=int(outcome.winner) if outcome else None,
-            matchScore=match_score,
-            outcome=outcome.termination.value if outcome else None,
-            move=str(board.peek()),
-            castles=castles.value if castles else None,
-            isCheck=board.is_check(),
-            enPassant=en_passant,
-            legalMoves=[str(m) for m in board.legal_moves],
-            moveStack=[str(m) for m in board.move_stack],
-        )
-
-        # calculate move time and update players' time remaining
-        move_time = move_timestamp - game.last_turn_timestamp
-        game.last_turn_timestamp = move_timestamp
-
-        if move_data.turn == 0:  # last turn was white
-            game.tr_white -= move_time
-        else:  # last turn was black
-            game.tr_black -= move_time
-
-        timer_data = TimerData(white=game.tr_white, black=game.tr_black)
-
-        # send updated game state to clients in room
-        utils.publish_event(self.rmq.channel, gid, Event("move", move_data.__dict__))
-        # send GT clock times
-        utils.publish_event(self.rmq.channel, gid, Event("clockSync", timer_data.__dict__))
+        # send updated game state and GT clock times to clients in room (one message)
+        await self.events.publish_many(gid, [Event("move", move_data.delta()), Event("clockSync", timer_data.__dict__)])
 
         if outcome:
-            await self.gc.handle_end_of_round(gid, game)
-        else:
-            await self.gc.save_game(gid, game, sid)
+            await self.gc.handle_end_of_round(gid, game, sid)
+        else:  # start the clock of the player to move
+            tr = timer_data.white if move_data.turn == Colour.WHITE.value[0] else timer_data.black
+            await self.gc.clocks.arm(gid, move_timestamp + tr)
+
+    async def resync(self, sid):
+        """Send the full state of the current round to a client that missed a move"""
+        game, _ = await self.gc.get_game_by_sid(sid)
+        board = game.board
+        state = {
+            "ply": len(board.move_stack),
+            "fen": board.fen(),
+            "moveStack": [m.uci() for m in board.move_stack],
+            "turn": int(board.turn),
+            "isCheck": board.is_check(),
+            "legal": utils.encode_legal_moves(board),
+            "white": game.tr_white,
+            "black": game.tr_black,
+        }
+        await self.sio.emit("resync", state, to=sid)  # N.B. requesting client is connected to this worker
 
     async def offer_draw(self, sid):
         game, gid = await self.gc.get_game_by_sid(sid)
-        utils.publish_event(self.rmq.channel, gid, Event("drawOffer", None), next(p for p in game.players if p != sid))
+        await self.events.publish(gid, Event("drawOffer", None), next(p for p in game.players if p != sid))
 
     async def accept_draw(self, sid):
-        game, gid = await self.gc.get_game_by_sid(sid)
         outcome = Outcome.AGREEMENT.value
-        # update match score
-        game, match_score = self._update_match_score(game, outcome, None)
-        utils.publish_event(self.rmq.channel, gid, Event("move", {"winner": None, "outcome": outcome, "matchScore": match_score}))
-        await self.gc.handle_end_of_round(gid, game)  # NOTE: this will save the updated match score to redis and start next round
+
+        def agree(game: Game):
+            if self._round_decided(game):
+                raise CustomException("Round is over", sid)
+            # update match score
+            return self._update_match_score(game, outcome, None)[1]
+
+        game, gid, match_score = await self.gc.update_game_by_sid(sid, agree)
+        await self.events.publish(gid, Event("move", {"winner": None, "outcome": outcome, "matchScore": match_score}))
+        await self.gc.handle_end_of_round(gid, game, sid)  # NOTE: this will finish the match or start the next round
 
     async def resign(self, sid):
-        game, gid = await self.gc.get_game_by_sid(sid)
-        winner_ind = utils.opponent_ind(game.players.index(sid))
         outcome = Outcome.RESIGNATION.value
-        # update match score
-        game, match_score = self._update_match_score(game, outcome, game.players[winner_ind])
+
+        def concede(game: Game):
+            if self._round_decided(game):
+                raise CustomException("Round is over", sid)
+            winner_ind = utils.opponent_ind(game.players.index(sid))
+            # update match score
+            return winner_ind, self._update_match_score(game, outcome, game.players[winner_ind])[1]
+
+        game, gid, (winner_ind, match_score) = await self.gc.update_game_by_sid(sid, concede)
         # outcome event
-        utils.publish_event(self.rmq.channel, gid, Event("move", {"winner": winner_ind, "outcome": outcome, "matchScore": match_score}))
-        # handle end of round (+ save match score)
-        await self.gc.handle_end_of_round(gid, game)
+        await self.events.publish(gid, Event("move", {"winner": winner_ind, "outcome": outcome, "matchScore": match_score}))
+        # handle end of round
+        await self.gc.handle_end_of_round(gid, game, sid)
 
     async def flag(self, sid, flagged):
+        """Client reports a player ran out of time (usually ahead of the server clock, see time_out)"""
         flag_received = utils.get_time_now_ms()
-        game, gid = await self.gc.get_game_by_sid(sid)
+        gid = await self.gc.gr.get_gid(sid)
+        await self._time_out(gid, flag_received, flagged, self.TIMER_HALF_PRECISION, sid)
 
-        # validate flag request
-        if int(game.board.turn) != flagged:
-            self.logger.warning(f"Flag request in game {gid} from client {sid} dismissed as flagged colour does not match turn")
-            return
-        tr = game.tr_white if flagged == Colour.WHITE.value[0] else game.tr_black
-        move_time = flag_received - game.last_turn_timestamp
-        if move_time < tr - self.TIMER_HALF_PRECISION:
-            self.logger.warning(f"Flag request in game {gid} from client {sid} dismissed as player still has time remaining")
-            return
+    async def time_out(self, gid):
+        """Server clock deadline passed (clock scheduler callback)"""
+        await self._time_out(gid, utils.get_time_now_ms())
+
+    async def _time_out(self, gid, flag_received, flagged=None, precision=0, sid=None):
+        """
+        End the round if the player to move has run out of time
 
-        # set winner and outcome
-        winner_ind = utils.opponent_ind(flagged)
+        :param flagged: colour reported as out of time (None: whoever is to move)
+        :param precision: ms of clock difference tolerated
+        :param sid: ID of the client that reported it, if any
+        """
         outcome = Outcome.TIMEOUT.value
-        # update match score
-        try:
-            game, match_score = self._update_match_score(game, outcome, game.players[winner_ind])
-        except AssertionError:
-            self.logger.warning(f"Duplicate valid flag request received for game {gid}")
+        source = f"client {sid}" if sid else "server clock"
+
+        def time_out(game: Game):
+            # validate flag request
+            if len(game.players) < 2:
+                self.logger.warning(f"Flag request in game {gid} from {source} dismissed as the game has not started")
+                return None
+            if self._round_decided(game):
+                self.logger.warning(f"Duplicate valid flag request received for game {gid} from {source}")
+                return None
+            turn = int(game.board.turn)
+            if flagged is not None and turn != flagged:
+                self.logger.warning(f"Flag request in game {gid} from {source} dismissed as flagged colour does not match turn")
+                return None
+            tr = game.tr_white if turn == Colour.WHITE.value[0] else game.tr_black
+            move_time = flag_received - game.last_turn_timestamp
+            if move_time < tr - precision:
+                self.logger.warning(f"Flag request in game {gid} from {source} dismissed as player still has time remaining")
+                return None
+
+            # set winner and outcome
+            winner_ind = utils.opponent_ind(turn)
+            # update match score
+            return winner_ind, self._update_match_score(game, outcome, game.players[winner_ind])[1]
+
+        game, result = await self.gc.update_game(gid, time_out, sid)
+        if result is None:
             return
+        winner_ind, match_score = result
         # outcome event
-        utils.publish_event(self.rmq.channel, gid, Event("move", {"winner": winner_ind, "outcome": outcome, "matchScore": match_score}))
-        # save game
-        await self.gc.handle_end_of_round(gid, game)
+        await self.events.publish(gid, Event("move", {"winner": winner_ind, "outcome": outcome, "matchScore": match_score}))
+        # handle end of round
+        await self.gc.handle_end_of_round(gid, game, sid)
@@ -0,0 +1,44 @@
+from collections import OrderedDict
+
+from app.constants import POSITION_CACHE_SIZE
+from chess import Board
+
+
+class PositionCache:
+    """
+    LRU cache of live boards (with full move stacks) keyed by game ID
+
+    Each entry is tagged with the game state version it was saved with, so a board is only reused if no other
+    worker has written the game since. Boards are checked out (removed) while a handler works on them and
+    checked back in when the game is saved, so a failed handler can never leave a half-updated board behind.
+    Read-only handlers peek instead, leaving the entry in place.
+    """
+
+    def __init__(self, max_size=POSITION_CACHE_SIZE):
+        self.max_size = max_size
+        self.boards = OrderedDict()
+
+    def checkout(self, gid, version) -> Board | None:
+        entry = self.boards.pop(gid, None)
+        if entry is None or entry[0] != version:
+            return None
+        return entry[1]
+
+    def peek(self, gid, version) -> Board | None:
+        entry = self.boards.get(gid)
+        if entry is None or entry[0] != version:
+            return None
+        self.boards.move_to_end(gid)
+        return entry[1]
+
+    def checkin(self, gid, version, board: Board):
+        self.boards[gid] = (version, board)
+        self.boards.move_to_end(gid)
+        if len(self.boards) > self.max_size:
+            self.boards.popitem(last=False)  # evict least recently used
+
+    def evict(self, gid):
+        self.boards.pop(gid, None)
+
+    def clear(self):
+        self.boards.clear()
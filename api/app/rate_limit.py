@@ -1,31 +1,159 @@
 import asyncio
+import time
+from collections import Counter
+from logging import Logger
+from typing import Dict, List, Tuple
 
-from app.constants import BUCKET_CAPACITY
+import app.utils as utils
+from aioredis.client import Redis
+from app.constants import (
+    BUCKET_CAPACITY,
+    BUCKET_REFILL_RATE,
+    DEFAULT_EVENT_RATE_LIMIT,
+    EVENT_RATE_LIMITS,
+    IP_BUCKET_CAPACITY,
+    IP_BUCKET_REFILL_RATE,
+    STATS_FLUSH_INTERVAL,
+)
 
 
 class TokenBucketRateLimiter:
-    def __init__(self):
-        self.bucket = 100
-        self.refill_rate = 10  # per minute
-        self.refiller = None
+    """
+    Token buckets shared by all workers and nodes, stored in Redis
 
-    async def refill_tokens(self):
+    Each bucket is a hash of its token count and when it was last updated. Refill is continuous and computed lazily
+    from the elapsed time (by Redis' clock, so nodes never disagree) whenever a token is requested, so there's no
+    refill task. A request draws from several buckets at once (e.g. global and per client IP) - all or none.
+    """
+
+    # KEYS: buckets, ARGV: cost, then capacity and refill rate (tokens per ms) of each bucket
+    # returns 1 and takes cost tokens from every bucket if all have enough, otherwise 0 and takes nothing
+    CONSUME_SCRIPT = """
+    local time = redis.call("TIME")
+    local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+    local cost = tonumber(ARGV[1])
+    local levels = {}
+    for i, key in ipairs(KEYS) do
+        local capacity = tonumber(ARGV[2 * i])
+        local rate = tonumber(ARGV[2 * i + 1])
+        local bucket = redis.call("HMGET", key, "tokens", "updatedAt")
+        local tokens = tonumber(bucket[1]) or capacity
+        local elapsed = math.max(0, now - (tonumber(bucket[2]) or now))
+        levels[i] = math.min(capacity, tokens + elapsed * rate)
+        if levels[i] < cost then
+            return 0
+        end
+    end
+    for i, key in ipairs(KEYS) do
+        local capacity = tonumber(ARGV[2 * i])
+        local rate = tonumber(ARGV[2 * i + 1])
+        redis.call("HSET", key, "tokens", levels[i] - cost, "updatedAt", now)
+        redis.call("PEXPIRE", key, math.ceil(capacity / rate))  -- a full bucket is the same as no bucket
+    end
+    return 1
+    """
+
+    def __init__(self, redis_client: Redis):
+        self.consume_script = redis_client.register_script(self.CONSUME_SCRIPT)
+
+    async def consume(self, buckets: List[Tuple[str, int, float]], cost: int = 1) -> bool:
         """
-        Refills tokens in the token bucket every minute based on REFILL_RATE_MINUTE
+        Take tokens from every bucket, or none if any is short
+
+        :param buckets: (name, capacity, refill rate in tokens per second) of each bucket
+        :param cost: tokens taken from each bucket
+        :returns: whether the tokens were taken
         """
+        keys = [utils.get_redis_rate_limit_key(name) for name, _, _ in buckets]
+        args = [cost]
+        for _, capacity, rate in buckets:
+            args += [capacity, rate / 1000]
+        return bool(await self.consume_script(keys=keys, args=args))
+
+    async def consume_connection(self, ip: str) -> bool:
+        """Take a connection token from the global and the client IP's bucket"""
+        return await self.consume(
+            [
+                ("connections", BUCKET_CAPACITY, BUCKET_REFILL_RATE),
+                (f"connections:{ip}", IP_BUCKET_CAPACITY, IP_BUCKET_REFILL_RATE),
+            ]
+        )
+
+
+class EventRateLimiter:
+    """
+    Per client (sid) token buckets for each socket event, kept in process
+
+    All of a client's events are handled by the worker it is connected to, so unlike connection buckets these don't
+    need sharing - a check costs no Redis round trip, and floods are dropped before any game work is done. Drop counts
+    are flushed to Redis every STATS_FLUSH_INTERVAL so monitoring sees the totals of all workers (see /stats).
+    """
+
+    def __init__(self, redis_client: Redis, logger: Logger, limits: Dict[str, Tuple[int, float]] = EVENT_RATE_LIMITS):
+        self.redis_client = redis_client
+        self.logger = logger
+        self.limits = limits
+        self.buckets: Dict[str, Dict[str, List[float]]] = {}  # sid -> event -> [tokens, updated at (monotonic s)]
+        self.dropped = Counter()  # event -> events dropped since the last flush
+        self.flusher = None
+
+    def allow(self, sid: str, event: str) -> bool:
+        """Take a token from the sid's bucket for event, False if the event should be dropped"""
+        capacity, rate = self.limits.get(event, DEFAULT_EVENT_RATE_LIMIT)
+        now = time.monotonic()
+        bucket = self.buckets.setdefault(sid, {}).setdefault(event, [capacity, now])
+        tokens = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+        bucket[1] = now
+        if tokens < 1:
+            bucket[0] = tokens
+            self.dropped[event] += 1
+            return False
+        bucket[0] = tokens - 1
+        return True
+
+    def forget(self, sid: str):
+        """Drop a disconnected client's buckets"""
+        self.buckets.pop(sid, None)
+
+    async def flush_counters(self):
+        dropped, self.dropped = self.dropped, Counter()
+        if not dropped:
+            return
+        try:
+            async with self.redis_client.pipeline(transaction=False) as pipe:
+                for event, count in dropped.items():
+                    pipe.hincrby(utils.get_redis_stat_key("rate_limited"), event, count)
+                await pipe.execute()
+        except BaseException:  # keep the counts for the next flush (drops may have been counted meanwhile)
+            self.dropped.update(dropped)
+            raise
+        self.logger.warning(f"Dropped rate limited events: {dict(dropped)}")
+
+    async def run(self):
         while True:
-            await asyncio.sleep(60)
-            self.bucket = min(self.bucket + self.refill_rate, BUCKET_CAPACITY)
+            await asyncio.sleep(STATS_FLUSH_INTERVAL)
+            try:
+                await self.flush_counters()
+            except Exception as exc:
+                self.logger.error(f"Flushing rate limit counters failed: {exc}")
+
+    def start(self):
+        self.flusher = asyncio.create_task(self.run())
+
+    def stop(self):
+        if self.flusher:
+            self.flusher.cancel()
 
-    def start_refiller(self):
-        asyncio.create_task(self.refill_tokens())
 
-    def stop_refiller(self):
-        if self.refiller:
-            self.refiller.cancel()
+def get_client_ip(environ: Dict) -> str:
+    """
+    Client IP of a socket connection
 
-    def consume_token(self):
-        if self.bucket > 0:
-            self.bucket -= 1
-            return True
-        return False
+    Behind the platform's router the connecting address is the router's, and the client's is the last one appended to
+    X-Forwarded-For (earlier entries are client-supplied and can be spoofed)
+    """
+    forwarded_for = environ.get("HTTP_X_FORWARDED_FOR")
+    if forwarded_for:
+        return forwarded_for.split(",")[-1].strip()
+    client = environ["asgi.scope"].get("client")
+    return client[0] if client else "unknown"
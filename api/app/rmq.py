@@ -1,41 +1,130 @@
+import asyncio
 from logging import Logger
+from typing import Callable, Dict, List, Tuple
 
-from pika import URLParameters
-from pika.adapters.asyncio_connection import AsyncioConnection
-
-# TODO: just use aio-pika - much better than callback hell
+import aio_pika
+from aio_pika.abc import AbstractExchange, AbstractIncomingMessage, AbstractQueue, AbstractRobustChannel, AbstractRobustConnection
+from aio_pika.pool import Pool
+from app.constants import RMQ_CHANNEL_POOL_SIZE, RMQ_MAX_PENDING_PUBLISHES, RMQ_MAX_PUBLISH_ATTEMPTS, RMQ_PUBLISH_RETRY_DELAY
 
 
 class RMQConnectionManager:
-    def __init__(self, url: str, logger: Logger):
-        self.channel = None
+    """
+    asyncio-native RabbitMQ connection manager (aio-pika)
+
+      - robust connection: reconnects automatically and restores declared exchanges, queues, bindings and consumers
+      - topology and consumers are spread over a pool of channels, publishing uses a dedicated channel with
+        publisher confirms
+      - publishes made during one event loop tick are flushed together and their confirms awaited as a batch, failed
+        publishes are put back on a later batch (up to RMQ_MAX_PUBLISH_ATTEMPTS times)
+      - backpressure: publishers wait while too many publishes are unconfirmed (e.g. the broker has blocked the
+        connection, in which case aiormq holds outbound frames until it is unblocked)
+    """
+
+    def __init__(self, url: str, logger: Logger, pool_size=RMQ_CHANNEL_POOL_SIZE, max_pending=RMQ_MAX_PENDING_PUBLISHES):
+        self.url = url
         self.logger = logger
-        self.rmq_params = URLParameters(url)
-        self.rmq_conn = AsyncioConnection(
-            self.rmq_params,
-            on_open_callback=lambda conn: self.setup_rmq(conn, self.set_channel),
-            on_open_error_callback=lambda _, err: self.on_connection_open_error(
-                err,
-            ),
-            on_close_callback=lambda _, reason: self.on_connection_closed(reason),
-        )
-
-    def set_channel(self, ch):
-        self.channel = ch
-
-    def setup_rmq(self, conn, set_channel):
-        conn.channel(on_open_callback=lambda ch: self.on_channel_open(ch, conn, set_channel))
-
-    def on_connection_open_error(self, err):
-        self.logger.error("RMQ connection open failed: %s", err)
-
-    def on_connection_closed(self, reason):
-        self.logger.warning("RMQ connection closed: %s", reason)
-
-    def on_channel_closed(self, conn):
-        conn.close()
-
-    def on_channel_open(self, ch, conn, set_channel):
-        self.logger.info("RMQ channel opened")
-        set_channel(ch)
-        ch.add_on_close_callback(lambda _, __: self.on_channel_closed(conn))
+        self.pool_size = pool_size
+        self.max_pending = max_pending
+        self.connection: AbstractRobustConnection = None
+        self.channel_pool: Pool = None
+        self.publish_channel: AbstractRobustChannel = None
+        self.exchanges: Dict[str, AbstractExchange] = {}
+        self.publish_exchanges: Dict[str, AbstractExchange] = {}
+        self.queues: Dict[str, AbstractQueue] = {}
+        self.pending: List[Tuple[str, str, bytes, int]] = []  # (exchange, routing key, body, attempts)
+        self.unconfirmed = 0
+        self.flush_task: asyncio.Task = None
+        self.has_capacity = asyncio.Event()
+        self.has_capacity.set()
+
+    @property
+    def is_open(self):
+        return self.connection is not None and not self.connection.is_closed
+
+    async def connect(self):
+        self.connection = await aio_pika.connect_robust(self.url)
+        self.connection.reconnect_callbacks.add(lambda _: self.logger.info("RMQ connection re-established"))
+        self.connection.close_callbacks.add(lambda _, reason: self.logger.warning("RMQ connection closed: %s", reason))
+        self.channel_pool = Pool(self.connection.channel, max_size=self.pool_size)
+        self.publish_channel = await self.connection.channel(publisher_confirms=True)
+        self.logger.info("RMQ channels opened")
+
+    async def close(self):
+        if self.pending:
+            await self._flush()
+        if self.channel_pool is not None:
+            await self.channel_pool.close()
+        if self.is_open:
+            await self.connection.close()
+
+    # Topology
+
+    async def declare_exchange(self, name: str, exchange_type=aio_pika.ExchangeType.TOPIC):
+        async with self.channel_pool.acquire() as channel:
+            self.exchanges[name] = await channel.declare_exchange(name, exchange_type)
+
+    async def declare_queue(self, name: str, **kwargs):
+        async with self.channel_pool.acquire() as channel:
+            self.queues[name] = await channel.declare_queue(name, **kwargs)
+
+    async def bind_queue(self, queue: str, exchange: str, routing_key: str):
+        await self.queues[queue].bind(exchange, routing_key)
+
+    async def unbind_queue(self, queue: str, exchange: str, routing_key: str):
+        await self.queues[queue].unbind(exchange, routing_key)
+
+    # Consuming
+
+    async def consume(self, queue: str, on_message: Callable[[str, bytes], None]) -> str:
+        """Start consuming from a queue (auto ack), returns the consumer tag"""
+
+        async def callback(message: AbstractIncomingMessage):
+            on_message(message.routing_key, message.body)
+
+        return await self.queues[queue].consume(callback, no_ack=True)
+
+    # Publishing
+
+    async def publish(self, exchange: str, routing_key: str, body: bytes):
+        """Queue a message for the next batched flush, waiting if too many publishes are unconfirmed"""
+        while self.unconfirmed >= self.max_pending:
+            self.has_capacity.clear()
+            await self.has_capacity.wait()
+        self.pending.append((exchange, routing_key, body, 1))
+        self.unconfirmed += 1
+        if self.flush_task is None:  # flush everything published during this loop tick together
+            self.flush_task = asyncio.create_task(self._flush())
+
+    async def _get_publish_exchange(self, name: str):
+        if name not in self.publish_exchanges:
+            self.publish_exchanges[name] = await self.publish_channel.get_exchange(name, ensure=False)
+        return self.publish_exchanges[name]
+
+    async def _publish_one(self, exchange: str, routing_key: str, body: bytes):
+        ex = await self._get_publish_exchange(exchange)
+        await ex.publish(aio_pika.Message(body), routing_key=routing_key)
+
+    async def _flush(self):
+        batch, self.pending = self.pending, []
+        self.flush_task = None
+        results = await asyncio.gather(*(self._publish_one(*message[:3]) for message in batch), return_exceptions=True)
+        retries = []
+        for (exchange, routing_key, body, attempts), result in zip(batch, results):
+            if not isinstance(result, Exception):
+                continue
+            if attempts < RMQ_MAX_PUBLISH_ATTEMPTS:
+                self.logger.warning(f"RMQ publish to {exchange} ({routing_key}) failed: {result!r}, retrying...")
+                retries.append((exchange, routing_key, body, attempts + 1))
+            else:
+                self.logger.error(f"RMQ publish to {exchange} ({routing_key}) failed {attempts} times, giving up: {result!r}")
+        self.unconfirmed -= len(batch) - len(retries)  # retried messages still count towards backpressure
+        if retries:
+            asyncio.get_running_loop().call_later(RMQ_PUBLISH_RETRY_DELAY, self._retry, retries)
+        if self.unconfirmed < self.max_pending:
+            self.has_capacity.set()
+
+    def _retry(self, messages: List[Tuple[str, str, bytes, int]]):
+        self.pending[:0] = messages  # ahead of anything published since
+        if self.flush_task is None:
+            self.flush_task = asyncio.create_task(self._flush())
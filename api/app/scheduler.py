@@ -0,0 +1,116 @@
+import asyncio
+import heapq
+from logging import Logger
+from typing import Awaitable, Callable, Dict, List, Tuple
+
+import app.utils as utils
+from aioredis.client import Redis
+from app.constants import DEADLINE_SWEEP_GRACE, DEADLINE_SWEEP_INTERVAL
+
+
+class DeadlineScheduler:
+    """
+    Durable per-game deadlines (clock flags, next round starts): fires a callback with the game ID once one passes
+
+    Deadlines live in a Redis sorted set and a per-worker min-heap, and are claimed atomically so each fires once.
+    """
+
+    # removes a deadline if it has not been re-armed since (score still matches), returns whether it was claimed
+    CLAIM_SCRIPT = """
+    local deadline = redis.call("ZSCORE", KEYS[1], ARGV[1])
+    if deadline and tonumber(deadline) == tonumber(ARGV[2]) then
+        redis.call("ZREM", KEYS[1], ARGV[1])
+        return 1
+    end
+    return 0
+    """
+
+    def __init__(self, redis_client: Redis, key: str, logger: Logger):
+        self.redis_client = redis_client
+        self.key = key  # sorted set of gid -> deadline (ms)
+        self.logger = logger
+        self.claim_script = redis_client.register_script(self.CLAIM_SCRIPT)
+        self.heap: List[Tuple[int, str]] = []  # (deadline, gid)
+        self.deadlines: Dict[str, int] = {}  # gid -> current deadline
+        self.on_expiry: Callable[[str], Awaitable] = None
+        self.wakeup = asyncio.Event()
+        self.worker = None
+
+    def _push(self, gid: str, deadline: int):
+        self.deadlines[gid] = deadline
+        heapq.heappush(self.heap, (deadline, gid))
+        if len(self.heap) > 2 * len(self.deadlines) + 1024:  # drop superseded entries
+            self.heap = [(d, g) for d, g in self.heap if self.deadlines.get(g) == d]
+            heapq.heapify(self.heap)
+        if self.heap[0][1] == gid:  # new earliest deadline
+            self.wakeup.set()
+
+    async def arm(self, gid: str, deadline: int):
+        """Set (or move) a game's deadline (ms timestamp)"""
+        await self.redis_client.zadd(self.key, {gid: deadline})
+        self._push(gid, deadline)
+
+    async def disarm(self, gid: str):
+        """Remove a game's deadline (round decided or game over)"""
+        self.deadlines.pop(gid, None)
+        await self.redis_client.zrem(self.key, gid)
+
+    async def _fire(self, gid: str, deadline: int):
+        try:
+            if not await self.claim_script(keys=[self.key], args=[gid, deadline]):
+                return  # re-armed, disarmed or fired by another worker
+            await self.on_expiry(gid)
+        except Exception as exc:
+            self.logger.error(f"Deadline handling ({self.key}) failed for game {gid}: {exc}")
+
+    async def _load(self, max_deadline="+inf"):
+        """Add deadlines stored in Redis (up to max_deadline) to the heap"""
+        entries = await self.redis_client.zrangebyscore(self.key, "-inf", max_deadline, withscores=True)
+        for gid, deadline in entries:
+            gid, deadline = gid.decode(), int(deadline)
+            if self.deadlines.get(gid) != deadline:
+                self._push(gid, deadline)
+        return len(entries)
+
+    async def run(self):
+        last_sweep = utils.get_time_now_ms()
+        while True:
+            now = utils.get_time_now_ms()
+            while self.heap and self.heap[0][0] <= now:
+                deadline, gid = heapq.heappop(self.heap)
+                if self.deadlines.get(gid) != deadline:  # superseded
+                    continue
+                del self.deadlines[gid]
+                asyncio.create_task(self._fire(gid, deadline))
+
+            if now - last_sweep >= DEADLINE_SWEEP_INTERVAL * 1000:
+                last_sweep = now
+                try:
+                    await self._load(now - DEADLINE_SWEEP_GRACE)
+                except Exception as exc:
+                    self.logger.error(f"Deadline sweep ({self.key}) failed: {exc}")
+                continue
+
+            timeout = DEADLINE_SWEEP_INTERVAL
+            if self.heap:
+                timeout = min(timeout, (self.heap[0][0] - now) / 1000)
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def start(self, on_expiry: Callable[[str], Awaitable]):
+        """
+        Rebuild deadlines from Redis and start firing them
+
+        :param on_expiry: called with the game ID when a deadline passes
+        """
+        self.on_expiry = on_expiry
+        n_deadlines = await self._load()
+        self.logger.info(f"Deadline scheduler ({self.key}) started with {n_deadlines} deadlines")
+        self.worker = asyncio.create_task(self.run())
+
+    def stop(self):
+        if self.worker:
+            self.worker.cancel()
@@ -0,0 +1,297 @@
+import asyncio
+from logging import Logger
+from typing import Dict, List
+
+import app.utils as utils
+from aioredis.client import Redis
+from app.constants import (
+    GAS_PRICE_BUMP,
+    MAX_GAS_PRICE,
+    SETTLEMENT_BACKOFF,
+    SETTLEMENT_BATCH_SIZE,
+    SETTLEMENT_LEASE,
+    SETTLEMENT_MAX_IN_FLIGHT,
+    SETTLEMENT_MAX_ATTEMPTS,
+    SETTLEMENT_POLL_INTERVAL,
+    SETTLEMENT_RECEIPT_TIMEOUT,
+    SETTLEMENT_RECORD_TTL,
+)
+from app.events import EventBus
+from app.game_contract import GameContract
+from app.models import Event, SentTx, Settlement
+from eth_utils import encode_hex
+from web3.exceptions import TimeExhausted
+
+
+class SettlementQueue:
+    """
+    Durable queue of on-chain settlements (game cancellations and match results) stored in Redis
+
+    Every worker claims due settlements (a lease, so a dead worker's are picked up again) and settles each in its own
+    task, retrying with backoff and replacing transactions that are not mined within SETTLEMENT_RECEIPT_TIMEOUT.
+    """
+
+    # job hash + sorted set of gid -> time (ms) the job is next due
+    ENQUEUE_SCRIPT = """
+    if redis.call("EXISTS", KEYS[1]) == 1 then
+        return 0
+    end
+    redis.call("HSET", KEYS[1], "kind", ARGV[1], "winner", ARGV[2], "attempts", 0, "status", "pending")
+    redis.call("ZADD", KEYS[2], ARGV[3], ARGV[4])
+    return 1
+    """
+
+    # claims due jobs by pushing their due time back by the lease duration
+    CLAIM_SCRIPT = """
+    local due = redis.call("ZRANGEBYSCORE", KEYS[1], "-inf", ARGV[1], "LIMIT", 0, ARGV[3])
+    for _, gid in ipairs(due) do
+        redis.call("ZADD", KEYS[1], ARGV[2], gid)
+    end
+    return due
+    """
+
+    # transaction hash per nonce: what it settles and every transaction sent with the nonce (shared by a batch's games)
+    RECORD_TX_SCRIPT = """
+    if redis.call("EXISTS", KEYS[1]) == 1 then
+        return 0
+    end
+    redis.call("HSET", KEYS[1], "fn", ARGV[1], "gids", ARGV[2], "winners", ARGV[3], "gas_price", ARGV[4], "tx_hashes", ARGV[5], "sent_at", ARGV[6])
+    redis.call("EXPIRE", KEYS[1], ARGV[7])
+    return 1
+    """
+
+    # takes the turn to replace a nonce's transaction: 1 for one caller per gas price, -1 if the nonce has no record
+    CLAIM_REPLACEMENT_SCRIPT = """
+    local gas_price = redis.call("HGET", KEYS[1], "gas_price")
+    if not gas_price then
+        return -1
+    end
+    if gas_price ~= ARGV[1] then
+        return 0
+    end
+    redis.call("HSET", KEYS[1], "gas_price", ARGV[2], "sent_at", ARGV[3])
+    return 1
+    """
+
+    def __init__(self, redis_client: Redis, contract: GameContract, events: EventBus, logger: Logger):
+        self.redis_client = redis_client
+        self.contract = contract
+        self.events = events
+        self.logger = logger
+        self.enqueue_script = redis_client.register_script(self.ENQUEUE_SCRIPT)
+        self.claim_script = redis_client.register_script(self.CLAIM_SCRIPT)
+        self.record_tx_script = redis_client.register_script(self.RECORD_TX_SCRIPT)
+        self.claim_replacement_script = redis_client.register_script(self.CLAIM_REPLACEMENT_SCRIPT)
+        self.settling: Dict[str, asyncio.Task] = {}  # gid -> task settling it on this worker
+        self.worker = None
+
+    async def enqueue(self, gid: str, kind: Settlement, winner_addr: str = None):
+        """Queue a settlement for a game (no-op if one has already been queued)"""
+        queued = await self.enqueue_script(
+            keys=[utils.get_redis_settlement_key(gid), utils.get_redis_settlements_due_key()],
+            args=[kind.value, winner_addr or "", utils.get_time_now_ms(), gid],
+        )
+        if queued:
+            self.logger.info(f"Settlement ({kind.value}) queued for game {gid}")
+        else:
+            self.logger.warning(f"Duplicate settlement ({kind.value}) for game {gid} ignored")
+
+    async def process_due(self) -> List[asyncio.Task]:
+        """Claim due jobs and settle each in its own task, so waiting for receipts never holds up claiming"""
+        limit = min(SETTLEMENT_BATCH_SIZE, SETTLEMENT_MAX_IN_FLIGHT - len(self.settling))
+        if limit <= 0:
+            return []
+        now = utils.get_time_now_ms()
+        gids = await self.claim_script(keys=[utils.get_redis_settlements_due_key()], args=[now, now + SETTLEMENT_LEASE * 1000, limit])
+        tasks = []
+        for gid in (gid.decode() for gid in gids):
+            if gid in self.settling:  # lease ran out while this worker is still settling it
+                continue
+            task = asyncio.create_task(self._settle(gid))
+            task.add_done_callback(lambda task, gid=gid: self._settled(gid, task))
+            self.settling[gid] = task
+            tasks.append(task)
+        return tasks
+
+    def _settled(self, gid: str, task: asyncio.Task):
+        self.settling.pop(gid, None)
+        if not task.cancelled() and task.exception() is not None:
+            self.logger.error(f"Settlement of game {gid} errored: {task.exception()}")
+
+    async def _send(self, gid, job) -> SentTx:
+        kind = Settlement(job["kind"])
+        if kind == Settlement.CANCEL:
+            return await self.contract.cancel_game(gid)
+        return await self.contract.declare_result(gid, job["winner"] if kind == Settlement.WINNER else None)
+
+    async def _record_tx(self, gid, job, tx: SentTx, tx_hashes):
+        job.update(tx_hashes=",".join(tx_hashes), nonce=tx.nonce, gas_price=tx.gas_price, sent_at=utils.get_time_now_ms())
+        await self.redis_client.hset(
+            utils.get_redis_settlement_key(gid),
+            mapping={k: job[k] for k in ("tx_hashes", "nonce", "gas_price", "sent_at")},
+        )
+
+    async def _record_batch(self, job, tx: SentTx):
+        fn = "cancelGame" if Settlement(job["kind"]) == Settlement.CANCEL else "declareResults"
+        await self.record_tx_script(
+            keys=[utils.get_redis_settlement_tx_key(tx.nonce)],
+            args=[fn, ",".join(tx.gids), ",".join(tx.winners), tx.gas_price, tx.tx_hash, job["sent_at"], SETTLEMENT_RECORD_TTL],
+        )
+
+    async def _get_batch(self, nonce):
+        return {k.decode(): v.decode() for k, v in (await self.redis_client.hgetall(utils.get_redis_settlement_tx_key(nonce))).items()}
+
+    async def _sync_batch(self, gid, job, tx_hashes):
+        """Adopt replacements of the job's transaction sent for other games of its batch"""
+        batch = await self._get_batch(job["nonce"])
+        if not batch:
+            return tx_hashes
+        replacements = [tx_hash for tx_hash in batch["tx_hashes"].split(",") if tx_hash not in tx_hashes]
+        if not replacements and batch["gas_price"] == job["gas_price"]:
+            return tx_hashes
+        tx_hashes = tx_hashes + replacements
+        job.update(tx_hashes=",".join(tx_hashes), gas_price=batch["gas_price"], sent_at=batch["sent_at"])
+        await self.redis_client.hset(
+            utils.get_redis_settlement_key(gid),
+            mapping={k: job[k] for k in ("tx_hashes", "gas_price", "sent_at")},
+        )
+        return tx_hashes
+
+    async def _clear_tx(self, gid, job):
+        """Forget the job's nonce, so its next attempt sends a new transaction (unless one it sent settled the game)"""
+        job["nonce"] = ""
+        await self.redis_client.hdel(utils.get_redis_settlement_key(gid), "nonce", "gas_price", "sent_at")
+
+    async def _replace(self, gid, job, tx_hashes):
+        """
+        Resend a stuck transaction with the same nonce and a higher gas price
+
+        A batch is resent whole, by whichever of its games gets to it first - the others adopt the replacement
+        """
+        gas_price = int(job["gas_price"])
+        if gas_price >= MAX_GAS_PRICE:  # can't outbid any further, keep waiting
+            job["sent_at"] = utils.get_time_now_ms()
+            await self.redis_client.hset(utils.get_redis_settlement_key(gid), "sent_at", job["sent_at"])
+            return
+        nonce = int(job["nonce"])
+        new_gas_price = min(max(int(gas_price * GAS_PRICE_BUMP), await self.contract.w3.eth.gas_price), MAX_GAS_PRICE)
+        claimed = await self.claim_replacement_script(
+            keys=[utils.get_redis_settlement_tx_key(nonce)],
+            args=[gas_price, new_gas_price, utils.get_time_now_ms()],
+        )
+        if claimed == 0:  # another game of the batch is replacing it, adopted on the next check
+            return
+        if claimed == -1:
+            await self._clear_tx(gid, job)
+            raise RuntimeError(f"no record of the transaction with nonce {nonce} to replace")
+
+        batch = await self._get_batch(nonce)
+        gids = batch["gids"].split(",")
+        try:
+            if batch["fn"] == "cancelGame":
+                tx = await self.contract.cancel_game(gids[0], nonce, new_gas_price)
+            else:
+                tx = await self.contract.replace_results(gids, batch["winners"].split(","), nonce, new_gas_price)
+        except Exception as exc:
+            if not self.contract.is_nonce_error(exc):
+                raise
+            # the nonce was mined in the meantime - by one of our transactions if the next check finds its receipt
+            await self._clear_tx(gid, job)
+            raise RuntimeError(f"transaction with nonce {nonce} could not be replaced: {exc}")
+        await self.redis_client.hset(utils.get_redis_settlement_tx_key(nonce), "tx_hashes", f"{batch['tx_hashes']},{tx.tx_hash}")
+        self.logger.warning(f"Settlement transaction {nonce} ({len(gids)} games) stuck, replaced with {tx.tx_hash} at {tx.gas_price} wei")
+        await self._record_tx(gid, job, tx, tx_hashes + [tx.tx_hash])
+
+    async def _find_receipt(self, gid, tx_hashes):
+        """Receipt of whichever of a settlement's transactions (original, replacements or resends) settled the game"""
+        for tx_hash in reversed(tx_hashes):
+            receipt = await self.contract.get_receipt(tx_hash)
+            if receipt is not None and self.contract.failure_reason(receipt, gid) is None:
+                return receipt
+        return None
+
+    async def _settle(self, gid):
+        key = utils.get_redis_settlement_key(gid)
+        job = {k.decode(): v.decode() for k, v in (await self.redis_client.hgetall(key)).items()}
+        if job.get("status") != "pending":  # already settled or given up on
+            await self.redis_client.zrem(utils.get_redis_settlements_due_key(), gid)
+            return
+
+        try:
+            tx_hashes = job["tx_hashes"].split(",") if job.get("tx_hashes") else []
+            if job.get("nonce"):
+                tx_hashes = await self._sync_batch(gid, job, tx_hashes)
+            receipt = await self._find_receipt(gid, tx_hashes)
+            if receipt is None:
+                if not job.get("nonce"):  # no transaction in flight
+                    tx = await self._send(gid, job)
+                    await self._record_tx(gid, job, tx, tx_hashes + [tx.tx_hash])
+                    await self._record_batch(job, tx)
+                elif utils.get_time_now_ms() - int(job["sent_at"]) >= SETTLEMENT_RECEIPT_TIMEOUT * 1000:
+                    await self._replace(gid, job, tx_hashes)
+                tx_hashes = job["tx_hashes"].split(",")
+
+                waited = (utils.get_time_now_ms() - int(job["sent_at"])) / 1000
+                try:
+                    receipt = await self.contract.wait_for_receipt(tx_hashes[-1], max(SETTLEMENT_RECEIPT_TIMEOUT - waited, 1))
+                except TimeExhausted:
+                    receipt = None
+
+                reason = receipt and self.contract.failure_reason(receipt, gid)
+                if receipt is None or reason:  # an earlier transaction may still have settled it
+                    earlier = await self._find_receipt(gid, tx_hashes[:-1])
+                    if earlier is not None:
+                        receipt, reason = earlier, None
+                if reason:  # nonce was consumed, the next attempt sends a new transaction
+                    await self._clear_tx(gid, job)
+                    raise RuntimeError(f"transaction {tx_hashes[-1]} did not settle the game: {reason}")
+
+            if receipt is None:  # still pending - check again (replacing it) on the next poll
+                await self.redis_client.zadd(utils.get_redis_settlements_due_key(), {gid: utils.get_time_now_ms()})
+                return
+        except Exception as exc:
+            await self._retry(gid, job, exc)
+            return
+
+        tx_hash = encode_hex(receipt["transactionHash"])
+        async with self.redis_client.pipeline(transaction=True) as pipe:
+            pipe.hset(key, mapping={"status": "settled", "tx_hash": tx_hash})
+            pipe.expire(key, SETTLEMENT_RECORD_TTL)
+            pipe.zrem(utils.get_redis_settlements_due_key(), gid)
+            await pipe.execute()
+        self.logger.info(f"Game {gid} settled ({job['kind']}). Transaction hash: {tx_hash}")
+        await self.events.publish(gid, Event("settled", {"outcome": job["kind"], "txHash": tx_hash}))
+
+    async def _retry(self, gid, job, exc):
+        key = utils.get_redis_settlement_key(gid)
+        attempts = int(job["attempts"]) + 1
+        if attempts >= SETTLEMENT_MAX_ATTEMPTS:
+            self.logger.error(f"Settlement of game {gid} failed {attempts} times, giving up: {exc}")
+            async with self.redis_client.pipeline(transaction=True) as pipe:
+                pipe.hset(key, mapping={"attempts": attempts, "status": "failed"})
+                pipe.zrem(utils.get_redis_settlements_due_key(), gid)
+                await pipe.execute()
+            return
+        backoff = min(SETTLEMENT_BACKOFF[0] * 2 ** (attempts - 1), SETTLEMENT_BACKOFF[1])
+        self.logger.error(f"Settlement of game {gid} failed (attempt {attempts}): {exc}. Retrying in {backoff}s")
+        async with self.redis_client.pipeline(transaction=True) as pipe:
+            pipe.hset(key, "attempts", attempts)
+            pipe.zadd(utils.get_redis_settlements_due_key(), {gid: utils.get_time_now_ms() + backoff * 1000})
+            await pipe.execute()
+
+    async def run(self):
+        while True:
+            try:
+                await self.process_due()
+            except Exception as exc:
+                self.logger.error(f"Settlement worker error: {exc}")
+            await asyncio.sleep(SETTLEMENT_POLL_INTERVAL)
+
+    def start(self):
+        self.worker = asyncio.create_task(self.run())
+
+    def stop(self):
+        if self.worker:
+            self.worker.cancel()
+        for task in list(self.settling.values()):  # leased, so another worker resumes them
+            task.cancel()
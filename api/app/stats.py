@@ -1,9 +1,17 @@
+import asyncio
+import json
+from logging import Logger
+
+from aioredis.client import Redis
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import PlainTextResponse
 from starlette.status import HTTP_500_INTERNAL_SERVER_ERROR
 import app.utils as utils
+from app.constants import STATS_FLUSH_INTERVAL
+from app.metrics import Counter, Histogram, Registry, registry
 
 
-def build_stats_router(redis_client):
+def build_stats_router(redis_client: Redis, logger: Logger):
     router = APIRouter(prefix="/stats", tags=["stats"])
 
     async def get_stats():
@@ -16,9 +24,14 @@ def build_stats_router(redis_client):
         try:
             n_games = await redis_client.get(utils.get_redis_stat_key("n_games"))
             total_wagered = await redis_client.get(utils.get_redis_stat_key("total_wagered"))
-            return {"gamesPlayed": n_games, "totalWagered": total_wagered}
+            rate_limited = await redis_client.hgetall(utils.get_redis_stat_key("rate_limited"))
+            return {
+                "gamesPlayed": n_games,
+                "totalWagered": total_wagered,
+                "rateLimited": {event.decode(): int(count) for event, count in rate_limited.items()},  # dropped events
+            }
         except Exception as e:
-            print(e)
+            logger.error(f"Error fetching stats: {e}")
             raise HTTPException(
                 status_code=HTTP_500_INTERNAL_SERVER_ERROR,
                 detail="An error occurred while fetching usage stats",
@@ -26,3 +39,126 @@ def build_stats_router(redis_client):
 
     router.add_api_route("", get_stats)
     return router
+
+
+class MetricsExporter:
+    """
+    Aggregates the metrics of all workers in Redis and renders them in the Prometheus text format
+
+    Workers only touch in-process counts on the hot path, and add them to the metric's Redis hash every
+    STATS_FLUSH_INTERVAL (a field per label set, and per bucket for histograms), so the totals cover every worker.
+    """
+
+    def __init__(self, redis_client: Redis, logger: Logger, metrics: Registry = registry):
+        self.redis_client = redis_client
+        self.logger = logger
+        self.metrics = metrics
+        self.flusher = None
+
+    async def flush(self):
+        drained = [(metric, metric.drain()) for metric in self.metrics.metrics]
+        try:
+            async with self.redis_client.pipeline(transaction=False) as pipe:
+                for metric, values in drained:
+                    key = utils.get_redis_metric_key(metric.name)
+                    for labels, value in values.items():
+                        if isinstance(metric, Counter):
+                            pipe.hincrbyfloat(key, labels, value)
+                            continue
+                        *counts, total = value
+                        for i, count in enumerate(counts):
+                            if count:
+                                pipe.hincrby(key, f"{labels}|{i}", count)
+                        pipe.hincrbyfloat(key, f"{labels}|sum", total)
+                await pipe.execute()
+        except BaseException:  # keep the values for the next flush (more may have been counted meanwhile)
+            for metric, values in drained:
+                metric.restore(values)
+            raise
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(STATS_FLUSH_INTERVAL)
+            try:
+                await self.flush()
+            except Exception as exc:
+                self.logger.error(f"Flushing metrics failed: {exc}")
+
+    def start(self):
+        self.flusher = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.flusher:
+            self.flusher.cancel()
+        await self.flush()  # don't lose this worker's last counts
+
+    async def render(self):
+        async with self.redis_client.pipeline(transaction=False) as pipe:
+            for metric in self.metrics.metrics:
+                pipe.hgetall(utils.get_redis_metric_key(metric.name))
+            stored = await pipe.execute()
+
+        lines = []
+        for metric, fields in zip(self.metrics.metrics, stored):
+            lines += [f"# HELP {metric.name} {metric.description}", f"# TYPE {metric.name} {metric.kind}"]
+            if isinstance(metric, Histogram):
+                lines += self._render_histogram(metric, fields)
+            else:
+                for labels, value in sorted(fields.items()):
+                    lines.append(f"{metric.name}{_labels(metric.labels, labels.decode())} {float(value)!r}")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _render_histogram(metric: Histogram, fields):
+        series = {}  # labels -> [bucket counts..., sum]
+        for field, value in fields.items():
+            labels, part = field.decode().rsplit("|", 1)
+            values = series.setdefault(labels, [0] * (len(metric.buckets) + 1) + [0.0])
+            if part == "sum":
+                values[-1] = float(value)
+            else:
+                values[int(part)] = int(value)
+
+        lines = []
+        for labels, (*counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip([*(f"{b:g}" for b in metric.buckets), "+Inf"], counts):
+                cumulative += count
+                lines.append(f"{metric.name}_bucket{_labels(metric.labels, labels, le=bound)} {cumulative}")
+            lines.append(f"{metric.name}_sum{_labels(metric.labels, labels)} {total!r}")
+            lines.append(f"{metric.name}_count{_labels(metric.labels, labels)} {cumulative}")
+        return lines
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values_json: str, **extra):
+    pairs = [*zip(names, json.loads(values_json)), *extra.items()]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def build_metrics_router(exporter: MetricsExporter):
+    router = APIRouter(tags=["metrics"])
+
+    async def get_metrics():
+        """
+        Prometheus metrics (socket event and hot path step latencies, errors etc.) of all workers
+
+        Returns:
+            str: The metrics in the Prometheus text exposition format
+        """
+        try:
+            return PlainTextResponse(await exporter.render(), media_type="text/plain; version=0.0.4")
+        except Exception as e:
+            exporter.logger.error(f"Error rendering metrics: {e}")
+            raise HTTPException(
+                status_code=HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="An error occurred while fetching metrics",
+            )
+
+    router.add_api_route("/metrics", get_metrics)
+    return router
@@ -1,48 +1,159 @@
-import copy
 import json
+import os
+import socket
 import time
-from app.constants import BROADCAST_KEY
-from app.models import Event, Game
-from chess import Board
-from pika.channel import Channel
+import uuid
+from typing import Dict, Iterable, List
 
+from app import codec
+from app.metrics import timed
+from app.models import Game
+from app.position_cache import PositionCache
+from chess import Board, Move
 
-def get_queue_name(gid: str, sid: str):
-    return f"{gid}::{sid}"
+
+def get_worker_queue_name():
+    return f"worker.{socket.gethostname()}.{os.getpid()}"
+
+
+def get_routing_key(gid: str, rk: str):
+    """Routing key for events to a game's player (sid) or to all of its players (BROADCAST_KEY)"""
+    return f"game.{gid}.{rk}"
+
+
+def parse_routing_key(routing_key: str):
+    """Inverse of get_routing_key, returns (gid, sid or BROADCAST_KEY)"""
+    _, gid, rk = routing_key.split(".", 2)
+    return gid, rk
 
 
 def get_redis_game_key(gid: str):
     return f"game:{gid}"
 
 
+def get_redis_player_key(sid: str):
+    return f"player:{sid}"
+
+
+def get_redis_live_games_key():
+    return "live_games"
+
+
+def get_redis_clock_deadlines_key():
+    return "clock_deadlines"
+
+
+def get_redis_round_starts_key():
+    return "round_starts"
+
+
+def get_redis_settlement_key(gid: str):
+    return f"settlement:{gid}"
+
+
+def get_redis_settlements_due_key():
+    return "settlements_due"
+
+
+def get_redis_settlement_tx_key(nonce: int):
+    return f"settlement_tx:{nonce}"
+
+
+def get_redis_nonce_key(address: str):
+    return f"nonce:{address}"
+
+
+def get_redis_released_nonces_key(address: str):
+    return f"released_nonces:{address}"
+
+
+def get_redis_exchange_rate_key(fiat: str):
+    return f"exchange_rate:{fiat}"
+
+
+def get_redis_exchange_rate_lock_key(fiat: str):
+    return f"exchange_rate_lock:{fiat}"
+
+
+def get_redis_rate_limit_key(bucket: str):
+    return f"rate_limit:{bucket}"
+
+
 def get_redis_stat_key(stat_tag: str):
     return f"stat:{stat_tag}"
 
 
+def get_redis_metric_key(name: str):
+    return f"metric:{name}"
+
+
+def gid_to_bytes(gid: str):
+    """Contract key of a game: the 16 bytes of its UUID (see ui/src/utils/index.ts gidToBytes)"""
+    return uuid.UUID(gid).bytes
+
+
 def opponent_ind(turn: int):
     return int(not bool(turn))
 
 
-def serialise_game_state(game: Game):
-    """Serialise game state to JSON string for storage in Redis"""
-    if not game:
-        return
-    game_dict = copy.deepcopy(game.__dict__)
-    game_dict["board"] = game.board.fen()
-    return json.dumps(game_dict)
+@timed("load_board")
+def load_board(fen: str, moves: List[Move]):
+    """Rebuild board by replaying the round's moves from the FEN they were played from (keeps the history needed for repetition claims)"""
+    board = Board(fen)
+    for move in moves:
+        board.push(move)
+    return board
 
 
-def deserialise_game_state(game: str):
-    """Deserialise game state from Redis JSON string"""
+@timed("serialise")
+def serialise_game_state(game: Game, fields: Iterable[str] = None):
+    """Serialise game state (or just the given attributes) to compact binary hash fields for storage in Redis"""
     if not game:
         return
-    game_dict = json.loads(game)
-    game_dict["board"] = Board(game_dict["board"])
-    return Game(**game_dict)
+    return codec.encode_fields(game, fields)
 
 
-def publish_event(channel: Channel, gid: str, event: Event, rk=BROADCAST_KEY):
-    channel.basic_publish(exchange=gid, routing_key=rk, body=json.dumps(event.__dict__))
+@timed("deserialise")
+def deserialise_game_state(game: Dict[bytes, bytes] | bytes | str, position_cache: PositionCache = None, gid: str = None, checkout: bool = False):
+    """
+    Deserialise game state from a Redis hash (or legacy JSON string), reusing a cached board if it is
+    still current. The board is only taken out of the cache with checkout (i.e. when the caller will modify it)
+    """
+    if not game:
+        return
+    legacy = not isinstance(game, dict)
+    if not legacy:
+        game_dict, fen, move_codes = codec.decode_fields(game)
+    else:  # legacy JSON state
+        game_dict = json.loads(game)
+        fen, move_codes = game_dict.pop("board"), ()  # current position, no move history
+    board = None
+    if position_cache:
+        lookup = position_cache.checkout if checkout else position_cache.peek
+        board = lookup(gid, game_dict.get("version", 0))
+    if board is None:
+        board = load_board(fen, [codec.decode_move(code) for code in move_codes])
+    game_dict["board"] = board
+    game = Game(**game_dict)
+    if not legacy:
+        game.dirty.clear()  # legacy states stay fully dirty so they are rewritten as a hash
+    return game
+
+
+# square (0 = a1 ... 63 = h8) -> character, two characters per move in encode_legal_moves
+SQUARE_ALPHABET = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_"
+
+
+@timed("legal_moves")
+def encode_legal_moves(board: Board):
+    """
+    Compact encoding of a position's legal moves for clients: from and to square as one character each
+
+    Promotions are not distinguished (clients only check the squares, and auto-promote to a queen), so each from/to pair
+    is sent once
+    """
+    pairs = dict.fromkeys(SQUARE_ALPHABET[m.from_square] + SQUARE_ALPHABET[m.to_square] for m in board.legal_moves)
+    return "".join(pairs)
 
 
 def get_time_now_ms():
@@ -1,6 +1,12 @@
 # Code translated from https://wismuth.com/elo/calculator.html
 
 import math
+import os
+from collections import OrderedDict
+from typing import Iterable, List, Tuple
+
+import numpy as np
+from app.constants import ELO_ROUNDING, ODDS_CACHE_SIZE, ODDS_TABLE_AVE, ODDS_TABLE_DIFF, VALID_N_ROUNDS_RANGE
 from pyerf import erf, erfinv
 
 FIRST_MOVE_ADVANTAGE = 0.1
@@ -101,8 +107,193 @@ def best_of_n(n, elo_1, elo_2):
     return compute_prob_best_of(n, win_prob, draw_prob_)
 
 
-elo_1 = 1000
-elo_2 = 800
+def game_probs(elo_1, elo_2):
+    """Probabilities of player 1 winning and drawing a single game (averaged over both colours)"""
+    draw_prob_ = draw_prob(elo_1, elo_2)
+    return elo_normal(elo_1 - elo_2) - draw_prob_ / 2, draw_prob_
+
+
+def compute_prob_best_of_many(n, win_prob, draw_prob):
+    """
+    Vectorised compute_prob_best_of: odds of best-of-n matches for arrays of single game win / draw probabilities
+
+    Each table diagonal (fixed number of games played) is computed from the next one for all matches at once.
+
+    :returns: arrays of win, lose and draw probabilities
+    """
+    win_prob = np.asarray(win_prob, dtype=np.float64)[:, None]
+    draw_prob = np.asarray(draw_prob, dtype=np.float64)[:, None]
+    lose_prob = 1 - win_prob - draw_prob
+
+    # Boundary conditions (all n games played), indexed by player 1's half-points.
+    i = np.arange(2 * n + 1)
+    win_table = np.broadcast_to((i > 2 * n - i).astype(np.float64), (len(win_prob), 2 * n + 1))
+    draw_table = np.broadcast_to((i == n).astype(np.float64), (len(win_prob), 2 * n + 1))
+
+    # Fill rest using recurrence, one diagonal at a time.
+    for _ in range(n):
+        win_table = win_prob * win_table[:, 2:] + draw_prob * win_table[:, 1:-1] + lose_prob * win_table[:, :-2]
+        draw_table = win_prob * draw_table[:, 2:] + draw_prob * draw_table[:, 1:-1] + lose_prob * draw_table[:, :-2]
+
+    win = win_table[:, 0]
+    draw = draw_table[:, 0]
+    lose = 1 - win - draw
+
+    # Prevent small negative results due to floating-point errors.
+    for probs in (win, lose, draw):
+        probs[np.abs(probs) < 1e-10] = 0
+
+    return win, lose, draw
+
+
+class WinProbability:
+    """
+    Best-of-n match odds for many (elo_1, elo_2, n) at once, with an LRU cache of results
+
+    Ratings are rounded to ELO_ROUNDING and results are keyed on (rating difference, average rating, n) - the average
+    matters as well as the difference since it sets the draw rate. Uncached odds are computed in one vectorised
+    recurrence per n.
+    """
+
+    def __init__(self, cache_size: int = ODDS_CACHE_SIZE):
+        self.cache_size = cache_size
+        self.cache: OrderedDict[Tuple[int, int, int], Tuple[float, float, float]] = OrderedDict()
+
+    @staticmethod
+    def _key(elo_1, elo_2, n):
+        return round((elo_1 - elo_2) / ELO_ROUNDING), round((elo_1 + elo_2) / 2 / ELO_ROUNDING), int(n)
+
+    def _compute(self, keys: List[Tuple[int, int, int]]):
+        by_n = {}
+        for key in keys:
+            by_n.setdefault(key[2], []).append(key)
+        for n, group in by_n.items():
+            probs = []
+            for diff, ave, _ in group:
+                elo_1, elo_2 = (ave + diff / 2) * ELO_ROUNDING, (ave - diff / 2) * ELO_ROUNDING
+                probs.append(game_probs(elo_1, elo_2))
+            win_prob, draw_prob_ = zip(*probs)
+            results = zip(*compute_prob_best_of_many(n, win_prob, draw_prob_))
+            for key, (win, lose, draw) in zip(group, results):
+                self.cache[key] = (float(win), float(lose), float(draw))
+
+    def odds_many(self, elo_1s: Iterable[float], elo_2s: Iterable[float], ns: Iterable[int]):
+        """
+        Odds of player 1 winning, losing and drawing best-of-n matches against player 2
+
+        :returns: list of (win, lose, draw) probabilities, one per (elo_1, elo_2, n)
+        """
+        keys = [self._key(elo_1, elo_2, n) for elo_1, elo_2, n in zip(elo_1s, elo_2s, ns)]
+        misses = [key for key in dict.fromkeys(keys) if key not in self.cache]
+        if misses:
+            self._compute(misses)
+
+        results = []
+        for key in keys:
+            self.cache.move_to_end(key)
+            results.append(self.cache[key])
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return results
+
+    def odds(self, elo_1: float, elo_2: float, n: int):
+        """Odds of player 1 winning, losing and drawing a best-of-n match against player 2"""
+        return self.odds_many([elo_1], [elo_2], [n])[0]
+
+
+def _axis(axis_range):
+    start, stop, step = axis_range
+    return np.arange(start, stop + step, step, dtype=np.float64)
+
+
+class OddsTable:
+    """
+    Precomputed best-of-n odds for every n in VALID_N_ROUNDS_RANGE over a grid of average ratings and rating
+    differences (ODDS_TABLE_AVE x ODDS_TABLE_DIFF), served by bilinear interpolation
+
+    The table is an array of shape (n, average, difference, [win, lose, draw]), saved after the grid it was built for and
+    memory-mapped rather than read, so workers share one copy through the page cache. Lookups are O(1) with no erf
+    evaluation - ratings outside the grid are clamped to its edges, see covers - and within 1e-3 of best_of_n (about 1e-4 for
+    ratings 800-2400 less than 1000 apart).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.ns = np.arange(VALID_N_ROUNDS_RANGE[0], VALID_N_ROUNDS_RANGE[1] + 1)
+        self.aves = _axis(ODDS_TABLE_AVE)
+        self.diffs = _axis(ODDS_TABLE_DIFF)
+        self.shape = (len(self.ns), len(self.aves), len(self.diffs), 3)
+        self.grid = np.array([*VALID_N_ROUNDS_RANGE, *ODDS_TABLE_AVE, *ODDS_TABLE_DIFF], dtype=np.float64)
+        self.table = None
+
+    def build(self):
+        """Compute the table (a few seconds) and save it"""
+        aves, diffs = np.meshgrid(self.aves, self.diffs, indexing="ij")
+        probs = [game_probs(ave + diff / 2, ave - diff / 2) for ave, diff in zip(aves.ravel(), diffs.ravel())]
+        win_prob, draw_prob_ = map(np.array, zip(*probs))
+        table = np.empty(self.shape, dtype=np.float32)
+        for i, n in enumerate(self.ns):
+            table[i] = np.stack(compute_prob_best_of_many(int(n), win_prob, draw_prob_), axis=-1).reshape(self.shape[1:])
+
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, self.grid)
+            np.save(f, table)
+        os.replace(tmp_path, self.path)  # atomic, other workers may be loading it
+
+    def _map(self):
+        """Memory-map the saved table, or None if it is missing or was built for a different grid"""
+        try:
+            with open(self.path, "rb") as f:
+                grid = np.load(f)
+                if grid.shape != self.grid.shape or not np.array_equal(grid, self.grid):
+                    return None
+                version = np.lib.format.read_magic(f)
+                read_header = np.lib.format.read_array_header_1_0 if version == (1, 0) else np.lib.format.read_array_header_2_0
+                shape, fortran_order, dtype = read_header(f)
+                offset = f.tell()
+        except (FileNotFoundError, EOFError, ValueError):  # missing, truncated or an older format
+            return None
+        if shape != self.shape:
+            return None
+        return np.memmap(self.path, dtype=dtype, mode="r", offset=offset, shape=shape, order="F" if fortran_order else "C")
+
+    def load(self):
+        """Memory-map the table, building it first if it is missing or was built for a different grid"""
+        table = self._map()
+        if table is None:
+            self.build()
+            table = self._map()
+        self.table = table
+
+    def covers(self, elo_1: float, elo_2: float):
+        """Whether the ratings are on the grid (odds for others are those of the nearest grid edge)"""
+        return self.aves[0] <= (elo_1 + elo_2) / 2 <= self.aves[-1] and self.diffs[0] <= elo_1 - elo_2 <= self.diffs[-1]
+
+    def odds_many(self, elo_1s: Iterable[float], elo_2s: Iterable[float], ns: Iterable[int]):
+        """
+        Odds of player 1 winning, losing and drawing best-of-n matches against player 2
+
+        :returns: array of shape (len(ns), 3) of win, lose and draw probabilities
+        """
+        elo_1s, elo_2s = np.asarray(elo_1s, dtype=np.float64), np.asarray(elo_2s, dtype=np.float64)
+        n_idx = np.asarray(ns) - self.ns[0]
+
+        # fractional grid coordinates, clamped to the grid
+        x = np.clip(((elo_1s + elo_2s) / 2 - self.aves[0]) / ODDS_TABLE_AVE[2], 0, len(self.aves) - 1)
+        y = np.clip((elo_1s - elo_2s - self.diffs[0]) / ODDS_TABLE_DIFF[2], 0, len(self.diffs) - 1)
+        x0 = np.minimum(x.astype(np.intp), len(self.aves) - 2)
+        y0 = np.minimum(y.astype(np.intp), len(self.diffs) - 2)
+        fx, fy = (x - x0)[:, None], (y - y0)[:, None]
+
+        t = self.table
+        return (
+            t[n_idx, x0, y0] * (1 - fx) * (1 - fy)
+            + t[n_idx, x0 + 1, y0] * fx * (1 - fy)
+            + t[n_idx, x0, y0 + 1] * (1 - fx) * fy
+            + t[n_idx, x0 + 1, y0 + 1] * fx * fy
+        )
 
-for n in range(1, 6):
-    print(best_of_n(n, elo_1, elo_2))
+    def odds(self, elo_1: float, elo_2: float, n: int):
+        """Odds of player 1 winning, losing and drawing a best-of-n match against player 2"""
+        return tuple(float(p) for p in self.odds_many([elo_1], [elo_2], [n])[0])
@@ -0,0 +1,99 @@
+"""
+Micro-benchmark: compact binary hash field codec vs the previous JSON + deepcopy serialisation
+
+Reports bytes written and encode/decode time for a full state write and for the partial writes made by the
+move and flag handlers.
+
+Usage (from api/, with the usual .env in place): python -m benchmarks.bench_codec
+"""
+
+import copy
+import json
+import random
+import timeit
+
+import app.utils as utils
+from app import codec
+from app.models import Game
+from chess import Board
+
+N_PLIES = (0, 40, 100)
+ITERATIONS = 2_000
+
+
+def make_game(n_plies):
+    board = Board()
+    rng = random.Random(n_plies)
+    for _ in range(n_plies):
+        if board.is_game_over():
+            break
+        board.push(rng.choice(list(board.legal_moves)))
+    players = ["rTj0bWqVb8A4lx1RAAAB", "Xa9yCkM3pYdQwL2EAAAD"]
+    return Game(
+        players=players,
+        board=board,
+        time_control=10,
+        wager=25,
+        player_wallet_addrs={p: "0x" + f"{i:040x}" for i, p in enumerate(players)},
+        match_score={p: 1 for p in players},
+        round=3,
+        n_rounds=5,
+        tr_white=412_345,
+        tr_black=398_761,
+        last_turn_timestamp=1_718_000_000_000,
+    )
+
+
+def json_encode(game):
+    game_dict = copy.deepcopy({f: getattr(game, f) for f in game.__slots__ if f not in ("version", "dirty")})
+    game_dict["board"] = game.board.fen()
+    return json.dumps(game_dict)
+
+
+def json_decode(data):
+    game_dict = json.loads(data)
+    game_dict["board"] = Board(game_dict["board"])
+    return Game(**game_dict)
+
+
+def hash_encode(game, fields=None):
+    return codec.encode_fields(game, fields)
+
+
+def hash_decode_hit(state):
+    # board comes from the position cache, only the scalar fields are decoded
+    return codec.decode_fields(state)
+
+
+def hash_decode_miss(state):
+    # board is rebuilt by replaying the move list
+    return utils.deserialise_game_state(state)
+
+
+def n_bytes(data):
+    return sum(len(v) for v in data.values()) if isinstance(data, dict) else len(data)
+
+
+def main():
+    print(f"{'plies':>6} {'write':>10} {'bytes':>7} {'encode (us)':>12} {'decode hit (us)':>16} {'decode miss (us)':>17}")
+    for n_plies in N_PLIES:
+        game = make_game(n_plies)
+        full = {k.encode(): v for k, v in hash_encode(game).items()}
+        for name, encode in (
+            ("json", json_encode),
+            ("hash", hash_encode),
+            ("hash-move", lambda g: hash_encode(g, ("board", "tr_white", "last_turn_timestamp", "version"))),
+            ("hash-flag", lambda g: hash_encode(g, ("match_score", "finished", "version"))),
+        ):
+            data = encode(game)
+            t_enc = timeit.timeit(lambda: encode(game), number=ITERATIONS) / ITERATIONS * 1e6
+            if name == "json":
+                t_hit = t_miss = timeit.timeit(lambda: json_decode(data), number=ITERATIONS) / ITERATIONS * 1e6
+            else:
+                t_hit = timeit.timeit(lambda: hash_decode_hit(full), number=ITERATIONS) / ITERATIONS * 1e6
+                t_miss = timeit.timeit(lambda: hash_decode_miss(full), number=ITERATIONS) / ITERATIONS * 1e6
+            print(f"{n_plies:>6} {name:>10} {n_bytes(data):>7} {t_enc:>12.1f} {t_hit:>16.1f} {t_miss:>17.1f}")
+
+
+if __name__ == "__main__":
+    main()
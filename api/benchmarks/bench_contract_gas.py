@@ -0,0 +1,129 @@
+"""
+Gas benchmark: DechecsMatchContractV2 (games keyed by UUID bytes16) vs DechecsMatchContract (UUID string keys)
+
+Always reports the calldata size and intrinsic calldata gas of each call made by the UI and GameContract (no chain
+needed). Given a local development chain with unlocked, funded accounts (e.g. anvil or ganache), both contracts are
+also compiled (needs py-solc-x), deployed and exercised - create, join and settle (winner, draw, cancel and a
+declareResults batch) - and the gas used by each transaction is compared.
+
+Usage (from api/, with the usual .env in place):
+    python -m benchmarks.bench_contract_gas
+    python -m benchmarks.bench_contract_gas --rpc http://127.0.0.1:8545
+"""
+
+import argparse
+import uuid
+from pathlib import Path
+
+import app.utils as utils
+from eth_abi import encode
+from web3 import Web3
+from web3.constants import ADDRESS_ZERO
+
+CONTRACTS_DIR = Path(__file__).resolve().parents[2] / "contracts"
+SOLC_VERSION = "0.8.24"
+WAGER = Web3.to_wei(1, "ether")
+COMMISSION_PERCENTAGE = 5
+BATCH_SIZE = 20
+WINNER = "0x" + "ab" * 20
+
+
+def calldata_gas(data: bytes):
+    """Intrinsic gas charged for calldata (EIP-2028)"""
+    return sum(16 if b else 4 for b in data)
+
+
+def calldata(signature: str, types, args):
+    return Web3.keccak(text=signature)[:4] + encode(types, args)
+
+
+def report_calldata():
+    gid = str(uuid.uuid4())
+    gids = [str(uuid.uuid4()) for _ in range(BATCH_SIZE)]
+    calls = {
+        "createGame": (("string", "uint256"), (gid, WAGER), ("bytes16", "uint256"), (utils.gid_to_bytes(gid), WAGER)),
+        "joinGame": (("string",), (gid,), ("bytes16",), (utils.gid_to_bytes(gid),)),
+        "cancelGame": (("string",), (gid,), ("bytes16",), (utils.gid_to_bytes(gid),)),
+        "declareDraw": (("string",), (gid,), ("bytes16",), (utils.gid_to_bytes(gid),)),
+        "declareWinner": (("string", "address"), (gid, WINNER), ("bytes16", "address"), (utils.gid_to_bytes(gid), WINNER)),
+        f"declareResults ({BATCH_SIZE})": (
+            ("string[]", "address[]"),
+            (gids, [WINNER] * BATCH_SIZE),
+            ("bytes16[]", "address[]"),
+            ([utils.gid_to_bytes(g) for g in gids], [WINNER] * BATCH_SIZE),
+        ),
+    }
+
+    print(f"{'calldata':<22}{'string B':>10}{'bytes16 B':>11}{'string gas':>12}{'bytes16 gas':>13}{'saved':>8}")
+    for name, (old_types, old_args, new_types, new_args) in calls.items():
+        fn = name.split()[0]
+        old = calldata(f"{fn}({','.join(old_types)})", old_types, old_args)
+        new = calldata(f"{fn}({','.join(new_types)})", new_types, new_args)
+        old_gas, new_gas = calldata_gas(old), calldata_gas(new)
+        print(f"{name:<22}{len(old):>10}{len(new):>11}{old_gas:>12}{new_gas:>13}{1 - new_gas / old_gas:>8.0%}")
+
+
+def compile_contract(name: str):
+    import solcx  # only needed for the on-chain comparison
+
+    solcx.install_solc(SOLC_VERSION)
+    source = (CONTRACTS_DIR / f"{name}.sol").read_text()
+    out = solcx.compile_source(source, output_values=["abi", "bin"], solc_version=SOLC_VERSION)
+    return out[f"<stdin>:{name}"]
+
+
+def run_on_chain(w3: Web3, compiled):
+    owner, player1, player2 = w3.eth.accounts[:3]
+    factory = w3.eth.contract(abi=compiled["abi"], bytecode=compiled["bin"])
+    receipt = w3.eth.wait_for_transaction_receipt(factory.constructor().transact({"from": owner}))
+    contract = w3.eth.contract(address=receipt.contractAddress, abi=compiled["abi"])
+    w3.eth.send_transaction({"from": owner, "to": contract.address, "value": WAGER})  # covers the gas fee checks
+
+    create_inputs = next(f for f in compiled["abi"] if f.get("name") == "createGame")["inputs"]
+    to_key = utils.gid_to_bytes if create_inputs[0]["type"] == "bytes16" else str
+    value = WAGER * (100 + COMMISSION_PERCENTAGE) // 100
+    gas_used = {}
+
+    def transact(name, fn, sender, **tx):
+        receipt = w3.eth.wait_for_transaction_receipt(fn.transact({"from": sender, **tx}))
+        assert receipt.status == 1, f"{name} reverted"
+        gas_used.setdefault(name, []).append(receipt.gasUsed)
+
+    def new_game(join=True):
+        gid = to_key(str(uuid.uuid4()))
+        transact("createGame", contract.functions.createGame(gid, WAGER), player1, value=value)
+        if join:
+            transact("joinGame", contract.functions.joinGame(gid), player2, value=value)
+        return gid
+
+    transact("cancelGame", contract.functions.cancelGame(new_game(join=False)), owner)
+    transact("declareWinner", contract.functions.declareWinner(new_game(), player1), owner)
+    transact("declareDraw", contract.functions.declareDraw(new_game()), owner)
+    gids = [new_game() for _ in range(BATCH_SIZE)]
+    winners = [player1 if i % 2 else ADDRESS_ZERO for i in range(BATCH_SIZE)]
+    transact(f"declareResults ({BATCH_SIZE})", contract.functions.declareResults(gids, winners), owner)
+    return {name: sum(gas) // len(gas) for name, gas in gas_used.items()}
+
+
+def report_on_chain(rpc_url: str):
+    w3 = Web3(Web3.HTTPProvider(rpc_url))
+    old = run_on_chain(w3, compile_contract("DechecsMatchContract"))
+    new = run_on_chain(w3, compile_contract("DechecsMatchContractV2"))
+
+    print(f"\n{'gas used':<22}{'string':>10}{'bytes16':>11}{'saved':>8}")
+    for name in new:
+        print(f"{name:<22}{old[name]:>10}{new[name]:>11}{1 - new[name] / old[name]:>8.0%}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rpc", help="local development chain to deploy both contracts to")
+    args = parser.parse_args()
+
+    report_calldata()
+    if args.rpc:
+        report_on_chain(args.rpc)
+
+
+if __name__ == "__main__":
+    main()
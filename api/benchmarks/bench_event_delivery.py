@@ -0,0 +1,113 @@
+"""
+End-to-end move latency benchmark for the game event delivery modes
+
+Plays games between pairs of Socket.IO clients against a running API and measures the time from a player
+emitting "move" to their opponent receiving the resulting "move" event. Start the API once per mode, e.g.
+
+    EVENT_DELIVERY=mq uvicorn app.main:chess_api --port 8000 --workers 3
+    EVENT_DELIVERY=sio-redis uvicorn app.main:chess_api --port 8000 --workers 3
+
+and run (from api/): python -m benchmarks.bench_event_delivery --url http://localhost:8000 --games 20 --plies 60
+
+Moves that would end the round are never played, so no contract calls are made.
+"""
+
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+import socketio
+from app.constants import BATCH_EVENT
+from chess import Board
+
+WALLET_ADDR = "0x" + "0" * 40
+
+
+class Player:
+    def __init__(self, url):
+        self.url = url
+        self.sio = socketio.AsyncClient()
+        self.events = asyncio.Queue()
+        self.sio.on("*", self._on_event)
+
+    async def _on_event(self, event, data=None):
+        received = time.perf_counter()
+        for event, data in data if event == BATCH_EVENT else [(event, data)]:
+            await self.events.put((event, data, received))
+
+    async def connect(self):
+        await self.sio.connect(self.url, socketio_path="/ws/socket.io", transports=["websocket"])
+
+    async def wait_for(self, name):
+        while True:
+            event, data, received = await self.events.get()
+            if event == name:
+                return data, received
+            if event == "error":
+                raise RuntimeError(f"Server error: {data}")
+
+
+def pick_move(board: Board, rng: random.Random):
+    """Random legal move that doesn't end the round"""
+    moves = list(board.legal_moves)
+    rng.shuffle(moves)
+    for move in moves:
+        board.push(move)
+        ends_round = board.outcome(claim_draw=True) is not None
+        board.pop()
+        if not ends_round:
+            return move
+    return None
+
+
+async def play_game(url, plies, seed, latencies):
+    creator, joiner = Player(url), Player(url)
+    await creator.connect()
+    await joiner.connect()
+    try:
+        await creator.sio.emit("create", (10, 1, WALLET_ADDR, 1))
+        gid, _ = await creator.wait_for("gameId")
+        await joiner.sio.emit("acceptGame", (gid, WALLET_ADDR))
+        (start_c, _), _ = await asyncio.gather(creator.wait_for("start"), joiner.wait_for("start"))
+        white, black = (creator, joiner) if start_c["colour"] == 1 else (joiner, creator)
+
+        board, rng = Board(), random.Random(seed)
+        for ply in range(plies):
+            mover, opponent = (white, black) if ply % 2 == 0 else (black, white)
+            move = pick_move(board, rng)
+            if move is None:
+                break
+            board.push(move)
+            sent = time.perf_counter()
+            await mover.sio.emit("move", move.uci())
+            _, received = await opponent.wait_for("move")
+            latencies.append((received - sent) * 1000)
+        await creator.sio.emit("exit")
+        await joiner.sio.emit("exit")
+    finally:
+        await creator.sio.disconnect()
+        await joiner.sio.disconnect()
+
+
+async def main(url, games, plies):
+    latencies = []
+    started = time.perf_counter()
+    await asyncio.gather(*(play_game(url, plies, seed, latencies) for seed in range(games)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    print(f"games={games} moves={len(latencies)} elapsed={elapsed:.1f}s throughput={len(latencies) / elapsed:.0f} moves/s")
+    print(
+        f"move latency (ms): mean={statistics.mean(latencies):.1f} p50={latencies[len(latencies) // 2]:.1f} "
+        f"p99={latencies[int(len(latencies) * 0.99)]:.1f} max={latencies[-1]:.1f}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--games", type=int, default=10)
+    parser.add_argument("--plies", type=int, default=60)
+    args = parser.parse_args()
+    asyncio.run(main(args.url, args.games, args.plies))
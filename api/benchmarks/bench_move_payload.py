@@ -0,0 +1,68 @@
+"""
+Micro-benchmark: move event payload size and build time over a 100 ply game, full state (every legal move as UCI plus
+the whole move stack, as previously sent) vs delta (latest move, compact legal moves)
+
+Usage (from api/, with the usual .env in place): python -m benchmarks.bench_move_payload
+"""
+
+import json
+import random
+import timeit
+
+import app.utils as utils
+from app.models import MoveData
+from chess import Board
+
+N_PLIES = 100
+ITERATIONS = 20
+
+
+def play_game(n_plies):
+    """Positions after each ply of a random game (restarted whenever it ends, like consecutive rounds)"""
+    rng = random.Random(0)
+    board, boards = Board(), []
+    while len(boards) < n_plies:
+        board.push(rng.choice(list(board.legal_moves)))
+        boards.append(board.copy())
+        if board.is_game_over():
+            board = Board()
+    return boards
+
+
+def full_payload(board):
+    return {
+        "turn": int(board.turn),
+        "winner": None,
+        "outcome": None,
+        "matchScore": None,
+        "move": str(board.peek()),
+        "castles": None,
+        "isCheck": board.is_check(),
+        "enPassant": False,
+        "legalMoves": [str(m) for m in board.legal_moves],
+        "moveStack": [str(m) for m in board.move_stack],
+    }
+
+
+def delta_payload(board):
+    return MoveData(
+        ply=len(board.move_stack),
+        turn=int(board.turn),
+        move=str(board.peek()),
+        isCheck=board.is_check(),
+        enPassant=False,
+        legal=utils.encode_legal_moves(board),
+    ).delta()
+
+
+def main():
+    boards = play_game(N_PLIES)
+    print(f"{'payload':>8} {'avg bytes':>10} {'last bytes':>11} {'total bytes':>12} {'build (us/move)':>16}")
+    for name, build in (("full", full_payload), ("delta", delta_payload)):
+        sizes = [len(json.dumps(build(b))) for b in boards]
+        t = timeit.timeit(lambda: [json.dumps(build(b)) for b in boards], number=ITERATIONS) / ITERATIONS / len(boards) * 1e6
+        print(f"{name:>8} {sum(sizes) / len(sizes):>10.1f} {sizes[-1]:>11} {sum(sizes):>12} {t:>16.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Micro-benchmark: best-of-n match odds, scalar win_prob.best_of_n vs the vectorised recurrence
+(compute_prob_best_of_many), the cached WinProbability service and the interpolated OddsTable
+
+Evaluates the odds of every valid number of rounds for a set of random rating pairs (as the odds route does).
+
+Usage (from api/, with the usual .env in place): python -m benchmarks.bench_win_prob
+"""
+
+import os
+import random
+import tempfile
+import time
+
+from app.constants import VALID_N_ROUNDS_RANGE
+from app.win_prob import OddsTable, WinProbability, best_of_n, compute_prob_best_of_many, game_probs
+
+N_PAIRS = (1, 100, 1_000)
+
+
+def make_requests(n_pairs):
+    rng = random.Random(n_pairs)
+    pairs = [(rng.uniform(800, 2400), rng.uniform(800, 2400)) for _ in range(n_pairs)]
+    rounds = range(VALID_N_ROUNDS_RANGE[0], VALID_N_ROUNDS_RANGE[1] + 1)
+    return [(elo_1, elo_2, n) for elo_1, elo_2 in pairs for n in rounds]
+
+
+def vectorised(requests):
+    """Odds of every request, one vectorised recurrence per number of rounds"""
+    by_n = {}
+    for i, (elo_1, elo_2, n) in enumerate(requests):
+        by_n.setdefault(n, []).append(i)
+    results = [None] * len(requests)
+    for n, indices in by_n.items():
+        win_prob, draw_prob = zip(*(game_probs(*requests[i][:2]) for i in indices))
+        for i, odds in zip(indices, zip(*compute_prob_best_of_many(n, win_prob, draw_prob))):
+            results[i] = odds
+    return results
+
+
+def timed(fn):
+    started = time.perf_counter()
+    result = fn()
+    return result, (time.perf_counter() - started) * 1000
+
+
+def max_err(expected, actual):
+    return max(abs(float(e) - a) for e_odds, a_odds in zip(expected, actual) for e, a in zip(e_odds, a_odds))
+
+
+def main():
+    table = OddsTable(os.path.join(tempfile.mkdtemp(), "odds_table.npy"))
+    _, t_build = timed(table.load)
+    print(f"odds table built in {t_build:.0f} ms ({table.table.nbytes / 1e6:.1f} MB)")
+
+    print(
+        f"{'pairs':>6} {'matches':>8} {'scalar (ms)':>12} {'vector (ms)':>12} {'max abs err':>12} {'cache cold (ms)':>16}"
+        f" {'cache warm (ms)':>16} {'cache err':>10} {'table (ms)':>11} {'table err':>10}"
+    )
+    for n_pairs in N_PAIRS:
+        requests = make_requests(n_pairs)
+        elo_1s, elo_2s, ns = zip(*requests)
+        scalar, t_scalar = timed(lambda: [best_of_n(n, elo_1, elo_2) for elo_1, elo_2, n in requests])
+        vector, t_vector = timed(lambda: vectorised(requests))
+        service = WinProbability()
+        cached, t_cold = timed(lambda: service.odds_many(elo_1s, elo_2s, ns))
+        _, t_warm = timed(lambda: service.odds_many(elo_1s, elo_2s, ns))
+        interpolated, t_table = timed(lambda: table.odds_many(elo_1s, elo_2s, ns))
+        print(
+            f"{n_pairs:>6} {len(requests):>8} {t_scalar:>12.1f} {t_vector:>12.1f} {max_err(scalar, vector):>12.1e}"
+            f" {t_cold:>16.1f} {t_warm:>16.1f} {max_err(scalar, cached):>10.1e}"
+            f" {t_table:>11.2f} {max_err(scalar, interpolated):>10.1e}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+"""
+Load test: simulated players playing random wagered matches against a running server, at increasing concurrency
+
+Each match is two Socket.IO clients speaking the same protocol as the UI - create, getGameDetails, acceptGame, then
+random legal moves (with an occasional premature flag, dismissed by the server) until the match ends, and exit. Per
+concurrency level (matches in flight) it reports completed matches, move throughput, move latency (emit to the
+server's echo of the move) and CPU/memory of the load generator and, given their PIDs, of the server workers. Use it to
+size CONCURRENT_GAME_LIMIT and the worker count; /metrics shows where server time goes.
+
+Usage (from api/, against python -m benchmarks.load_server):
+    python -m benchmarks.load_test --levels 10,100,500,1000 --duration 60 --server-pid $(pgrep -d, -f load_server)
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import resource
+import time
+from dataclasses import dataclass, field
+from typing import List
+
+import chess
+import socketio
+from socketio.exceptions import ConnectionError as SocketIOConnectionError
+
+WALLET_ADDR = "0x" + "0" * 39 + "1"
+
+
+@dataclass
+class LevelStats:
+    matches: int = 0
+    moves: int = 0
+    latencies: List[float] = field(default_factory=list)  # seconds
+    errors: int = 0
+    timeouts: int = 0
+
+
+class Player:
+    """One simulated client, playing random legal moves whenever it is its turn"""
+
+    def __init__(self, args, stats: LevelStats, rng: random.Random):
+        self.args = args
+        self.stats = stats
+        self.rng = rng
+        self.sio = socketio.AsyncClient(reconnection=False)
+        self.board = chess.Board()
+        self.colour = None
+        self.sent = {}  # ply -> perf_counter when the move was emitted
+        self.game_id = asyncio.get_running_loop().create_future()
+        self.game_info = asyncio.get_running_loop().create_future()
+        self.match_ended = asyncio.Event()
+        self.mover = None
+
+        self.sio.on("batch", self.on_batch)
+        self.sio.on("gameId", self.on_game_id)
+        self.sio.on("gameInfo", self.on_game_info)
+        self.sio.on("start", self.on_start)
+        self.sio.on("move", self.on_move)
+        self.sio.on("matchEnded", self.on_match_ended)
+        self.sio.on("error", self.on_error)
+
+    async def connect(self):
+        await self.sio.connect(self.args.url, socketio_path="/ws/socket.io", transports=["websocket"])
+
+    async def on_batch(self, events):
+        handlers = {"move": self.on_move, "matchEnded": self.on_match_ended, "start": self.on_start}
+        for name, data in events:
+            if name in handlers:
+                await handlers[name](data)
+
+    async def on_game_id(self, gid):
+        self.game_id.set_result(gid)
+
+    async def on_game_info(self, info):
+        self.game_info.set_result(info)
+
+    async def on_start(self, data):
+        self.colour = data["colour"]
+        self.board.reset()
+        self.sent.clear()
+        self._play()
+
+    async def on_move(self, data):
+        if data.get("ply") is not None:
+            sent = self.sent.pop(data["ply"], None)
+            if sent is not None:
+                self.stats.latencies.append(time.perf_counter() - sent)
+                self.stats.moves += 1
+            if data["ply"] == len(self.board.move_stack) + 1:
+                self.board.push_uci(data["move"])
+        if data.get("outcome") is None:  # round goes on (outcomes wait for the next start, or matchEnded)
+            self._play()
+        elif self.mover:
+            self.mover.cancel()
+
+    async def on_match_ended(self, _):
+        self.match_ended.set()
+
+    async def on_error(self, message):
+        self.stats.errors += 1
+        if self.sent:  # our move was rejected (e.g. game busy) - try again
+            self.sent.clear()
+            self._play()
+
+    def _play(self):
+        if self.colour is not None and int(self.board.turn) == self.colour and not self.sent:
+            if self.mover is None or self.mover.done():
+                self.mover = asyncio.create_task(self._move())
+
+    async def _move(self):
+        await asyncio.sleep(self.rng.expovariate(1000 / self.args.think_ms) if self.args.think_ms else 0)
+        if len(self.board.move_stack) >= self.args.max_plies:
+            await self.sio.emit("resign")
+            return
+        if self.rng.random() < self.args.flag_rate:  # opponent is nowhere near out of time, the server dismisses it
+            await self.sio.emit("flag", int(not self.board.turn))
+        move = self.rng.choice(list(self.board.legal_moves))
+        self.sent[len(self.board.move_stack) + 1] = time.perf_counter()
+        await self.sio.emit("move", move.uci())
+
+    async def leave(self):
+        try:
+            await self.sio.emit("exit")
+        finally:
+            await self.sio.disconnect()
+
+
+async def play_match(args, stats: LevelStats, rng: random.Random):
+    creator, joiner = Player(args, stats, rng), Player(args, stats, rng)
+    try:
+        await asyncio.gather(creator.connect(), joiner.connect())
+        await creator.sio.emit("create", (args.time_control, args.wager, WALLET_ADDR, args.rounds))
+        gid = await asyncio.wait_for(creator.game_id, args.match_timeout)
+        await joiner.sio.emit("getGameDetails", gid)
+        await asyncio.wait_for(joiner.game_info, args.match_timeout)
+        await joiner.sio.emit("acceptGame", (gid, WALLET_ADDR))
+        await asyncio.wait_for(asyncio.gather(creator.match_ended.wait(), joiner.match_ended.wait()), args.match_timeout)
+        stats.matches += 1
+    except asyncio.TimeoutError:
+        stats.timeouts += 1
+    except SocketIOConnectionError:
+        stats.errors += 1
+    finally:
+        for player in (creator, joiner):
+            if player.mover:
+                player.mover.cancel()
+        await asyncio.gather(*(p.leave() for p in (creator, joiner) if p.sio.connected), return_exceptions=True)
+
+
+def process_usage(pids):
+    """Total CPU seconds and resident memory (bytes) of processes, from /proc"""
+    cpu = rss = 0
+    for pid in pids:
+        with open(f"/proc/{pid}/stat") as f:
+            stat = f.read().rsplit(")", 1)[1].split()
+        cpu += (int(stat[11]) + int(stat[12])) / os.sysconf("SC_CLK_TCK")  # utime + stime
+        with open(f"/proc/{pid}/status") as f:
+            rss += next(int(line.split()[1]) * 1024 for line in f if line.startswith("VmRSS"))
+    return cpu, rss
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return float("nan")
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+async def run_level(args, concurrency):
+    stats = LevelStats()
+    deadline = time.perf_counter() + args.duration
+
+    async def match_loop(i):
+        rng = random.Random(f"{args.seed}-{concurrency}-{i}")
+        await asyncio.sleep(rng.random() * args.ramp)  # don't open every socket at once
+        while time.perf_counter() < deadline:
+            await play_match(args, stats, rng)
+
+    client_cpu = resource.getrusage(resource.RUSAGE_SELF)
+    server_cpu = process_usage(args.server_pid)[0] if args.server_pid else None
+    start = time.perf_counter()
+    await asyncio.gather(*(match_loop(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    client_cpu = (usage.ru_utime + usage.ru_stime) - (client_cpu.ru_utime + client_cpu.ru_stime)
+    latencies = sorted(stats.latencies)
+    row = {
+        "concurrent": concurrency,
+        "done": stats.matches,
+        "moves/s": stats.moves / elapsed,
+        "p50 ms": percentile(latencies, 0.5) * 1000,
+        "p99 ms": percentile(latencies, 0.99) * 1000,
+        "max ms": (latencies[-1] if latencies else float("nan")) * 1000,
+        "errors": stats.errors,
+        "timeouts": stats.timeouts,
+        "gen cpu%": 100 * client_cpu / elapsed,
+        "gen MB": usage.ru_maxrss / 1024,
+    }
+    if args.server_pid:
+        cpu, rss = process_usage(args.server_pid)
+        row["srv cpu%"] = 100 * (cpu - server_cpu) / elapsed
+        row["srv MB"] = rss / 2**20
+    return row
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--levels", default="10,50,100,250,500,1000", help="concurrent matches per level")
+    parser.add_argument("--duration", type=float, default=60, help="seconds matches are started for, per level")
+    parser.add_argument("--ramp", type=float, default=5, help="seconds over which a level's matches are started")
+    parser.add_argument("--think-ms", type=float, default=500, help="mean think time per move (exponential)")
+    parser.add_argument("--max-plies", type=int, default=200, help="the side to move resigns after this many plies")
+    parser.add_argument("--flag-rate", type=float, default=0.01, help="chance of a (dismissed) flag before a move")
+    parser.add_argument("--time-control", type=int, default=10)
+    parser.add_argument("--wager", type=int, default=1)
+    parser.add_argument("--rounds", type=int, default=1, help="rounds per match (rounds are ROUND_INTERVAL apart)")
+    parser.add_argument("--match-timeout", type=float, default=900)
+    parser.add_argument("--seed", default="dechecs")
+    parser.add_argument("--server-pid", type=lambda s: [int(p) for p in s.split(",") if p], default=[], help="server worker PIDs (comma separated)")
+    args = parser.parse_args()
+
+    header = None
+    for concurrency in (int(c) for c in args.levels.split(",")):
+        row = await run_level(args, concurrency)
+        if header is None:
+            header = list(row)
+            print("".join(f"{h:>11}" for h in header))
+        print("".join(f"{row[h]:>11.1f}" if isinstance(row[h], float) else f"{row[h]:>11}" for h in header), flush=True)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
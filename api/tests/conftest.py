@@ -0,0 +1,47 @@
+import asyncio
+import os
+
+import pytest
+
+# settings the app requires, set before any app module is imported
+os.environ.setdefault("CONCURRENT_GAME_LIMIT", "100")
+os.environ.setdefault("BUCKET_CAPACITY", "100")
+
+TEST_REDIS_URL = os.environ.get("TEST_REDIS_URL", "redis://localhost:6379/15")
+
+
+@pytest.fixture
+def redis_url():
+    """URL of an empty Redis database (TEST_REDIS_URL is flushed before each test), skips if Redis is not running"""
+    import aioredis
+
+    async def flush():
+        redis_client = aioredis.from_url(TEST_REDIS_URL)
+        try:
+            await redis_client.flushdb()
+        finally:
+            await redis_client.close()
+
+    try:
+        asyncio.run(flush())
+    except (aioredis.ConnectionError, OSError) as exc:
+        pytest.skip(f"no Redis at {TEST_REDIS_URL}: {exc}")
+    return TEST_REDIS_URL
+
+
+class RecordingEventBus:
+    """Stands in for an EventBus, keeping what was published"""
+
+    def __init__(self):
+        self.published = []  # (gid, event)
+
+    async def publish(self, gid, event, rk=None):
+        self.published.append((gid, event))
+
+    async def publish_many(self, gid, events, rk=None):
+        self.published += [(gid, event) for event in events]
+
+
+@pytest.fixture
+def events():
+    return RecordingEventBus()
@@ -0,0 +1,143 @@
+"""
+ExchangeRates against a local stand-in for CoinMarketCap: caching, stale fallback and lock contention between workers
+
+Needs Redis (see conftest.TEST_REDIS_URL), skipped if it is not running.
+"""
+
+import asyncio
+import logging
+
+import aiohttp
+import aioredis
+import app.exchange as exchange
+import app.utils as utils
+import pytest
+from aiohttp import test_utils, web
+
+logger = logging.getLogger(__name__)
+
+
+class StandInQuotes:
+    """Serves the CoinMarketCap quotes endpoint, recording the fiats of each request"""
+
+    def __init__(self):
+        self.requests = []
+        self.price = 0.5
+        self.status = 200
+        self.delay = 0  # seconds before responding
+
+    async def quotes(self, request):
+        self.requests.append(request.query["convert"])
+        await asyncio.sleep(self.delay)
+        if self.status != 200:
+            return web.json_response({"status": {"error_message": "unavailable"}}, status=self.status)
+        quote = {fiat: {"price": self.price} for fiat in request.query["convert"].split(",")}
+        return web.json_response({"data": {"POL": [{"quote": quote}]}})
+
+
+@pytest.fixture
+def upstream():
+    return StandInQuotes()
+
+
+@pytest.fixture
+def workers(redis_url, upstream):
+    """Runs a test coroutine with the stand-in server up, passing it a factory of workers' ExchangeRates"""
+
+    def run(test):
+        async def main():
+            app = web.Application()
+            app.router.add_get("/quotes", upstream.quotes)
+            server = test_utils.TestServer(app)
+            await server.start_server()
+            started = []
+
+            def worker():
+                rates = exchange.ExchangeRates(aioredis.from_url(redis_url), logger, str(server.make_url("/quotes")))
+                rates.session = aiohttp.ClientSession()  # as start() does, without the background refresher
+                started.append(rates)
+                return rates
+
+            try:
+                return await test(worker)
+            finally:
+                for rates in started:
+                    await rates.close()
+                    await rates.redis_client.close()
+                await server.close()
+
+        return asyncio.run(main())
+
+    return run
+
+
+def test_fresh_rate_is_served_from_the_cache(workers, upstream):
+    async def test(worker):
+        first = await worker().get_rate("GBP")
+        upstream.price = 0.6
+        return first, await worker().get_rate("GBP")
+
+    assert workers(test) == (0.5, 0.5)
+    assert upstream.requests == ["GBP"]
+
+
+def test_stale_rate_is_served_when_upstream_fails(workers, upstream, monkeypatch):
+    async def test(worker):
+        rates = worker()
+        await rates.get_rate("GBP")
+        monkeypatch.setattr(exchange, "EXCHANGE_RATE_TTL", 0)  # cached rate is now stale
+        upstream.status = 500
+        return await rates.get_rate("GBP")
+
+    assert workers(test) == 0.5
+    assert upstream.requests == ["GBP", "GBP"]
+
+
+def test_upstream_failure_without_a_stale_rate_raises(workers, upstream):
+    upstream.status = 500
+
+    async def test(worker):
+        with pytest.raises(RuntimeError):
+            await worker().get_rate("GBP")
+
+    workers(test)
+
+
+def test_concurrent_misses_on_all_workers_share_one_fetch(workers, upstream):
+    upstream.delay = 0.2
+
+    async def test(worker):
+        first, second = worker(), worker()
+        return await asyncio.gather(*(rates.get_rate("GBP") for rates in (first, second) for _ in range(3)))
+
+    assert workers(test) == [0.5] * 6
+    assert upstream.requests == ["GBP"]
+
+
+def test_worker_waiting_on_a_lock_falls_back_to_the_stale_rate(workers, upstream, monkeypatch):
+    monkeypatch.setattr(exchange, "EXCHANGE_TIMEOUT", 0.2)  # how long a waiter polls for the holder's result
+
+    async def test(worker):
+        rates = worker()
+        await rates.get_rate("GBP")
+        monkeypatch.setattr(exchange, "EXCHANGE_RATE_TTL", 0)
+        upstream.price = 0.6
+        lock_key = utils.get_redis_exchange_rate_lock_key("GBP")
+        await rates.redis_client.set(lock_key, "other worker", ex=10)  # held, and never completed
+        return await rates.get_rate("GBP"), await rates.redis_client.get(lock_key)
+
+    assert workers(test) == (0.5, b"other worker")
+    assert upstream.requests == ["GBP"]
+
+
+def test_worker_never_releases_a_lock_it_does_not_hold(workers, upstream, monkeypatch):
+    monkeypatch.setattr(exchange, "EXCHANGE_TIMEOUT", 0.2)
+
+    async def test(worker):
+        rates = worker()
+        lock_key = utils.get_redis_exchange_rate_lock_key("GBP")
+        await rates.redis_client.set(lock_key, "other worker", ex=10)
+        return await rates.get_rate("GBP"), await rates.redis_client.get(lock_key)
+
+    assert workers(test) == (0.5, b"other worker")  # no stale rate, so fetched without the lock
+    assert upstream.requests == ["GBP"]
@@ -0,0 +1,71 @@
+"""
+Game state storage: hash states round trip through utils.serialise_game_state / deserialise_game_state, and legacy
+JSON states (a FEN, no move history) are migrated without losing the position
+"""
+
+import json
+
+import app.utils as utils
+from chess import Board
+
+OPENING = ["e2e4", "e7e5", "g1f3", "b8c6"]
+
+
+def saved(game):
+    """The Redis hash of a game as it is read back (field names as bytes)"""
+    return {field.encode(): value for field, value in utils.serialise_game_state(game).items()}
+
+
+def legacy_state(board: Board):
+    """A game saved as a JSON string by the baseline server (board as its current FEN)"""
+    return json.dumps(
+        {
+            "players": ["black", "white"],
+            "board": board.fen(),
+            "time_control": 3,
+            "wager": 10,
+            "player_wallet_addrs": {"black": "0xb", "white": "0xw"},
+            "match_score": {"black": 0, "white": 0},
+            "round": 1,
+            "n_rounds": 3,
+            "tr_white": 180_000,
+            "tr_black": 180_000,
+            "finished": False,
+            "last_turn_timestamp": 0,
+        }
+    ).encode()
+
+
+def test_game_round_trips_with_its_move_history():
+    board = Board()
+    for uci in OPENING:
+        board.push_uci(uci)
+    game = utils.deserialise_game_state(legacy_state(Board()))
+    game.board = board
+
+    loaded = utils.deserialise_game_state(saved(game))
+
+    assert loaded.board.fen() == board.fen()
+    assert [m.uci() for m in loaded.board.move_stack] == OPENING
+
+
+def test_legacy_mid_game_state_keeps_its_position_once_migrated():
+    board = Board()
+    for uci in OPENING:
+        board.push_uci(uci)
+    game = utils.deserialise_game_state(legacy_state(board))
+    assert game.board.fen() == board.fen()
+
+    # play a move, and save the game as a hash (as the first update of a legacy game does)
+    game.board.push_uci("f1b5")
+    game.touch("board")
+    board.push_uci("f1b5")
+    loaded = utils.deserialise_game_state(saved(game))
+
+    assert loaded.board.fen() == board.fen()
+    assert [m.uci() for m in loaded.board.move_stack] == ["f1b5"]
+
+    # and the next save, from the reloaded board
+    loaded.board.push_uci("a7a6")
+    board.push_uci("a7a6")
+    assert utils.deserialise_game_state(saved(loaded)).board.fen() == board.fen()
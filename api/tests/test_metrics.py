@@ -0,0 +1,54 @@
+"""
+MetricsExporter: counts drained for a flush that fails are kept and exported by the next one
+
+Needs Redis (see conftest.TEST_REDIS_URL), skipped if it is not running.
+"""
+
+import asyncio
+import logging
+
+import aioredis
+import pytest
+from app.metrics import Registry
+from app.stats import MetricsExporter
+
+UNREACHABLE_REDIS_URL = "redis://127.0.0.1:1"  # nothing listens on port 1, so every command fails to connect
+
+logger = logging.getLogger(__name__)
+
+
+def test_counts_survive_a_failed_flush(redis_url):
+    metrics = Registry()
+    errors = metrics.counter("test_errors_total", "Errors", ("event",))
+    seconds = metrics.histogram("test_seconds", "Latency", ("event",), buckets=(0.1, 1.0))
+
+    async def run():
+        errors.inc(event="move")
+        seconds.observe(0.05, event="move")
+
+        unreachable = aioredis.from_url(UNREACHABLE_REDIS_URL)
+        try:
+            with pytest.raises((aioredis.ConnectionError, OSError)):
+                await MetricsExporter(unreachable, logger, metrics).flush()
+        finally:
+            await unreachable.close()
+
+        # counted while Redis was down
+        errors.inc(event="move")
+        seconds.observe(5, event="move")
+
+        redis_client = aioredis.from_url(redis_url)
+        try:
+            exporter = MetricsExporter(redis_client, logger, metrics)
+            await exporter.flush()
+            return await exporter.render()
+        finally:
+            await redis_client.close()
+
+    rendered = asyncio.run(run()).splitlines()
+
+    assert 'test_errors_total{event="move"} 2.0' in rendered
+    assert 'test_seconds_bucket{event="move",le="0.1"} 1' in rendered
+    assert 'test_seconds_bucket{event="move",le="+Inf"} 2' in rendered
+    assert 'test_seconds_sum{event="move"} 5.05' in rendered
+    assert not errors.values and not seconds.values
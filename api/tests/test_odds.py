@@ -0,0 +1,46 @@
+"""
+The odds route: odds from the precomputed table on its grid, and computed for ratings too far apart for it
+"""
+
+import asyncio
+
+import app.odds as odds
+import pytest
+from app.constants import ODDS_TABLE_DIFF
+from app.win_prob import OddsTable, best_of_n
+
+
+@pytest.fixture(scope="module", autouse=True)
+def odds_table(tmp_path_factory):
+    """Builds the table in a temporary directory (as on startup)"""
+    table = OddsTable(str(tmp_path_factory.mktemp("odds") / "odds_table.npy"))
+    table.load()
+    odds.odds_table = table
+    return table
+
+
+def get_odds(elo1, elo2, n):
+    result = asyncio.run(odds.get_odds(elo1, elo2, [n]))["odds"][n]
+    return result["win"], result["lose"], result["draw"]
+
+
+def max_err(elo1, elo2, n):
+    return max(abs(float(e) - a) for e, a in zip(best_of_n(n, elo1, elo2), get_odds(elo1, elo2, n)))
+
+
+@pytest.mark.parametrize("elo1, elo2", [(1500, 1500), (1900, 1200), (1500 + ODDS_TABLE_DIFF[1], 1500)])
+def test_odds_on_the_grid_are_interpolated(odds_table, elo1, elo2):
+    assert odds_table.covers(elo1, elo2)
+    assert max_err(elo1, elo2, 3) < 1e-3
+
+
+# ratings on the ELO_ROUNDING grid, so the cached odds are exact
+@pytest.mark.parametrize("elo1, elo2", [(2400, 800), (800, 2400), (1500 + ODDS_TABLE_DIFF[1] + 10, 1500)])
+def test_odds_off_the_grid_are_computed(odds_table, elo1, elo2):
+    assert not odds_table.covers(elo1, elo2)
+    assert max_err(elo1, elo2, 3) < 1e-6
+
+
+def test_odds_off_the_grid_are_not_clamped(odds_table):
+    clamped_lose = odds_table.odds(2400, 800, 3)[1]  # those of a 1000 point gap
+    assert get_odds(2400, 800, 3)[1] < clamped_lose / 10
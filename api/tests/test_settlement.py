@@ -0,0 +1,210 @@
+"""
+SettlementQueue and GameContract against a local development chain: batched results, replacement of a stuck batch
+and settling from receipts
+
+Needs a chain with the standard development accounts (anvil, or a hardhat node), py-solc-x to compile the contract
+and Redis (see conftest.TEST_REDIS_URL). Skipped if the chain is not running.
+
+Usage (from api/):
+    pip install -r requirements-dev.txt
+    anvil &
+    python -m pytest tests/test_settlement.py
+"""
+
+import asyncio
+import logging
+import os
+import uuid
+
+import pytest
+from web3 import AsyncWeb3, Web3
+from web3.constants import ADDRESS_ZERO
+from web3.exceptions import TransactionNotFound
+
+RPC_URL = os.environ.get("DEV_CHAIN_RPC", "http://127.0.0.1:8545")
+OWNER_PK = "0xac0974bec39a17e36ba4a6b4d238ff944bacb478cbed5efcae784d7bf4f2ff80"  # first development account
+WAGER = Web3.to_wei(1, "ether")
+COMMISSION_PERCENTAGE = 5
+
+w3 = Web3(Web3.HTTPProvider(RPC_URL))
+if not w3.is_connected():
+    pytest.skip(f"no development chain at {RPC_URL}", allow_module_level=True)
+pytest.importorskip("solcx")
+
+import aioredis  # noqa: E402
+import app.game_contract as game_contract  # noqa: E402
+import app.settlement as settlement  # noqa: E402
+import app.utils as utils  # noqa: E402
+from app.models import Settlement  # noqa: E402
+from benchmarks.bench_contract_gas import compile_contract  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+
+@pytest.fixture(scope="module")
+def contract():
+    owner = w3.eth.accounts[0]
+    if owner != w3.eth.account.from_key(OWNER_PK).address:
+        pytest.skip("the chain's first account is not the standard development account")
+    compiled = compile_contract("DechecsMatchContractV2")  # the contract app.abi describes
+    factory = w3.eth.contract(abi=compiled["abi"], bytecode=compiled["bin"])
+    receipt = w3.eth.wait_for_transaction_receipt(factory.constructor().transact({"from": owner}))
+    deployed = w3.eth.contract(address=receipt.contractAddress, abi=compiled["abi"])
+    w3.eth.send_transaction({"from": owner, "to": deployed.address, "value": 10 * WAGER})  # covers the gas fee checks
+    return deployed
+
+
+@pytest.fixture
+def make_queue(contract, redis_url, events, monkeypatch):
+    """Builds the SettlementQueue of a worker (call inside the test's event loop)"""
+    monkeypatch.setattr(game_contract, "SC_ADDRESS", contract.address)
+    monkeypatch.setattr(game_contract, "WALLET_PK", OWNER_PK)
+    monkeypatch.setattr(game_contract, "CONTRACT_BATCH_WINDOW", 0.2)
+
+    def make():
+        redis_client = aioredis.from_url(redis_url)
+        chain = game_contract.GameContract(AsyncWeb3(AsyncWeb3.AsyncHTTPProvider(RPC_URL)), redis_client, logger)
+        return settlement.SettlementQueue(redis_client, chain, events, logger)
+
+    return make
+
+
+def players():
+    return w3.eth.accounts[1], w3.eth.accounts[2]
+
+
+def new_game(contract, join=True):
+    """Create (and join) a game on-chain, returns its ID"""
+    gid = str(uuid.uuid4())
+    player1, player2 = players()
+    value = WAGER * (100 + COMMISSION_PERCENTAGE) // 100
+    w3.eth.wait_for_transaction_receipt(contract.functions.createGame(utils.gid_to_bytes(gid), WAGER).transact({"from": player1, "value": value}))
+    if join:
+        w3.eth.wait_for_transaction_receipt(contract.functions.joinGame(utils.gid_to_bytes(gid)).transact({"from": player2, "value": value}))
+    return gid
+
+
+def set_automine(enabled: bool):
+    w3.provider.make_request("evm_setAutomine", [enabled])
+
+
+async def get_job(queue, gid):
+    return {k.decode(): v.decode() for k, v in (await queue.redis_client.hgetall(utils.get_redis_settlement_key(gid))).items()}
+
+
+async def settle_due(queue):
+    """Claim due settlements and wait for the tasks settling them"""
+    await asyncio.gather(*await queue.process_due())
+
+
+async def enqueue_results(queue, results):
+    for gid, winner in results.items():
+        await queue.enqueue(gid, Settlement.WINNER if winner else Settlement.DRAW, winner)
+
+
+def test_results_are_declared_in_one_batch(contract, make_queue, events):
+    player1, player2 = players()
+    results = {new_game(contract): player1, new_game(contract): None, new_game(contract): player2}
+
+    async def run():
+        queue = make_queue()
+        await enqueue_results(queue, results)
+        await settle_due(queue)
+        return [await get_job(queue, gid) for gid in results]
+
+    jobs = asyncio.run(run())
+    assert [job["status"] for job in jobs] == ["settled"] * 3
+    assert len({job["tx_hash"] for job in jobs}) == 1  # one declareResults transaction
+
+    receipt = w3.eth.get_transaction_receipt(jobs[0]["tx_hash"])
+    declared = {log["args"]["gid"]: log["args"]["winner"] for log in contract.events.ResultDeclared().process_receipt(receipt)}
+    assert declared == {utils.gid_to_bytes(gid): winner or ADDRESS_ZERO for gid, winner in results.items()}
+    assert sorted(gid for gid, event in events.published if event.name == "settled") == sorted(results)
+
+
+def test_stuck_batch_is_replaced_whole_with_the_same_nonce(contract, make_queue, monkeypatch):
+    monkeypatch.setattr(settlement, "SETTLEMENT_RECEIPT_TIMEOUT", 1)
+    player1, _ = players()
+    results = {new_game(contract): player1, new_game(contract): None}
+
+    async def run():
+        queue = make_queue()
+        await enqueue_results(queue, results)
+        set_automine(False)
+        try:
+            await settle_due(queue)  # sent, but not mined
+            sent = [await get_job(queue, gid) for gid in results]
+            await asyncio.sleep(1)
+            await settle_due(queue)  # stuck for longer than the receipt timeout
+            await settle_due(queue)  # the other game adopts the replacement
+        finally:
+            set_automine(True)
+        w3.provider.make_request("evm_mine", [])
+        batch_key = utils.get_redis_settlement_tx_key(int(sent[0]["nonce"]))
+        batch = {k.decode(): v.decode() for k, v in (await queue.redis_client.hgetall(batch_key)).items()}
+        await settle_due(queue)
+        return sent, batch, [await get_job(queue, gid) for gid in results]
+
+    sent, batch, settled = asyncio.run(run())
+    assert len({(job["nonce"], job["tx_hashes"]) for job in sent}) == 1  # both games in one transaction
+    original, *replacements = batch["tx_hashes"].split(",")
+    assert original == sent[0]["tx_hashes"]
+    assert len(replacements) == 1  # replaced once for the whole batch, not per game
+
+    replacement = w3.eth.get_transaction(replacements[0])
+    assert replacement["nonce"] == int(sent[0]["nonce"])
+    assert replacement["gasPrice"] > int(sent[0]["gas_price"])
+    _, args = contract.decode_function_input(replacement["input"])
+    assert sorted(args["gids"]) == sorted(utils.gid_to_bytes(gid) for gid in results)
+
+    assert [job["status"] for job in settled] == ["settled"] * 2
+    assert {job["tx_hash"] for job in settled} == {replacements[0]}
+    with pytest.raises(TransactionNotFound):  # dropped for its replacement
+        w3.eth.get_transaction_receipt(original)
+
+
+def test_settled_from_the_receipt_of_a_transaction_sent_before_a_restart(contract, make_queue, monkeypatch):
+    monkeypatch.setattr(settlement, "SETTLEMENT_RECEIPT_TIMEOUT", 1)
+    player1, _ = players()
+    gid = new_game(contract)
+
+    async def run():
+        queue = make_queue()
+        await queue.enqueue(gid, Settlement.WINNER, player1)
+        set_automine(False)
+        try:
+            await settle_due(queue)  # sent, not mined before the worker goes away
+        finally:
+            set_automine(True)
+        w3.provider.make_request("evm_mine", [])
+        sent = await get_job(queue, gid)
+        nonce = w3.eth.get_transaction_count(queue.contract.acct.address)
+        await settle_due(make_queue())  # another worker picks it up
+        return sent, nonce, await get_job(queue, gid), w3.eth.get_transaction_count(queue.contract.acct.address)
+
+    sent, nonce, job, nonce_after = asyncio.run(run())
+    assert job["status"] == "settled"
+    assert job["tx_hash"] == sent["tx_hashes"]
+    assert nonce_after == nonce  # nothing was resent
+
+
+def test_game_failing_in_a_batch_is_retried_alone(contract, make_queue):
+    player1, _ = players()
+    settled_gid, unjoined_gid = new_game(contract), new_game(contract, join=False)
+
+    async def run():
+        queue = make_queue()
+        await enqueue_results(queue, {settled_gid: player1, unjoined_gid: player1})
+        await settle_due(queue)
+        return await get_job(queue, settled_gid), await get_job(queue, unjoined_gid)
+
+    settled, failed = asyncio.run(run())
+    assert settled["status"] == "settled"
+    assert failed["status"] == "pending"
+    assert failed["attempts"] == "1"
+    assert "nonce" not in failed  # the next attempt sends a new transaction
+    assert failed["tx_hashes"] == settled["tx_hash"]
+
+    receipt = w3.eth.get_transaction_receipt(settled["tx_hash"])
+    reasons = {log["args"]["gid"]: log["args"]["reason"] for log in contract.events.ResultFailed().process_receipt(receipt)}
+    assert reasons == {utils.gid_to_bytes(unjoined_gid): "Game has not started"}
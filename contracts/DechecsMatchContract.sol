@@ -22,6 +22,9 @@ contract DechecsMatchContract {
 
     mapping(string => Game) private _games;
 
+    event ResultDeclared(string gid, address winner); // winner is the zero address for a draw
+    event ResultFailed(string gid, string reason);
+
     receive() external payable {}
 
     fallback() external payable {}
@@ -184,6 +187,60 @@ contract DechecsMatchContract {
      * @param gid id of the game
      */
     function declareDraw(string calldata gid) external isOwner notPaused {
+        _declareDraw(gid);
+    }
+
+    /**
+     * @dev Declare the winner of a game
+     * @param gid id of the game
+     * @param _winner address of the winner
+     */
+    function declareWinner(
+        string calldata gid,
+        address _winner
+    ) external isOwner notPaused {
+        _declareWinner(gid, _winner);
+    }
+
+    /**
+     * @dev Declare the results of many games in one transaction. A game that cannot be settled does not revert the
+     * batch - each game emits either ResultDeclared or ResultFailed
+     * @param gids ids of the games
+     * @param winners address of the winner of each game (zero address for a draw)
+     */
+    function declareResults(
+        string[] calldata gids,
+        address[] calldata winners
+    ) external isOwner notPaused {
+        require(gids.length == winners.length, "Mismatched gids and winners");
+
+        for (uint256 i = 0; i < gids.length; i++) {
+            try this.settleGame(gids[i], winners[i]) {
+                emit ResultDeclared(gids[i], winners[i]);
+            } catch Error(string memory reason) {
+                emit ResultFailed(gids[i], reason);
+            } catch {
+                emit ResultFailed(gids[i], "");
+            }
+        }
+    }
+
+    /**
+     * @dev Settle a single game of a batch (external so a failure only reverts this game, see declareResults)
+     * @param gid id of the game
+     * @param _winner address of the winner (zero address for a draw)
+     */
+    function settleGame(string calldata gid, address _winner) external {
+        require(msg.sender == address(this), "Caller is not the contract");
+
+        if (_winner == address(0)) {
+            _declareDraw(gid);
+        } else {
+            _declareWinner(gid, _winner);
+        }
+    }
+
+    function _declareDraw(string calldata gid) private {
         Game storage game = _games[gid];
         require(game.createdAt > 0, "Game does not exist");
         require(game.player2 != address(0), "Game has not started");
@@ -200,15 +257,7 @@ contract DechecsMatchContract {
         delete _games[gid]; // free up storage
     }
 
-    /**
-     * @dev Declare the winner of a game
-     * @param gid id of the game
-     * @param _winner address of the winner
-     */
-    function declareWinner(
-        string calldata gid,
-        address _winner
-    ) external isOwner notPaused {
+    function _declareWinner(string calldata gid, address _winner) private {
         Game storage game = _games[gid];
         require(game.createdAt > 0, "Game does not exist");
         require(game.player2 != address(0), "Game has not started");
@@ -11,9 +11,9 @@ export const abi = [
   {
     inputs: [
       {
-        internalType: "string",
+        internalType: "bytes16",
         name: "gid",
-        type: "string",
+        type: "bytes16",
       },
     ],
     name: "cancelGame",
@@ -24,9 +24,9 @@ export const abi = [
   {
     inputs: [
       {
-        internalType: "string",
+        internalType: "bytes16",
         name: "gid",
-        type: "string",
+        type: "bytes16",
       },
       {
         internalType: "uint256",
@@ -42,9 +42,9 @@ export const abi = [
   {
     inputs: [
       {
-        internalType: "string",
+        internalType: "bytes16",
         name: "gid",
-        type: "string",
+        type: "bytes16",
       },
     ],
     name: "declareDraw",
@@ -55,9 +55,9 @@ export const abi = [
   {
     inputs: [
       {
-        internalType: "string",
+        internalType: "bytes16",
         name: "gid",
-        type: "string",
+        type: "bytes16",
       },
       {
         internalType: "address",
@@ -112,9 +112,9 @@ export const abi = [
   {
     inputs: [
       {
-        internalType: "string",
+        internalType: "bytes16",
         name: "gid",
-        type: "string",
+        type: "bytes16",
       },
     ],
     name: "joinGame",
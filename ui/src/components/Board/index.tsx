@@ -2,9 +2,9 @@ import cloneDeep from "lodash/cloneDeep"
 import { useEffect, useRef, useState } from "react"
 import { boardArray, initialLegalMoves, initialState } from "../../constants/board"
 import { socket } from "../../socket"
-import { BoardState, Castles, Colour, Move, Outcome, PieceInfo, PieceRef, PieceType } from "../../types"
+import { BoardState, Castles, Colour, Move, Outcome, PieceInfo, PieceRef, PieceType, ResyncData } from "../../types"
 import { getAlgebraicNotation, moveToUci, uciToMove } from "../../utils"
-import { isCastles, isEnPassant, isIllegalMove, isPromotion } from "../../utils/board"
+import { decodeLegalMoves, fenToState, isCastles, isEnPassant, isIllegalMove, isPromotion } from "../../utils/board"
 import Piece from "../Piece"
 import Square from "./Square"
 import styles from "./board.module.css"
@@ -23,6 +23,7 @@ export default function Board({ colour, turn, setTurn, setOutcome, setWinner, se
   const animating = useRef(false)
   const squareCoords = useRef<Map<string, { x: number; y: number }>>()
   const oppositeColour = useRef(colour === Colour.WHITE ? Colour.BLACK : Colour.WHITE)
+  const plyRef = useRef(0) // moves played this round, to detect a missed move event
 
   const [selectedPiece, setSelectedPiece] = useState<PieceRef>()
   const [state, setState] = useState<(PieceInfo | null)[][]>(initialState)
@@ -106,10 +107,28 @@ export default function Board({ colour, turn, setTurn, setOutcome, setWinner, se
   }
 
   useEffect(() => {
+    function processOutcome(data: BoardState) {
+      if (data.outcome) {
+        setOutcome(data.outcome)
+        setWinner(data.winner)
+        if (data.matchScore) setScore(data.matchScore)
+      }
+    }
+
     function onMove(data: BoardState) {
+      if (data.move) {
+        if (data.ply !== plyRef.current + 1) {
+          // missed a move, request the full state (which has no outcome, so the round may end here)
+          processOutcome(data)
+          socket.emit("resync")
+          return
+        }
+        plyRef.current = data.ply
+      }
+
       if (data.turn == colour && data.move) {
         // if other player just moved
-        setPrevMove(data.moveStack?.at(-1) ?? "")
+        setPrevMove(data.move)
 
         const move = uciToMove(data.move)
         const newState = cloneDeep(state)
@@ -170,18 +189,12 @@ export default function Board({ colour, turn, setTurn, setOutcome, setWinner, se
         }
 
         setSelectedPiece(undefined)
-        setLegalMoves(data.legalMoves.map((m) => uciToMove(m)))
+        setLegalMoves(data.legal ? decodeLegalMoves(data.legal) : [])
       }
 
       setTurn(data.turn)
       setIsCheck(data.isCheck)
-
-      // process outcome
-      if (data.outcome) {
-        setOutcome(data.outcome)
-        setWinner(data.winner)
-        if (data.matchScore) setScore(data.matchScore)
-      }
+      processOutcome(data)
     }
 
     socket.on("move", onMove)
@@ -191,6 +204,24 @@ export default function Board({ colour, turn, setTurn, setOutcome, setWinner, se
     }
   }, [squareCoords.current, state])
 
+  useEffect(() => {
+    function onResync(data: ResyncData) {
+      plyRef.current = data.ply
+      setState(fenToState(data.fen))
+      setPrevMove(data.moveStack.at(-1) ?? "")
+      setLegalMoves(data.turn === colour ? decodeLegalMoves(data.legal) : [])
+      setSelectedPiece(undefined)
+      setTurn(data.turn)
+      setIsCheck(data.isCheck)
+    }
+
+    socket.on("resync", onResync)
+
+    return () => {
+      socket.off("resync", onResync)
+    }
+  }, [])
+
   function handleCastles(newState: (PieceInfo | null)[][], selectedPiece: PieceRef, rank_idx: number, file_idx: number) {
     if (file_idx === 6) {
       // short castles
@@ -1,6 +1,6 @@
 import { useEffect, useRef, useState } from "react"
 import { socket } from "../../socket"
-import { Colour, Outcome, TimerData } from "../../types"
+import { Colour, Outcome, ResyncData, TimerData } from "../../types"
 import { millisecondsToTimeFormat } from "../../utils"
 import styles from "./timer.module.css"
 
@@ -27,10 +27,20 @@ export default function Timer({ side, timeControl, outcome }: Readonly<TimerProp
       setTurn((curr) => curr === Colour.WHITE ? Colour.BLACK : Colour.WHITE)
     }
 
+    // the clocks (and whose they are) of a missed move
+    const onResync = (data: ResyncData) => {
+      const timerData = { white: data.white, black: data.black }
+      setTimer(timerData)
+      timerRef.current = timerData
+      setTurn(data.turn)
+    }
+
     socket.on("clockSync", onSync)
+    socket.on("resync", onResync)
 
     return () => {
       socket.off("clockSync", onSync)
+      socket.off("resync", onResync)
     }
   }, [])
 
@@ -12,7 +12,8 @@ import { chainId, COMMISSION_PERCENTAGE, MAX_GAS, SC_ADDRESS } from "../constant
 import { termsModalContent } from "../constants/modalContent"
 import { socket } from "../socket"
 import { StartData } from "../types"
-import { parsePOL, POLtoX } from "../utils/currency"
+import { gidToBytes } from "../utils"
+import { parsePOL, POLtoFiats } from "../utils/currency"
 
 export default function Create() {
   const navigate = useNavigate()
@@ -35,9 +36,11 @@ export default function Create() {
   // eslint-disable-next-line react-hooks/exhaustive-deps
   const throttledConverter = useCallback(
     throttle((amount) => {
-      POLtoX(amount, "gbp").then((gbpAmount) => setWagerAmountGBP(gbpAmount))
-      POLtoX(amount, "usd").then((usdAmount) => setWagerAmountUSD(usdAmount))
-      POLtoX(amount, "eur").then((usdAmount) => setWagerAmountEUR(usdAmount))
+      POLtoFiats(amount).then(({ gbp, usd, eur }) => {
+        setWagerAmountGBP(gbp)
+        setWagerAmountUSD(usd)
+        setWagerAmountEUR(eur)
+      })
     }, 500),
     []
   )
@@ -54,7 +57,7 @@ export default function Create() {
           functionName: "createGame",
           value: wagerWei + commissionWei,
           gas: MAX_GAS,
-          args: [gameId, wagerWei],
+          args: [gidToBytes(gameId), wagerWei],
         })
         console.log("Transaction successful:", result)
         setNewGameId(gameId)
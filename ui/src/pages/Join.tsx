@@ -11,7 +11,8 @@ import { COMMISSION_PERCENTAGE, MAX_GAS, SC_ADDRESS, chainId } from "../constant
 import { termsModalContent } from "../constants/modalContent"
 import { socket } from "../socket"
 import { GameInfo, StartData } from "../types"
-import { POLtoX, parsePOL } from "../utils/currency"
+import { gidToBytes } from "../utils"
+import { POLtoFiats, parsePOL } from "../utils/currency"
 
 export default function Join() {
   const navigate = useNavigate()
@@ -42,9 +43,10 @@ export default function Join() {
     }
 
     async function onGameInfo(data: GameInfo) {
-      setWagerAmountUSD(await POLtoX(data.wagerAmount, "usd"))
-      setWagerAmountGBP(await POLtoX(data.wagerAmount, "gbp"))
-      setWagerAmountEUR(await POLtoX(data.wagerAmount, "eur"))
+      const { gbp, usd, eur } = await POLtoFiats(data.wagerAmount)
+      setWagerAmountUSD(usd)
+      setWagerAmountGBP(gbp)
+      setWagerAmountEUR(eur)
 
       const wagerWei = parsePOL(data.wagerAmount.toString())
       const commissionWei = (wagerWei * BigInt(COMMISSION_PERCENTAGE)) / BigInt(100)
@@ -112,7 +114,7 @@ export default function Join() {
         functionName: "joinGame",
         value: wagerPlusCommissionWei,
         gas: MAX_GAS,
-        args: [joiningGameId],
+        args: [gidToBytes(joiningGameId)],
       })
       console.log("Transaction successful:", result)
       socket.emit("acceptGame", joiningGameId, address)
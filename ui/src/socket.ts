@@ -7,3 +7,10 @@ export const socket = io(API_URL, {
   autoConnect: false,
   timeout: 2000,
 })
+
+// the server sends events produced together (e.g. move and clockSync) as one batch, [[name, data], ...]
+socket.on("batch", (events: [string, unknown][]) => {
+  for (const [name, data] of events) {
+    socket.listeners(name).forEach((listener) => listener(data))
+  }
+})
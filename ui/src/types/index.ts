@@ -53,16 +53,27 @@ export type Move = {
 }
 
 export type BoardState = {
+  ply: number // moves played this round
   turn: Colour
   winner?: Colour
   outcome?: Outcome
   matchScore?: [number, number]
   move: string
-  castles: Castles
+  castles?: Castles
   enPassant: boolean
   isCheck: boolean
-  legalMoves: string[]
-  moveStack?: string[]
+  legal?: string // encoded legal moves, see decodeLegalMoves
+}
+
+export interface ResyncData {
+  ply: number
+  fen: string
+  moveStack: string[]
+  turn: Colour
+  isCheck: boolean
+  legal: string
+  white: number
+  black: number
 }
 
 export interface StartData {
@@ -22,3 +22,48 @@ export function isIllegalMove(selectedPiece: PieceRef, fromSquare: [number, numb
     !legalMoves.some((m) => m.fromSquare[0] === fromSquare[0] && m.fromSquare[1] === fromSquare[1] && m.toSquare[0] === toSquare[0] && m.toSquare[1] === toSquare[1])
   )
 }
+
+// square index (0 = a1 ... 63 = h8) of each character of an encoded legal move list
+const SQUARE_ALPHABET = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_"
+
+/**
+ * Decodes the compact legal move list sent by the server (two characters per move: from and to square).
+ *
+ * @param {string} legal - The encoded legal moves.
+ * @returns {Move[]} The legal moves (promotions are left unset as pawns auto-promote to a queen).
+ */
+export function decodeLegalMoves(legal: string): Move[] {
+  const moves: Move[] = []
+  for (let i = 0; i + 1 < legal.length; i += 2) {
+    const from = SQUARE_ALPHABET.indexOf(legal[i])
+    const to = SQUARE_ALPHABET.indexOf(legal[i + 1])
+    moves.push({ fromSquare: [from >> 3, from & 7], toSquare: [to >> 3, to & 7], promotion: null })
+  }
+  return moves
+}
+
+/**
+ * Builds the board state from the piece placement field of a FEN string.
+ *
+ * @param {string} fen - The FEN string.
+ * @returns {(PieceInfo | null)[][]} The board state indexed by rank then file.
+ */
+export function fenToState(fen: string): (PieceInfo | null)[][] {
+  const state: (PieceInfo | null)[][] = []
+  fen
+    .split(" ")[0]
+    .split("/")
+    .reverse() // FEN starts from the 8th rank
+    .forEach((rankFen) => {
+      const rank: (PieceInfo | null)[] = []
+      for (const c of rankFen) {
+        if (c >= "1" && c <= "8") {
+          rank.push(...Array(parseInt(c)).fill(null))
+        } else {
+          rank.push({ pieceType: c.toUpperCase() as PieceType, colour: c === c.toUpperCase() ? Colour.WHITE : Colour.BLACK })
+        }
+      }
+      state.push(rank)
+    })
+  return state
+}
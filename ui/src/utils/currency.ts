@@ -2,35 +2,36 @@ import { toast } from "react-toastify"
 import { parseUnits } from "viem"
 import { API_URL } from "../constants"
 
-async function getPOLExchangeRate(fiat: string) {
+async function getPOLExchangeRates(): Promise<Record<string, number>> {
   /**
-   * Fetch the current exchange rate of POL to {fiat} from CoinMarketCap
+   * Fetch the current exchange rates of POL to all supported fiats from CoinMarketCap (via the API cache)
    *
-   * @param fiat - the target fiat currency
-   * @returns the exchange rate
+   * @returns the exchange rates by fiat (uppercase)
    */
   try {
-    const response = await fetch(`${API_URL}/exchange/${fiat}`)
+    const response = await fetch(`${API_URL}/exchange`)
     const data = await response.json()
-    return data["exchange_rate"]
+    return data["exchange_rates"]
   } catch (error) {
-    console.error("Error fetching exchange rate:", error)
-    toast.error("Error fetching exchange rate")
+    console.error("Error fetching exchange rates:", error)
+    toast.error("Error fetching exchange rates")
+    return {}
   }
 }
 
-export async function POLtoX(amountPOL: number, fiat: string) {
+export async function POLtoFiats(amountPOL: number) {
   /**
-   * Fetch the current exchange rate of POL to GBP from CoinMarketCap
+   * Convert an amount of POL to all supported fiats with a single request
    *
    * @param amountPOL - the amount in POL to convert
-   * @param fiat - the target fiat currency
-   * @returns the amount in {fiat}
+   * @returns the amounts in gbp, usd and eur
    */
-  let fiatAmount = 0
-  const exchangeRate = await getPOLExchangeRate(fiat)
-  fiatAmount = amountPOL * exchangeRate
-  return fiatAmount
+  const exchangeRates = await getPOLExchangeRates()
+  return {
+    gbp: amountPOL * (exchangeRates["GBP"] ?? 0),
+    usd: amountPOL * (exchangeRates["USD"] ?? 0),
+    eur: amountPOL * (exchangeRates["EUR"] ?? 0),
+  }
 }
 
 export function parsePOL(amount: string) {
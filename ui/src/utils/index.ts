@@ -66,3 +66,13 @@ export function millisecondsToTimeFormat(milliseconds: number) {
 
   return `${minutesString}:${secondsString}`
 }
+
+/**
+ * Converts a game ID to its smart contract key: the 16 bytes of the UUID (see api app/utils.py gid_to_bytes).
+ *
+ * @param {string} gid - The game ID (UUID string).
+ * @returns {`0x${string}`} The UUID bytes as a bytes16 hex string.
+ */
+export function gidToBytes(gid: string): `0x${string}` {
+  return `0x${gid.replace(/-/g, "").toLowerCase()}`
+}